@@ -0,0 +1,33 @@
+"""wal checkpoint
+
+Revision ID: 5c0e8d27f41b
+Revises: a3b61547422b
+Create Date: 2026-10-19 18:41:07.226093
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c0e8d27f41b"
+down_revision: Union[str, None] = "a3b61547422b"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "wal_checkpoint",
+        sa.Column("name", sa.String(), nullable=False),
+        sa.Column("segment", sa.BigInteger(), nullable=False),
+        sa.Column("position", sa.BigInteger(), nullable=False),
+        sa.Column("shipped_at", sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("wal_checkpoint")
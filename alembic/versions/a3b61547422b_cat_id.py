@@ -0,0 +1,59 @@
+"""cat id
+
+Revision ID: a3b61547422b
+Revises: e69a0f109b9c
+Create Date: 2026-10-19 14:03:21.904117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "a3b61547422b"
+down_revision: Union[str, None] = "e69a0f109b9c"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _cat_id() -> sa.Column:
+    # the rows written before belong to the default cat
+    return sa.Column(
+        "cat_id", sa.Integer(), server_default="0", nullable=False
+    )
+
+
+def upgrade() -> None:
+    op.add_column("eat_stat", _cat_id())
+    op.add_column("pet_stat", _cat_id())
+    op.add_column("user_stat_summary", _cat_id())
+    op.create_index(
+        "ix_eat_stat_cat_id_eat_at", "eat_stat", ["cat_id", "eat_at"]
+    )
+    op.create_index(
+        "ix_pet_stat_cat_id_pet_at", "pet_stat", ["cat_id", "pet_at"]
+    )
+    op.drop_constraint(
+        "user_stat_summary_pkey", "user_stat_summary", type_="primary"
+    )
+    op.create_primary_key(
+        "user_stat_summary_pkey", "user_stat_summary", ["cat_id", "user_id"]
+    )
+
+
+def downgrade() -> None:
+    # only the default cat survives
+    op.execute("DELETE FROM user_stat_summary WHERE cat_id != 0")
+    op.drop_constraint(
+        "user_stat_summary_pkey", "user_stat_summary", type_="primary"
+    )
+    op.create_primary_key(
+        "user_stat_summary_pkey", "user_stat_summary", ["user_id"]
+    )
+    op.drop_index("ix_pet_stat_cat_id_pet_at", table_name="pet_stat")
+    op.drop_index("ix_eat_stat_cat_id_eat_at", table_name="eat_stat")
+    op.drop_column("user_stat_summary", "cat_id")
+    op.drop_column("pet_stat", "cat_id")
+    op.drop_column("eat_stat", "cat_id")
@@ -0,0 +1,68 @@
+"""user stat summary
+
+Revision ID: e69a0f109b9c
+Revises: 13da4d89f1d3
+Create Date: 2026-10-19 10:12:40.518304
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e69a0f109b9c"
+down_revision: Union[str, None] = "13da4d89f1d3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# the last 64 events of the forget period, the weights of the older ones
+# are below 2^-64
+BACKFILL = """
+INSERT INTO user_stat_summary
+    (user_id, {kind}_acc, {kind}_norm, {kind}_last_at)
+SELECT user_id,
+       sum(power(0.5, n) * value::int),
+       sum(power(0.5, n)),
+       max(at)
+FROM (
+    SELECT user_id,
+           {value} AS value,
+           {kind}_at AS at,
+           row_number() OVER (
+               PARTITION BY user_id ORDER BY {kind}_at DESC, id DESC
+           ) AS n
+    FROM {kind}_stat
+    WHERE {kind}_at >= timezone('utc', now()) - interval '300 seconds'
+) AS recent
+WHERE n <= 64
+GROUP BY user_id
+ON CONFLICT (user_id) DO UPDATE SET
+    {kind}_acc = excluded.{kind}_acc,
+    {kind}_norm = excluded.{kind}_norm,
+    {kind}_last_at = excluded.{kind}_last_at
+"""
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_stat_summary",
+        sa.Column("user_id", sa.Integer(), nullable=False),
+        sa.Column("eat_acc", sa.Float(), server_default="0", nullable=False),
+        sa.Column("eat_norm", sa.Float(), server_default="0", nullable=False),
+        sa.Column("eat_last_at", sa.DateTime(), nullable=True),
+        sa.Column("pet_acc", sa.Float(), server_default="0", nullable=False),
+        sa.Column("pet_norm", sa.Float(), server_default="0", nullable=False),
+        sa.Column("pet_last_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["user_id"], ["user.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("user_id"),
+    )
+    op.execute(
+        BACKFILL.format(kind="eat", value="(is_success OR is_cat_was_fed)")
+    )
+    op.execute(BACKFILL.format(kind="pet", value="is_success"))
+
+
+def downgrade() -> None:
+    op.drop_table("user_stat_summary")
@@ -1,114 +1,448 @@
 import asyncio
-import re
+import contextlib
+import functools
+import multiprocessing
+import os
+import time
 
-from random import randint
+from collections import Counter
+from random import Random
 from datetime import datetime
+from typing import Hashable, Iterable
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from application.network.server import (
     AsyncTcpServer,
     AsyncUdpServer,
+    AsyncUnixServer,
+    AsyncUnixDatagramServer,
     AsyncTcpConnection,
     AsyncUdpConnection,
 )
+from application.network.protocol import (
+    tcp_response_messages,
+    udp_response_messages,
+    incorrect_data_message,
+    amused_message,
+    decode_text,
+    BinaryDecoder,
+    BINARY_MAGIC,
+    OP_PET,
+    OP_FEED,
+    OP_BATCH,
+    OP_DEFINE_USER,
+    OP_DEFINE_FOOD,
+    OP_SELECT_CAT,
+    RESULT_ACCEPTED,
+    RESULT_INCORRECT,
+    binary_response_messages,
+    BUSY,
+    TIMEOUT,
+    MOVED,
+    DEFAULT_CAT,
+    split_cat,
+    SUBSCRIBE_COMMAND,
+    subscribed_message,
+    encode_mood,
+    TOP_COMMAND,
+    parse_top,
+    encode_top,
+)
+from application.network.broadcast import Broadcaster
+from application.network.handoff import (
+    SocketReceiver,
+    SocketSender,
+    inherited_sockets,
+    CAT_HANDOFF_PATH,
+    CAT_LISTEN_FDS,
+    CAT_HANDOFF_TIMEOUT,
+)
 from application.utils.cruds import FoodCRUD, UserCRUD, StatCRUD
-from config.logger import logger
-from config.db import async_session_injector
+from application.utils.models import User, Food
+from application.utils.singleflight import SingleFlight
+from application.utils.scheduler import FairScheduler
+from application.utils.limits import AdmissionController
+from application.utils.lru import LRUCache
+from application.utils.registry import Registry, CAT_IDLE_EVICT
+from application.utils.ring import HashRing
+from application.utils.loop_health import LoopMonitor
+from application.utils.tracing import tracer, span, traced
+from application.utils.capture import TrafficRecorder, CAPTURE_PATH
+from application.utils.archive import Archiver
+from application.utils.loader import CatalogLoader, CAT_CATALOG_PATH
+from application.utils.snapshot import Snapshot, read_snapshot, write_snapshot
+from application.utils.summary import Summary
+from application.utils.topk import Leaderboard
+from application.utils.wal import (
+    WriteAheadLog,
+    WalShipper,
+    EAT,
+    eat_record,
+    pet_record,
+    CAT_WAL_PATH,
+)
+from config.logger import logger, add_file_sink
+from config.db import async_session_injector, warm_up
 
 
 CAT_SATIETY_PERIOD = 60
 CAT_TIME_TO_FORGET = 300
+# with lazy scales the cat recomputes satiety and pet scales only when a
+# request needs them and they are older than CAT_SCALES_STALENESS seconds
+CAT_LAZY_SCALES = os.getenv("CAT_LAZY_SCALES", "0") == "1"
+CAT_SCALES_STALENESS = float(os.getenv("CAT_SCALES_STALENESS", "1"))
+# seconds a request may spend queued and talking to the DB before it is
+# answered with a timeout, 0 turns the deadline off
+CAT_REQUEST_TIMEOUT = float(os.getenv("CAT_REQUEST_TIMEOUT", "5"))
+# users, foods and per-user histories the cat keeps in memory
+CAT_CACHE_SIZE = int(os.getenv("CAT_CACHE_SIZE", "100000"))
+# the pet scale weights halve with every pet, so older pets don't matter
+CAT_HISTORY_SIZE = 64
+# seconds a cached history is trusted, the stats other replicas write for the
+# same users show up after it
+CAT_HISTORY_TTL = float(os.getenv("CAT_HISTORY_TTL", "30"))
+# the state is saved here on stop and restored on start, "" turns it off
+CAT_SNAPSHOT_PATH = os.getenv("CAT_SNAPSHOT_PATH", "cat.snapshot")
+CAT_RECONCILE_CHUNK = 1000
+# a seed makes the cat's mood and taste reproducible, e.g. for replays
+CAT_RANDOM_SEED = os.getenv("CAT_RANDOM_SEED")
+# seconds between moves of forgotten stats to the archive, 0 turns it off,
+# see application/utils/archive.py
+CAT_ARCHIVE_INTERVAL = float(os.getenv("CAT_ARCHIVE_INTERVAL", "0"))
+# the service runs as CAT_WORKERS processes, the worker n listens on the
+# ports below plus 2 * n and hosts the cats the HashRing of the workers
+# gives it, the others are answered with MOVED
+CAT_WORKERS = int(os.getenv("CAT_WORKERS", "1"))
 
 host = "127.0.0.1"
 tcp_port = 8000
 udp_port = 8001
+# large enough for a whole binary batch frame in one read
+tcp_read_size = 1 << 16
+# optional AF_UNIX listeners for co-located clients, "@name" binds to the
+# Linux abstract namespace
+unix_stream_path = os.getenv("CAT_UNIX_STREAM_PATH")
+unix_dgram_path = os.getenv("CAT_UNIX_DGRAM_PATH")
+
+
+_epoch = datetime(1970, 1, 1)
+
+
+def _timestamp(moment: datetime) -> float:
+    # stats are stored in naive UTC
+    return (moment - _epoch).total_seconds()
+
+
+def _summary(acc: float, norm: float, last_at: datetime | None) -> Summary:
+    return Summary(acc, norm, last_at and _timestamp(last_at))
+
+
+def _release(counter: Counter, keys: list) -> list:
+    # the keys nobody holds any more
+    counter.subtract(keys)
+    released = [key for key in keys if counter[key] <= 0]
+    for key in released:
+        counter.pop(key, None)
+    return released
+
+
+async def _in_order(requests: list, key, run) -> list:
+    # the requests with the same key, one (cat, user), run one after another
+    # in the frame's order, the others concurrently
+    groups = {}
+    for i, request in enumerate(requests):
+        groups.setdefault(key(request), []).append(i)
+    results = [None] * len(requests)
+
+    async def run_group(indexes: list[int]):
+        for i in indexes:
+            results[i] = await run(requests[i])
+
+    await asyncio.gather(*(run_group(group) for group in groups.values()))
+    return results
+
 
-tcp_response_messages = {
-    False: b"Scratched by the Cat",
-    True: b"Tolerated by the Cat",
-}
+def _binary_key(request: tuple) -> Hashable:
+    opcode, args = request
+    if opcode in (OP_PET, OP_FEED):
+        return args[:2]
+    # a batch names its own users, it keeps to itself
+    return object()
 
-udp_response_messages = {
-    False: b"Ignored by the Cat",
-    True: b"Eaten by the Cat",
-}
 
+def _is_top_query(name: str) -> bool:
+    return name == TOP_COMMAND or name.startswith(f"{TOP_COMMAND} ")
 
-def get_weights(n: int) -> list[float]:
-    summ = sum([1 / (pow(2, i + 1)) for i in range(n)])
-    weights = [1 / (pow(2, i + 1)) / summ for i in range(n)]
-    return weights
+
+def worker_ports(worker: int) -> tuple[int, int]:
+    return tcp_port + 2 * worker, udp_port + 2 * worker
+
+
+def _new_cat(cat_id: int, wal: WriteAheadLog | None = None) -> "Cat":
+    if cat_id == DEFAULT_CAT:
+        return Cat(wal=wal)
+    # the other cats only wake up for requests and don't outlive a restart
+    return Cat(cat_id, lazy_scales=True, snapshot_path="", wal=wal)
+
+
+class History:
+    __slots__ = ("eat", "pet", "loaded_at")
+
+    def __init__(self, eat: Summary | None = None, pet: Summary | None = None):
+        self.eat = eat or Summary()
+        self.pet = pet or Summary()
+        self.loaded_at = time.monotonic()
 
 
 class Cat:
-    def __init__(self):
+    def __init__(
+        self,
+        cat_id: int = DEFAULT_CAT,
+        lazy_scales: bool = CAT_LAZY_SCALES,
+        scales_staleness: float = CAT_SCALES_STALENESS,
+        cache_size: int = CAT_CACHE_SIZE,
+        snapshot_path: str = CAT_SNAPSHOT_PATH,
+        seed: str | int | None = CAT_RANDOM_SEED,
+        wal: WriteAheadLog | None = None,
+    ):
+        self._cat_id = cat_id
+        # with a write-ahead log the stats are written there and shipped to
+        # the DB in the background
+        self._wal = wal
         self._satiety_period = CAT_SATIETY_PERIOD
         self._time_to_forget = CAT_TIME_TO_FORGET
         self._satiety_scale = 0.0
         self._pet_scale = 1.0
         self._started = False
+        self._lazy_scales = lazy_scales
+        self._scales_staleness = scales_staleness
+        self._scales_updated_at = None
+        self._scales_update = None
+        self._lookups = SingleFlight()
+        self._monitoring = None
+        self._random = Random(seed)
+        # successful pets and feeds in the last hour, for the /top command
+        self.leaderboard = Leaderboard()
+        # the cat writes every stat of its users itself, so once a user's
+        # history is read it is kept up to date in memory
+        self._users = LRUCache(cache_size)
+        self._foods = LRUCache(cache_size)
+        self._histories = LRUCache(cache_size)
+        self._history_ttl = CAT_HISTORY_TTL
+        # the users whose histories are being read, whose stats are being
+        # added, and the read ones that got a stat meanwhile: the read may or
+        # may not have seen it
+        self._reading = Counter()
+        self._writing = Counter()
+        self._written = set()
+        self._snapshot_path = snapshot_path
+        self._reconciling = None
+
+    def start(self):
+        if self._snapshot_path and self._reconciling is None:
+            self._restore_snapshot()
+        if not self._lazy_scales and self._monitoring is None:
+            self._monitoring = asyncio.create_task(
+                self._monitoring_self_scales()
+            )
+
+    def stop(self):
+        if self._monitoring:
+            self._monitoring.cancel()
+            self._monitoring = None
+        if self._reconciling:
+            self._reconciling.cancel()
+
+    def snapshot(self) -> Snapshot:
+        now = time.time()
+        histories = {
+            user_id: (history.eat.astuple(), history.pet.astuple())
+            for user_id, history in self._histories.items()
+            if history.eat.is_fresh(now, self._time_to_forget)
+            or history.pet.is_fresh(now, self._time_to_forget)
+        }
+        return Snapshot(
+            created_at=now,
+            satiety_scale=self._satiety_scale,
+            pet_scale=self._pet_scale,
+            users=[(user.id, name) for name, user in self._users.items()],
+            foods=[
+                (food.id, name, food.preferred_by_the_cat)
+                for name, food in self._foods.items()
+            ],
+            histories=histories,
+        )
+
+    @property
+    def cache_size(self) -> int:
+        return self._users.maxsize
+
+    def warm(self, users: Iterable[User] = (), foods: Iterable[Food] = ()):
+        for user in users:
+            self._users.put(user.name, user)
+        for food in foods:
+            self._foods.put(food.name, food)
+
+    async def save_snapshot(self):
+        if not self._snapshot_path:
+            return
+        snapshot = self.snapshot()
+        await asyncio.to_thread(write_snapshot, self._snapshot_path, snapshot)
+        logger.info(
+            f"snapshot of {len(snapshot.users)} users and "
+            f"{len(snapshot.histories)} histories saved"
+        )
+
+    def _restore_snapshot(self):
+        try:
+            snapshot = read_snapshot(self._snapshot_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"snapshot {self._snapshot_path} is ignored: {e}")
+            return
+        if snapshot is None:
+            return
+        if time.time() - snapshot.created_at < self._satiety_period:
+            self._satiety_scale = snapshot.satiety_scale
+            self._pet_scale = snapshot.pet_scale
+            self._scales_updated_at = asyncio.get_running_loop().time()
+        self._reconciling = asyncio.create_task(self._reconcile(snapshot))
+        self._reconciling.add_done_callback(self._reconciled)
+
+    async def _reconcile(self, snapshot: Snapshot):
+        # the snapshot may come from another database, so nothing of it but
+        # the scales is used before the identities are checked
+        users = await async_session_injector(UserCRUD.get_users)(
+            [name for _, name in snapshot.users]
+        )
+        foods = await async_session_injector(FoodCRUD.get_foods)(
+            [name for _, name, _ in snapshot.foods]
+        )
+        # the snapshot lists the most recently used first
+        verified_users = [
+            users[name]
+            for id, name in reversed(snapshot.users)
+            if name in users and users[name].id == id
+        ]
+        verified_foods = [
+            foods[name]
+            for id, name, preferred in reversed(snapshot.foods)
+            if name in foods
+            and (foods[name].id, foods[name].preferred_by_the_cat)
+            == (id, preferred)
+        ]
+        for user in verified_users:
+            if user.name not in self._users:
+                self._users.put(user.name, user)
+        for food in verified_foods:
+            if food.name not in self._foods:
+                self._foods.put(food.name, food)
+        verified = {user.id for user in verified_users}
+        restored = [
+            user_id
+            for user_id in reversed(snapshot.histories)
+            if user_id in verified and user_id not in self._histories
+        ]
+        for user_id in restored:
+            eat, pet = snapshot.histories[user_id]
+            self._histories.put(user_id, History(Summary(*eat), Summary(*pet)))
+        logger.info(
+            f"restored {len(verified_users)} users, {len(verified_foods)} "
+            f"foods and {len(restored)} histories from the snapshot"
+        )
+        # then the stats written while the cat was away are read back
+        await self._update_self_scales()
+        for i in range(0, len(restored), CAT_RECONCILE_CHUNK):
+            await self._load_histories(restored[i : i + CAT_RECONCILE_CHUNK])
 
-        asyncio.create_task(self._monitoring_self_scales())
+    def _reconciled(self, task: asyncio.Task):
+        self._reconciling = None
+        if not task.cancelled() and task.exception():
+            logger.warning(
+                f"snapshot reconciliation failed: {task.exception()!r}"
+            )
 
     @property
     def started(self):
         return self._started
 
+    @property
+    def cat_id(self) -> int:
+        return self._cat_id
+
     @async_session_injector
     async def _get_satiety_scale(self, session: AsyncSession) -> float:
-        results = await StatCRUD.get_eat_stat_for_the_last_period(
-            self._satiety_period, session=session
+        return await StatCRUD.get_satiety_scale(
+            self._cat_id,
+            self._satiety_period,
+            datetime.utcnow(),
+            session=session,
         )
-        if not results:
-            # logger.debug("satiety_scale: 0.0")
-            return 0.0
-        n = len(results)
-        current_time = datetime.utcnow()
-        weights = [
-            (self._satiety_period - (current_time - el.eat_at).total_seconds())
-            / self._satiety_period
-            for el in results
-        ]
-        weights = [el / sum(weights) for el in weights]
-        points = [
-            weights[i] * (results[i].is_success or results[i].is_cat_was_fed)
-            for i in range(n)
-        ]
-        scale = sum(points)
-        # logger.debug(f"satiety_scale: {scale}")
-        return scale
 
     @async_session_injector
-    async def _get_pet_scale(self, session: AsyncSession):
-        results = await StatCRUD.get_pet_stat_for_the_last_period(
-            self._time_to_forget, session=session
+    async def _get_pet_scale(self, session: AsyncSession) -> float:
+        return await StatCRUD.get_pet_scale(
+            self._cat_id,
+            self._time_to_forget,
+            CAT_HISTORY_SIZE,
+            datetime.utcnow(),
+            session=session,
         )
-        if not results:
-            # logger.debug("pet_scale: 0.0")
-            return 0.0
-        n = len(results)
-        weights = get_weights(n)
-        points = [weights[i] * results[i] for i in range(n)]
-        scale = sum(points)
-        # logger.debug(f"pet_scale: {scale}")
-        return scale
 
-    async def _monitoring_self_scales(self):
-        while True:
+    async def _update_self_scales(self):
+        try:
             self._satiety_scale = await self._get_satiety_scale()
             self._pet_scale = await self._get_pet_scale()
+        except (OSError, SQLAlchemyError) as e:
+            # the stats are logged locally, so the cat goes on with the
+            # scales it has until the DB is back
+            if self._wal is None:
+                raise
+            logger.warning(f"the scales are not updated: {e!r}")
+        self._scales_updated_at = asyncio.get_running_loop().time()
+
+    async def _monitoring_self_scales(self):
+        while True:
+            await self._update_self_scales()
             await asyncio.sleep(1)
 
+    def _scales_are_fresh(self) -> bool:
+        if self._scales_updated_at is None:
+            return False
+        age = asyncio.get_running_loop().time() - self._scales_updated_at
+        return age < self._scales_staleness
+
+    def _forget_scales_update(self, _):
+        self._scales_update = None
+
+    async def refresh_scales(self):
+        if not self._lazy_scales or self._scales_are_fresh():
+            return
+        # concurrent requests share one recomputation instead of each
+        # querying the DB
+        if self._scales_update is None:
+            self._scales_update = asyncio.ensure_future(
+                self._update_self_scales()
+            )
+            self._scales_update.add_done_callback(self._forget_scales_update)
+        await asyncio.shield(self._scales_update)
+
     @property
     def happiness_scale(self) -> float:
         scale = (
             0.5 * self._satiety_scale
             + 0.3 * self._pet_scale
-            + 0.2 * randint(1, 100) / 100
+            + 0.2 * self._random.randint(1, 100) / 100
         )
         logger.debug(f"happiness_scale: {scale}")
         return scale
 
+    @property
+    def expected_happiness_scale(self) -> float:
+        # happiness_scale without the whim, which would use up the random
+        # numbers of a seeded cat
+        return 0.5 * self._satiety_scale + 0.3 * self._pet_scale + 0.101
+
     @property
     def satiety_scale(self) -> float:
         return self._satiety_scale
@@ -117,93 +451,186 @@ class Cat:
     def pet_scale(self) -> float:
         return self._pet_scale
 
+    async def _coalesced(self, key: tuple, func, *args):
+        # a coalesced query runs in its own session, so it does not depend on
+        # which of the waiting requests started it
+        return await self._lookups.do(key, async_session_injector(func), *args)
+
+    @property
+    def lookup_stats(self) -> dict[str, int]:
+        return self._lookups.stats
+
+    @traced("predisposition queries")
     @async_session_injector
-    async def _predisposition_by_eat_scale(
-        self, username: str, session: AsyncSession
-    ) -> float:
-        results = await StatCRUD.get_eat_stat_by_username_and_period(
-            username, self._time_to_forget, session=session
-        )
-        if not results:
-            logger.debug("_predisposition_by_eat_scale: 1.0")
-            return 1.0
-        n = len(results)
-        weights = get_weights(n)
-        points = [
-            weights[i] * (results[i].is_success or results[i].is_cat_was_fed)
-            for i in range(n)
-        ]
-        scale = sum(points)
+    async def _load_histories(
+        self, user_ids: list[int], session: AsyncSession
+    ) -> dict[int, History]:
+        self._written.update(filter(self._writing.__contains__, user_ids))
+        self._reading.update(user_ids)
+        try:
+            summaries, records = await self._read_summaries(user_ids, session)
+        finally:
+            written = self._written.intersection(user_ids)
+            for user_id in _release(self._reading, user_ids):
+                self._written.discard(user_id)
+        histories = {}
+        for user_id in user_ids:
+            if (summary := summaries.get(user_id)) is None:
+                histories[user_id] = History()
+            else:
+                histories[user_id] = History(
+                    _summary(
+                        summary.eat_acc, summary.eat_norm, summary.eat_last_at
+                    ),
+                    _summary(
+                        summary.pet_acc, summary.pet_norm, summary.pet_last_at
+                    ),
+                )
+        for kind, _, user_id, _, at, is_success, fed in records:
+            history = histories[user_id]
+            if kind == EAT:
+                history.eat.add(is_success or fed, at, self._time_to_forget)
+            else:
+                history.pet.add(is_success, at, self._time_to_forget)
+        for user_id in user_ids:
+            if user_id in written:
+                # the next lookup reads it again
+                self._histories.pop(user_id)
+            else:
+                self._histories.put(user_id, histories[user_id])
+        return histories
+
+    async def _read_summaries(
+        self, user_ids: list[int], session: AsyncSession
+    ) -> tuple[dict, list[tuple]]:
+        if self._wal is None:
+            summaries = await StatCRUD.get_summaries(
+                self._cat_id, user_ids, session=session
+            )
+            return summaries, []
+        # the summaries miss the records the shipper hasn't inserted yet,
+        # they are read from the log after the shipped position. A shipping
+        # in between moves the position and the two are read again
+        position = await self._wal.shipped(session)
+        while True:
+            summaries = await StatCRUD.get_summaries(
+                self._cat_id, user_ids, session=session
+            )
+            records = await self._wal.unshipped(
+                position, self._cat_id, user_ids
+            )
+            if (shipped := await self._wal.shipped(session)) == position:
+                return summaries, records
+            position = shipped
+
+    async def _history(self, username: str) -> History:
+        if not (user := await self._does_the_cat_know_the_human(username)):
+            return History()
+        if (history := self._cached_history(user.id)) is None:
+            histories = await self._coalesced(
+                ("history", user.id), self._load_histories, [user.id]
+            )
+            history = histories[user.id]
+        return history
+
+    def _cached_history(self, user_id: int) -> History | None:
+        history = self._histories.get(user_id)
+        if (
+            history
+            and time.monotonic() - history.loaded_at > self._history_ttl
+        ):
+            return None
+        return history
+
+    def _history_scale(self, summary: Summary) -> float:
+        return summary.scale(time.time(), self._time_to_forget)
+
+    def _record_success(self, username: str, foodname: str | None = None):
+        if foodname is None:
+            self.leaderboard.record("pets", username)
+        else:
+            self.leaderboard.record("feeds", username)
+            self.leaderboard.record("foods", foodname)
+
+    @contextlib.contextmanager
+    def _adding_stats(self, user_ids: list[int]):
+        self._written.update(filter(self._reading.__contains__, user_ids))
+        self._writing.update(user_ids)
+        try:
+            yield
+        finally:
+            _release(self._writing, user_ids)
+
+    def _remember_eat(self, user_id: int, value: bool):
+        if (history := self._histories.get(user_id)) is not None:
+            history.eat.add(value, time.time(), self._time_to_forget)
+
+    def _remember_pet(self, user_id: int, value: bool):
+        if (history := self._histories.get(user_id)) is not None:
+            history.pet.add(value, time.time(), self._time_to_forget)
+
+    async def _predisposition_by_eat_scale(self, username: str) -> float:
+        scale = self._history_scale((await self._history(username)).eat)
         logger.debug(f"_predisposition_by_eat_scale: {scale}")
         return scale
 
-    @async_session_injector
-    async def _predisposition_by_pet_scale(
-        self, username: str, session: AsyncSession
-    ) -> float:
-        results = await StatCRUD.get_pet_stat_by_username_and_period(
-            username, self._time_to_forget, session=session
-        )
-        if not results:
-            logger.debug("predisposition_by_pet_scale: 1.0")
-            return 1
-        n = len(results)
-        weights = get_weights(n)
-        points = [weights[i] * results[i].is_success for i in range(n)]
-        scale = sum(points)
+    async def _predisposition_by_pet_scale(self, username: str) -> float:
+        scale = self._history_scale((await self._history(username)).pet)
         logger.debug(f"predisposition_by_pet_scale: {scale}")
         return scale
 
-    @async_session_injector
-    async def predisposition_to_eat(
-        self, username: str, session: AsyncSession
-    ) -> float:
-        scale = (
+    @traced("scoring")
+    def _predisposition_to_eat(self, by_eat: float, by_pet: float) -> float:
+        return (
             0.2 * self.happiness_scale
             + 0.5 * (1 - self._satiety_scale)
-            + 0.2
-            * await self._predisposition_by_eat_scale(
-                username, session=session
-            )
-            + 0.1
-            * await self._predisposition_by_pet_scale(
-                username, session=session
-            )
+            + 0.2 * by_eat
+            + 0.1 * by_pet
+        )
+
+    @traced("scoring")
+    def _predisposition_to_pet(self, by_eat: float, by_pet: float) -> float:
+        return 0.75 * self.happiness_scale + 0.2 * by_eat + 0.05 * by_pet
+
+    async def predisposition_to_eat(self, username: str) -> float:
+        scale = self._predisposition_to_eat(
+            await self._predisposition_by_eat_scale(username),
+            await self._predisposition_by_pet_scale(username),
         )
         logger.debug("predisposition_to_eat: {scale}")
         return scale
 
-    @async_session_injector
-    async def predisposition_to_pet(
-        self, username: str, session: AsyncSession
-    ) -> float:
-        scale = (
-            0.75 * self.happiness_scale
-            + 0.2
-            * await self._predisposition_by_eat_scale(
-                username, session=session
-            )
-            + 0.05
-            * await self._predisposition_by_pet_scale(
-                username, session=session
-            )
+    async def predisposition_to_pet(self, username: str) -> float:
+        scale = self._predisposition_to_pet(
+            await self._predisposition_by_eat_scale(username),
+            await self._predisposition_by_pet_scale(username),
         )
         logger.debug("predisposition_to_pet: {scale}")
         return scale
 
-    @async_session_injector
+    @traced("user lookup")
     async def _does_the_cat_know_the_human(
-        self, username: str, session: AsyncSession
+        self, username: str
     ) -> UserCRUD.model | None:
-        user = await UserCRUD.get_user(username, session=session)
+        if (user := self._users.get(username)) is None:
+            user = await self._coalesced(
+                ("user", username), UserCRUD.get_user, username
+            )
+            if user is not None:
+                self._users.put(username, user)
         logger.debug(f"does_the_cat_know_the_human: {user}")
         return user
 
-    @async_session_injector
+    @traced("food lookup")
     async def _does_the_cat_tried_this_food(
-        self, foodname: str, session: AsyncSession
+        self, foodname: str
     ) -> FoodCRUD.model | None:
-        food = await FoodCRUD.get_food(foodname, session=session)
+        if (food := self._foods.get(foodname)) is None:
+            food = await self._coalesced(
+                ("food", foodname), FoodCRUD.get_food, foodname
+            )
+            if food is not None:
+                self._foods.put(foodname, food)
         logger.debug(f"does_the_cat_tried_this_food: {food}")
         return food
 
@@ -217,244 +644,883 @@ class Cat:
         logger.debug(f"does_the_cat_likes_this_food: {is_preffered}")
         return is_preffered
 
+    async def _add_eat_stat(
+        self,
+        user_id: int,
+        food_id: int,
+        is_success: bool,
+        is_cat_was_fed: bool,
+        session: AsyncSession,
+    ):
+        with self._adding_stats([user_id]):
+            if self._wal:
+                await self._wal.append(
+                    [
+                        eat_record(
+                            self._cat_id,
+                            user_id,
+                            food_id,
+                            is_success,
+                            is_cat_was_fed,
+                        )
+                    ]
+                )
+            else:
+                await StatCRUD.add_eat_stat(
+                    cat_id=self._cat_id,
+                    user_id=user_id,
+                    food_id=food_id,
+                    is_success=is_success,
+                    is_cat_was_fed=is_cat_was_fed,
+                    forget_after=self._time_to_forget,
+                    session=session,
+                )
+            self._remember_eat(user_id, is_success or is_cat_was_fed)
+
+    async def _add_pet_stat(
+        self, user_id: int, is_success: bool, session: AsyncSession
+    ):
+        with self._adding_stats([user_id]):
+            if self._wal:
+                await self._wal.append(
+                    [pet_record(self._cat_id, user_id, is_success)]
+                )
+            else:
+                await StatCRUD.add_pet_stat(
+                    self._cat_id,
+                    user_id,
+                    is_success,
+                    self._time_to_forget,
+                    session=session,
+                )
+            self._remember_pet(user_id, is_success)
+
+    async def _add_stats(
+        self,
+        eat_stats: list[dict],
+        pet_stats: list[dict],
+        session: AsyncSession,
+    ):
+        user_ids = [stat["user_id"] for stat in eat_stats + pet_stats]
+        with self._adding_stats(user_ids):
+            if self._wal:
+                await self._wal.append(
+                    [
+                        eat_record(
+                            self._cat_id,
+                            stat["user_id"],
+                            stat["food_id"],
+                            stat["is_success"],
+                            stat["is_cat_was_fed"],
+                        )
+                        for stat in eat_stats
+                    ]
+                    + [
+                        pet_record(
+                            self._cat_id, stat["user_id"], stat["is_success"]
+                        )
+                        for stat in pet_stats
+                    ]
+                )
+            else:
+                await StatCRUD.add_stats(
+                    self._cat_id,
+                    eat_stats,
+                    pet_stats,
+                    forget_after=self._time_to_forget,
+                    session=session,
+                )
+            for stat in eat_stats:
+                self._remember_eat(
+                    stat["user_id"],
+                    stat["is_success"] or stat["is_cat_was_fed"],
+                )
+            for stat in pet_stats:
+                self._remember_pet(stat["user_id"], stat["is_success"])
+
+    @traced("feed")
     @async_session_injector
-    async def feed(
+    async def _feed(
         self, username: str, foodname: str, session: AsyncSession
     ) -> bool:
         self._started = True
-        if not (
-            user := await self._does_the_cat_know_the_human(
-                username, session=session
-            )
-        ):
+        await self.refresh_scales()
+        if not (user := await self._does_the_cat_know_the_human(username)):
             user = await UserCRUD.add_new_user(username, session=session)
-        if not (
-            food := await self._does_the_cat_tried_this_food(
-                foodname, session=session
-            )
-        ):
+            self._users.put(username, user)
+        if not (food := await self._does_the_cat_tried_this_food(foodname)):
             food = await FoodCRUD.add_new_food(
                 name=foodname,
-                prefered_by_the_cat=randint(0, 1),
+                prefered_by_the_cat=self._random.randint(0, 1),
                 session=session,
             )
+            self._foods.put(foodname, food)
         pre_result = food.preferred_by_the_cat
-        scale = pre_result * await self.predisposition_to_eat(
-            username, session=session
-        )
+        scale = pre_result * await self.predisposition_to_eat(username)
         is_cat_fed = self.satiety_scale > 0.75
         logger.debug(f"satiety_scale: {self.satiety_scale}")
         if scale > 0.5:
-            await StatCRUD.add_eat_stat(
-                user_id=user.id,
-                food_id=food.id,
-                is_success=True,
-                is_cat_was_fed=is_cat_fed,
-                session=session,
+            await self._add_eat_stat(
+                user.id, food.id, True, is_cat_fed, session=session
             )
+            self._record_success(username, foodname)
             logger.debug(f"fed successfully: {scale}")
             return True
-        await StatCRUD.add_eat_stat(
-            user_id=user.id,
-            food_id=food.id,
-            is_success=False,
-            is_cat_was_fed=is_cat_fed,
-            session=session,
+        await self._add_eat_stat(
+            user.id, food.id, False, is_cat_fed, session=session
         )
         logger.debug(f"fed unsuccessfully: {scale}")
         return False
 
+    @traced("pet")
     @async_session_injector
-    async def pet(self, name: str, session: AsyncSession) -> bool:
+    async def _pet(self, name: str, session: AsyncSession) -> bool:
         self._started = True
-        if not (
-            user := await self._does_the_cat_know_the_human(
-                name, session=session
-            )
-        ):
+        await self.refresh_scales()
+        if not (user := await self._does_the_cat_know_the_human(name)):
             user = await UserCRUD.add_new_user(name, session=session)
-        scale = await self.predisposition_to_pet(name, session=session)
+            self._users.put(name, user)
+        scale = await self.predisposition_to_pet(name)
         if scale > 0.5:
-            await StatCRUD.add_pet_stat(user.id, True, session=session)
+            await self._add_pet_stat(user.id, True, session=session)
+            self._record_success(name)
             logger.debug(f"pet successfully: {scale}")
             return True
-        await StatCRUD.add_pet_stat(user.id, False, session=session)
+        await self._add_pet_stat(user.id, False, session=session)
         logger.debug(f"pet unsuccessfully: {scale}")
         return False
 
+    @traced("batch")
+    @async_session_injector
+    async def _batch(
+        self, actions: list[tuple[str, str | None]], session: AsyncSession
+    ) -> list[bool]:
+        # actions are (username, foodname) for feeds and (username, None) for
+        # pets, all of them are resolved with a few set-based queries
+        self._started = True
+        await self.refresh_scales()
+        usernames = list({username for username, _ in actions})
+        foodnames = list({food for _, food in actions if food is not None})
+        users = await UserCRUD.get_or_add_users(usernames, session=session)
+        foods = await FoodCRUD.get_or_add_foods(
+            foodnames,
+            [bool(self._random.randint(0, 1)) for _ in foodnames],
+            session=session,
+        )
+        for name, user in users.items():
+            self._users.put(name, user)
+        for name, food in foods.items():
+            self._foods.put(name, food)
+        histories = {
+            user.id: self._cached_history(user.id) for user in users.values()
+        }
+        if missing := [id for id, history in histories.items() if not history]:
+            histories.update(
+                await self._load_histories(missing, session=session)
+            )
+        # the batch's own stats count for the actions after them
+        eat_history = {
+            user_id: history.eat.copy()
+            for user_id, history in histories.items()
+        }
+        pet_history = {
+            user_id: history.pet.copy()
+            for user_id, history in histories.items()
+        }
+        now = time.time()
+
+        is_cat_fed = self.satiety_scale > 0.75
+        new_eat_stats, new_pet_stats, results = [], [], []
+        for username, foodname in actions:
+            user = users[username]
+            eaten = eat_history.setdefault(user.id, Summary())
+            petted = pet_history.setdefault(user.id, Summary())
+            by_eat = eaten.scale(now, self._time_to_forget)
+            by_pet = petted.scale(now, self._time_to_forget)
+            if foodname is None:
+                is_success = self._predisposition_to_pet(by_eat, by_pet) > 0.5
+                new_pet_stats.append(
+                    {
+                        "cat_id": self._cat_id,
+                        "user_id": user.id,
+                        "is_success": is_success,
+                    }
+                )
+                petted.add(is_success, now, self._time_to_forget)
+            else:
+                food = foods[foodname]
+                scale = food.preferred_by_the_cat * (
+                    self._predisposition_to_eat(by_eat, by_pet)
+                )
+                is_success = scale > 0.5
+                new_eat_stats.append(
+                    {
+                        "cat_id": self._cat_id,
+                        "user_id": user.id,
+                        "food_id": food.id,
+                        "is_success": is_success,
+                        "is_cat_was_fed": is_cat_fed,
+                    }
+                )
+                eaten.add(is_success or is_cat_fed, now, self._time_to_forget)
+            results.append(is_success)
+
+        await self._add_stats(new_eat_stats, new_pet_stats, session=session)
+        for (username, foodname), is_success in zip(actions, results):
+            if is_success:
+                self._record_success(username, foodname)
+        logger.debug(f"batch of {len(actions)}: {sum(results)} successful")
+        return results
+
+    # A deadline is a loop time. Everything a request awaits is cancelled
+    # once it passes, the session checkout and a query in progress included,
+    # and asyncio.TimeoutError is raised.
+    async def feed(
+        self,
+        username: str,
+        foodname: str,
+        deadline: float | None = None,
+        **kwargs,
+    ) -> bool:
+        async with asyncio.timeout_at(deadline):
+            return await self._feed(username, foodname, **kwargs)
+
+    async def pet(
+        self, name: str, deadline: float | None = None, **kwargs
+    ) -> bool:
+        async with asyncio.timeout_at(deadline):
+            return await self._pet(name, **kwargs)
+
+    async def batch(
+        self,
+        actions: list[tuple[str, str | None]],
+        deadline: float | None = None,
+        **kwargs,
+    ) -> list[bool]:
+        async with asyncio.timeout_at(deadline):
+            return await self._batch(actions, **kwargs)
+
 
 class CatService:
-    def __init__(self):
-        self._cat = Cat()
-        self._tcp_server = AsyncTcpServer(host, tcp_port)
-        self._udp_server = AsyncUdpServer(host, udp_port)
+    def __init__(
+        self,
+        host: str = host,
+        tcp_port: int = tcp_port,
+        udp_port: int = udp_port,
+        unix_stream_path: str | None = unix_stream_path,
+        unix_dgram_path: str | None = unix_dgram_path,
+        scheduler: FairScheduler | None = None,
+        admission: AdmissionController | None = None,
+        request_timeout: float = CAT_REQUEST_TIMEOUT,
+        capture_path: str | None = CAPTURE_PATH,
+        archive_interval: float = CAT_ARCHIVE_INTERVAL,
+        worker: int = 0,
+        workers: int = 1,
+        idle_evict: float = CAT_IDLE_EVICT,
+        handoff_path: str | None = CAT_HANDOFF_PATH,
+        listen_fds: str | None = CAT_LISTEN_FDS,
+        wal_path: str | None = CAT_WAL_PATH,
+    ):
+        self._wal = self._shipper = None
+        if wal_path:
+            self._wal = WriteAheadLog(wal_path)
+            self._shipper = WalShipper(wal_path, CAT_TIME_TO_FORGET)
+        # the cats are created on their first request, the default one is
+        # never evicted
+        self._cats = Registry(
+            functools.partial(_new_cat, wal=self._wal),
+            Cat.stop,
+            idle_after=idle_evict,
+            pinned=(DEFAULT_CAT,),
+        )
+        self._worker = worker
+        self._ring = HashRing(range(workers))
+        self._loop_monitor = LoopMonitor()
+        self._request_timeout = request_timeout
+        self._timeouts = 0
+        self._scheduler = scheduler or FairScheduler()
+        self._admission = admission or AdmissionController()
+        self._tcp_tasks: dict[AsyncTcpConnection, asyncio.Task] = {}
+        # connections waiting for their next request
+        self._idle: set[AsyncTcpConnection] = set()
+        self._udp_pass = None
+        self._handlers = None
+        self._draining = False
+        self._broadcaster = Broadcaster()
+        # the listening sockets of a running service or of a supervisor are
+        # taken over instead of bound
+        self._receiver = None
+        sockets = {}
+        if listen_fds:
+            sockets = inherited_sockets(listen_fds)
+        elif handoff_path:
+            self._receiver = SocketReceiver(handoff_path)
+            sockets = self._receiver.take()
+        self._handoff_path = handoff_path
+        self._sender = None
+        self._handing_off = None
+        self._tcp_servers = [
+            AsyncTcpServer(
+                host, tcp_port, sockets.get(AsyncTcpServer.key(host, tcp_port))
+            )
+        ]
+        self._udp_servers = [
+            AsyncUdpServer(
+                host, udp_port, sockets.get(AsyncUdpServer.key(host, udp_port))
+            )
+        ]
+        if unix_stream_path:
+            self._tcp_servers.append(
+                AsyncUnixServer(
+                    unix_stream_path,
+                    sockets.get(AsyncUnixServer.key(unix_stream_path, 0)),
+                )
+            )
+        if unix_dgram_path:
+            self._udp_servers.append(
+                AsyncUnixDatagramServer(
+                    unix_dgram_path,
+                    sockets.get(
+                        AsyncUnixDatagramServer.key(unix_dgram_path, 0)
+                    ),
+                )
+            )
+        # forgotten stats are moved to the archive every archive_interval
+        self._archiver = None
+        self._archiving = None
+        if archive_interval:
+            self._archiver = Archiver(expire_after=CAT_TIME_TO_FORGET)
+        self._archive_interval = archive_interval
+        # opt-in capture of the inbound traffic for benchmarks/replay.py
+        self._recorder = None
+        if capture_path:
+            self._recorder = TrafficRecorder(capture_path)
+            for server in self._udp_servers:
+                server.on_datagram = self._record_datagram
 
-    async def _start_servers(self):
-        await asyncio.gather(
-            self._tcp_server.start(), self._udp_server.start()
+    def _record_datagram(self, connection: AsyncUdpConnection, data: bytes):
+        self._recorder.record(
+            "udp", f"{connection.host}:{connection.port}", data
         )
 
+    @classmethod
+    async def create(
+        cls, *args, catalog_path: str | None = CAT_CATALOG_PATH, **kwargs
+    ) -> "CatService":
+        # binds the listeners, opens the first DB connection and loads the
+        # catalog, so the service can answer as soon as start() is called
+        service = cls(*args, **kwargs)
+        await warm_up()
+        if catalog_path and service._owns(DEFAULT_CAT):
+            await CatalogLoader(service._cat).load(catalog_path)
+        return service
+
+    def _owns(self, cat_id: int) -> bool:
+        return self._ring.owner(cat_id) == self._worker
+
+    @property
+    def _cat(self) -> Cat:
+        return self._cats.get(DEFAULT_CAT)
+
+    @property
+    def _servers(self) -> list:
+        return self._tcp_servers + self._udp_servers
+
+    async def _start_servers(self):
+        await asyncio.gather(*(server.start() for server in self._servers))
+
     async def _stop_servers(self):
-        await asyncio.gather(self._tcp_server.stop(), self._udp_server.stop())
+        await asyncio.gather(*(server.stop() for server in self._servers))
 
+    @traced("response write")
     async def _tcp_response(self, connection: AsyncTcpConnection, data: bytes):
         await connection.write(data)
-        logger.debug(f"{data.decode()} -> {connection}")
+        logger.debug(f"{data.decode(errors='replace')} -> {connection}")
+
+    async def _scheduled(self, connection, func, *args, cost: int = 1):
+        # work over the limits is answered with BUSY right away instead of
+        # waiting in the queues
+        if not self._admission.admit(
+            connection.host, connection.pending, self._scheduler.waiting, cost
+        ):
+            return BUSY
+        deadline = None
+        if self._request_timeout:
+            deadline = (
+                asyncio.get_running_loop().time() + self._request_timeout
+            )
+        connection.pending += 1
+        try:
+            # work items of all clients share the scheduler's slots, weighted
+            # by the peer address, the time spent waiting for one counts
+            # against the deadline
+            with span("queue"):
+                async with asyncio.timeout_at(deadline):
+                    await self._scheduler.acquire(connection.host, cost)
+            try:
+                return await func(*args, deadline=deadline)
+            finally:
+                self._scheduler.release(connection.host)
+        except asyncio.TimeoutError:
+            self._timeouts += cost
+            return TIMEOUT
+        finally:
+            connection.pending -= 1
+
+    async def _dispatch(
+        self, connection, cat_id: int, action: str, *args, cost: int = 1
+    ):
+        if not self._owns(cat_id):
+            return MOVED
+        cat = self._cats.get(cat_id)
+        return await self._scheduled(
+            connection, getattr(cat, action), *args, cost=cost
+        )
 
+    @property
+    def _lookup_stats(self) -> dict[str, int]:
+        stats = {}
+        for cat in self._cats.values():
+            for name, value in cat.lookup_stats.items():
+                stats[name] = stats.get(name, 0) + value
+        return stats
+
+    @property
+    def counters(self) -> dict[str, dict[str, int]]:
+        return {
+            "admission": {
+                **self._admission.stats,
+                "udp_dropped": sum(
+                    server.dropped for server in self._udp_servers
+                ),
+            },
+            "scheduler": {**self._scheduler.stats, "timeouts": self._timeouts},
+            "lookups": self._lookup_stats,
+            "cats": self._cats.stats,
+            "loop": self._loop_monitor.stats,
+            "subscriptions": self._broadcaster.stats,
+            "wal": {
+                **(self._wal.stats if self._wal else {}),
+                **(self._shipper.stats if self._shipper else {}),
+            },
+        }
+
+    async def _archiving_loop(self):
+        while True:
+            await asyncio.sleep(self._archive_interval)
+            try:
+                await self._archiver.archive()
+            except Exception as e:
+                logger.warning(f"archiving failed: {e!r}")
+
+    def _top(self, cat_id: int, query: str) -> bytes:
+        # answered from the cat's in-memory sketches, the DB is not asked
+        if not self._owns(cat_id):
+            return tcp_response_messages[MOVED]
+        leaderboard = self._cats.get(cat_id).leaderboard
+        try:
+            metric, n, window = parse_top(query, leaderboard.max_window)
+            window, entries = leaderboard.top(metric, n, window)
+        except (ValueError, KeyError):
+            logger.warning(f"Incorrect query: {query}")
+            return incorrect_data_message
+        return encode_top(metric, window, entries)
+
+    async def _mood(self) -> bytes:
+        await self._cat.refresh_scales()
+        return encode_mood(
+            self._cat.expected_happiness_scale,
+            self._cat.satiety_scale,
+            self._cat.pet_scale,
+        )
+
+    def _negotiate_protocol(self, connection, received_data: bytes) -> bytes:
+        if connection.protocol is None:
+            if received_data[:1] == bytes([BINARY_MAGIC]):
+                connection.protocol = "binary"
+                connection.decoder = BinaryDecoder()
+                return received_data[1:]
+            connection.protocol = "text"
+        return received_data
+
+    async def _binary_request(self, connection, opcode: int, args) -> bytes:
+        if opcode == OP_PET:
+            cat_id, name = args
+            return binary_response_messages[
+                await self._dispatch(connection, cat_id, "pet", name)
+            ]
+        if opcode == OP_FEED:
+            cat_id, name, foodname = args
+            return binary_response_messages[
+                await self._dispatch(
+                    connection, cat_id, "feed", name, foodname
+                )
+            ]
+        if opcode == OP_BATCH:
+            cat_id, actions = args
+            results = await self._dispatch(
+                connection, cat_id, "batch", actions, cost=len(actions)
+            )
+            if results in (BUSY, TIMEOUT, MOVED):
+                results = [results] * len(actions)
+            return b"".join(binary_response_messages[r] for r in results)
+        if opcode in (OP_DEFINE_USER, OP_DEFINE_FOOD, OP_SELECT_CAT):
+            return bytes([RESULT_ACCEPTED])
+        logger.warning("Incorrect data")
+        return bytes([RESULT_INCORRECT])
+
+    async def _binary_data_processing(
+        self, connection, received_data: bytes
+    ) -> bytes:
+        with span("parse"):
+            requests = connection.decoder.feed(received_data)
+        results = await _in_order(
+            requests,
+            _binary_key,
+            lambda request: self._binary_request(connection, *request),
+        )
+        return b"".join(results)
+
+    @traced("parse")
     def _data_preprocessing(
-        self, connection, received_data: bytes, regex: str
+        self, connection, received_data: bytes
     ) -> list[str]:
-        incorrect_data = False
-        message = received_data.decode()
-        corrupted_word = connection.buffer.decode()
-        names = []
-        found = [el for el in re.findall(regex, message) if el]
-        words = [el for el in re.split(regex, message) if el]
-
-        for word in words:
-            if "@" in word or "~" in word or corrupted_word:
-                corrupted_word += word
-                if "~" not in word:
-                    break
-                elif "~" != word[-1]:
-                    logger.warning("Incorrect data")
-                    raise ValueError("Incorrect data")
-                word = re.match(regex, corrupted_word)
-                word = word.group(1) if word else None
-                if not word:
-                    incorrect_data = True
-                    corrupted_word = ""
-                    break
-                corrupted_word = ""
-            names.append(word)
-
+        try:
+            names, connection.buffer, incorrect_data = decode_text(
+                connection.buffer, received_data, tcp_read_size
+            )
+        except ValueError:
+            logger.warning("Incorrect data")
+            raise
         logger.info(f"{names=}")
-        logger.info(f"{corrupted_word=}")
-        connection.buffer = corrupted_word.encode()
+        logger.info(f"corrupted_word={connection.buffer.decode()!r}")
         if incorrect_data:
             raise ValueError("Incorrect data")
         return names
 
-    async def _tcp_data_processing(
+    async def _tcp_text_processing(
         self, connection: AsyncTcpConnection, received_data: bytes
     ) -> bytes:
         result = b""
         try:
-            names = self._data_preprocessing(
-                connection, received_data, regex="@([^@~]+)~"
-            )
+            names = self._data_preprocessing(connection, received_data)
         except ValueError:
-            return b"Incorrect data"
+            return incorrect_data_message
+
+        requests = [split_cat(name) for name in names]
+        # only the default cat's mood can be watched
+        if (DEFAULT_CAT, SUBSCRIBE_COMMAND) in requests:
+            requests = [
+                request
+                for request in requests
+                if request != (DEFAULT_CAT, SUBSCRIBE_COMMAND)
+            ]
+            if self._owns(DEFAULT_CAT):
+                self._broadcaster.subscribe(connection)
+                result += subscribed_message
+            else:
+                result += tcp_response_messages[MOVED]
+        if queries := [r for r in requests if _is_top_query(r[1])]:
+            requests = [r for r in requests if not _is_top_query(r[1])]
+            for cat_id, query in queries:
+                result += self._top(cat_id, query)
+        results = await _in_order(
+            requests,
+            lambda request: request,
+            lambda request: self._dispatch(
+                connection, request[0], "pet", request[1]
+            ),
+        )
+        for is_success in results:
+            result += tcp_response_messages[is_success]
+        return result
 
-        for name in names:
-            result += tcp_response_messages[await self._cat.pet(name)]
+    async def _tcp_data_processing(
+        self, connection: AsyncTcpConnection, received_data: bytes
+    ) -> bytes:
+        received_data = self._negotiate_protocol(connection, received_data)
+        if connection.protocol == "binary":
+            result = await self._binary_data_processing(
+                connection, received_data
+            )
+        else:
+            result = await self._tcp_text_processing(connection, received_data)
 
-        if self._cat.happiness_scale < 0.2:
+        # subscribers stay to watch the unhappy cat
+        if (
+            self._owns(DEFAULT_CAT)
+            and connection not in self._broadcaster
+            and self._cat.happiness_scale < 0.2
+        ):
             await connection.close()
 
         return result
 
-    async def _handle_tcp_requests(self):
-        logger.debug("tcp handler started")
-        while True:
-            await asyncio.sleep(0.1)
-            for connection in self._tcp_server.connections:
-                try:
-                    data = await asyncio.wait_for(
-                        connection.read(100), timeout=0.1
-                    )
-                except asyncio.TimeoutError:
-                    continue
-                except ConnectionError:
-                    # logger.debug(f"{connection} closed")
-                    continue
-                logger.debug(f"{connection} -> {data.decode()}")
+    async def _serve_tcp_connection(self, connection: AsyncTcpConnection):
+        while connection.is_opened and not self._draining:
+            self._idle.add(connection)
+            try:
+                data = await connection.read(tcp_read_size)
+            except ConnectionError:
+                # logger.debug(f"{connection} closed")
+                break
+            finally:
+                self._idle.discard(connection)
+            logger.debug(f"{connection} -> {data.decode(errors='replace')}")
+            if self._recorder:
+                self._recorder.record(
+                    "tcp", f"{connection.host}:{connection.port}", data
+                )
+            with tracer.request("tcp request", peer=repr(connection)):
                 response = await self._tcp_data_processing(connection, data)
                 try:
                     await self._tcp_response(connection, response)
                 except ConnectionError:
+                    break
+        self._broadcaster.unsubscribe(connection)
+
+    async def _handle_tcp_requests(self):
+        logger.debug("tcp handler started")
+        while True:
+            await asyncio.sleep(0.1)
+            for connection in [
+                connection
+                for server in self._tcp_servers
+                for connection in server.connections
+            ]:
+                if connection in self._tcp_tasks:
                     continue
+                # every connection is read by its own task, the scheduler
+                # decides whose work runs first
+                task = asyncio.create_task(
+                    self._serve_tcp_connection(connection)
+                )
+                self._tcp_tasks[connection] = task
+                task.add_done_callback(
+                    lambda _, c=connection: self._tcp_tasks.pop(c, None)
+                )
 
+    @traced("response write")
     async def _udp_response(self, connection: AsyncUdpConnection, data: bytes):
         await connection.write(data)
-        logger.debug(f"{data.decode()} -> {connection}")
+        logger.debug(f"{data.decode(errors='replace')} -> {connection}")
+
+    async def _udp_feed(self, connection: AsyncUdpConnection, lst) -> bytes:
+        logger.warning(lst)
+        try:
+            cat_id, name = split_cat(lst[0])
+        except IndexError:
+            logger.warning("Incorrect data")
+            return incorrect_data_message
+        try:
+            foodname = lst[1]
+        except IndexError:
+            logger.warning("Incorrect data")
+            return incorrect_data_message
+        return udp_response_messages[
+            await self._dispatch(connection, cat_id, "feed", name, foodname)
+        ]
 
     async def _udp_data_processing(
         self, connection: AsyncUdpConnection, received_data: bytes
     ) -> bytes:
+        received_data = self._negotiate_protocol(connection, received_data)
+        if connection.protocol == "binary":
+            return await self._binary_data_processing(
+                connection, received_data
+            )
+
         result = b""
         try:
-            names = self._data_preprocessing(
-                connection, received_data, regex="@([^@~]+)~"
-            )
+            names = self._data_preprocessing(connection, received_data)
         except ValueError:
-            return b"Incorrect data"
+            return incorrect_data_message
 
         lists = [list(name.split(" - ")) for name in names]
         logger.info(f"{lists=}")
 
-        for lst in lists:
-            logger.warning(lst)
-            try:
-                name = lst[0]
-            except IndexError:
-                logger.warning("Incorrect data")
-                result += b"Incorrect data"
-                continue
-            try:
-                foodname = lst[1]
-            except IndexError:
-                logger.warning("Incorrect data")
-                result += b"Incorrect data"
-                continue
-            result += udp_response_messages[
-                await self._cat.feed(name, foodname)
-            ]
+        for response in await _in_order(
+            lists,
+            lambda lst: split_cat(lst[0]),
+            lambda lst: self._udp_feed(connection, lst),
+        ):
+            result += response
 
         if connection.buffer:
-            print(connection.buffer)
-            result += f"The Cat is amused by #{connection.counter}".encode()
+            logger.debug(f"{connection} unfinished {bytes(connection.buffer)}")
+            result += amused_message + str(connection.counter).encode()
             connection.counter += 1
         else:
             connection.counter = 0
 
         return result
 
+    async def _serve_udp_connection(self, connection: AsyncUdpConnection):
+        data = connection.take_messages()
+        # logger.debug(f"{connection} -> {data.decode()}")
+        with tracer.request("udp request", peer=repr(connection)):
+            response = await self._udp_data_processing(connection, data)
+            try:
+                await self._udp_response(connection, response)
+            except ConnectionError:
+                pass
+
+    async def _serve_udp_connections(self):
+        await asyncio.gather(
+            *(
+                self._serve_udp_connection(connection)
+                for server in self._udp_servers
+                for connection in server.connections
+                if connection.message_buffer
+            )
+        )
+
     async def _handle_udp_requests(self):
         logger.debug("udp handler started")
         while True:
             await asyncio.sleep(1)
-            for connection in self._udp_server.connections:
-                if not connection.message_buffer:
-                    continue
-                data = connection.message_buffer
-                connection.message_buffer = b""
-                # logger.debug(f"{connection} -> {data.decode()}")
-                response = await self._udp_data_processing(connection, data)
-                try:
-                    await self._udp_response(connection, response)
-                except ConnectionError:
-                    continue
+            self._udp_pass = asyncio.ensure_future(
+                self._serve_udp_connections()
+            )
+            await self._udp_pass
 
-    async def _start_handlers(self):
-        await asyncio.gather(
+    def _start_handlers(self) -> asyncio.Future:
+        return asyncio.gather(
             self._handle_tcp_requests(), self._handle_udp_requests()
         )
 
+    def _listening_sockets(self) -> dict:
+        return {server.name: server.socket for server in self._servers}
+
+    async def _save_snapshot(self):
+        if (cat := self._cats.peek(DEFAULT_CAT)) is not None:
+            await cat.save_snapshot()
+
+    async def _hand_off(self):
+        # the new service gets the latest snapshot along with the sockets
+        await self._sender.hand_off(
+            self._listening_sockets, prepare=self._save_snapshot
+        )
+        logger.info("listening sockets handed off, draining")
+        for server in self._servers:
+            server.handed_off = True
+        await self.drain()
+        await self.stop()
+
+    async def drain(self, timeout: float = CAT_HANDOFF_TIMEOUT):
+        # no new work is taken in: the listeners pause, the idle connections
+        # are closed and the busy ones once their answers are written
+        self._draining = True
+        self._broadcaster.stop()
+        for server in self._servers:
+            server.pause()
+        await asyncio.gather(
+            *(connection.close() for connection in list(self._idle)),
+            return_exceptions=True,
+        )
+        busy = list(self._tcp_tasks.values())
+        if self._udp_pass:
+            busy.append(self._udp_pass)
+        if busy:
+            await asyncio.wait(busy, timeout=timeout)
+        # the datagrams read before the pause
+        await self._serve_udp_connections()
+        await asyncio.gather(
+            *(
+                connection.close()
+                for server in self._tcp_servers
+                for connection in server.connections
+                if connection.is_opened
+            ),
+            return_exceptions=True,
+        )
+
     async def start(self):
-        await asyncio.gather(self._start_servers(), self._start_handlers())
+        self._loop_monitor.start()
+        self._cats.start()
+        if self._owns(DEFAULT_CAT):
+            self._cat.start()
+            self._broadcaster.start(self._mood)
+        if self._archiver and self._archiving is None:
+            self._archiving = asyncio.create_task(self._archiving_loop())
+        if self._shipper:
+            self._shipper.start()
+        if self._receiver:
+            self._receiver.ready()
+        if self._handoff_path and self._sender is None:
+            self._sender = SocketSender(self._handoff_path)
+            self._handing_off = asyncio.create_task(self._hand_off())
+        self._handlers = self._start_handlers()
+        try:
+            await asyncio.gather(self._start_servers(), self._handlers)
+        except asyncio.CancelledError:
+            # stop() ends the handlers and start() returns
+            if asyncio.current_task().cancelling():
+                raise
 
     async def stop(self):
         logger.info("Stop CatService")
+        if self._handing_off not in (None, asyncio.current_task()):
+            self._handing_off.cancel()
+        if self._sender:
+            self._sender.close()
+        if self._handlers:
+            self._handlers.cancel()
+        self._cats.stop()
+        self._loop_monitor.stop()
+        self._broadcaster.stop()
+        if self._archiving:
+            self._archiving.cancel()
+            self._archiving = None
         await asyncio.gather(self._stop_servers())
+        if self._wal:
+            # the sealed log is shipped now or by the next start
+            await self._wal.close()
+            await self._shipper.stop()
+        tracer.close()
+        if self._recorder:
+            self._recorder.close()
+        await self._save_snapshot()
 
 
-if __name__ == "__main__":
+def _suffixed(path: str | None, worker: int) -> str | None:
+    return f"{path}.{worker}" if path and worker else path
 
-    async def main():
-        cat_service = CatService()
-        await cat_service.start()
-        logger.info("CatService was stopped")
-        # await cat_service._stop()
 
-    asyncio.run(main())
+async def _serve(worker: int = 0, workers: int = 1):
+    add_file_sink()
+    tcp, udp = worker_ports(worker)
+    cat_service = await CatService.create(
+        tcp_port=tcp,
+        udp_port=udp,
+        unix_stream_path=_suffixed(unix_stream_path, worker),
+        unix_dgram_path=_suffixed(unix_dgram_path, worker),
+        handoff_path=_suffixed(CAT_HANDOFF_PATH, worker),
+        capture_path=_suffixed(CAPTURE_PATH, worker),
+        # a single worker moves every cat's stats to the archive
+        archive_interval=CAT_ARCHIVE_INTERVAL if worker == 0 else 0,
+        worker=worker,
+        workers=workers,
+    )
+    await cat_service.start()
+    logger.info("CatService was stopped")
+
+
+def _run_worker(worker: int, workers: int):
+    asyncio.run(_serve(worker, workers))
+
+
+if __name__ == "__main__":
+    if CAT_WORKERS == 1:
+        asyncio.run(_serve())
+    else:
+        processes = [
+            multiprocessing.Process(
+                target=_run_worker, args=(worker, CAT_WORKERS)
+            )
+            for worker in range(CAT_WORKERS)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
@@ -0,0 +1,122 @@
+import asyncio
+import os
+from typing import Awaitable, Callable
+
+from application.network.server import AsyncTcpConnection
+from config.logger import logger
+
+# seconds between mood checks, a frame is sent only when the mood changed
+CAT_MOOD_INTERVAL = float(os.getenv("CAT_MOOD_INTERVAL", "1"))
+# unsent bytes a subscriber may hold before it misses updates, a subscriber
+# missing this many updates in a row is dropped
+CAT_MOOD_BUFFER = int(os.getenv("CAT_MOOD_BUFFER", "4096"))
+CAT_MOOD_MAX_SKIPPED = int(os.getenv("CAT_MOOD_MAX_SKIPPED", "30"))
+
+
+class _Subscriber:
+    __slots__ = ("frame", "skipped")
+
+    def __init__(self):
+        # the last frame written to the subscriber
+        self.frame = None
+        self.skipped = 0
+
+
+class Broadcaster:
+    # A frame is encoded once per tick and the same bytes object is handed
+    # to every subscriber's transport without awaiting a drain. The
+    # transport's write buffer is the subscriber's bounded queue: while it
+    # is over the limit the subscriber is skipped, so it gets the latest
+    # frame once it catches up instead of every frame it missed.
+    def __init__(
+        self,
+        interval: float = CAT_MOOD_INTERVAL,
+        max_buffer: int = CAT_MOOD_BUFFER,
+        max_skipped: int = CAT_MOOD_MAX_SKIPPED,
+    ):
+        self._interval = interval
+        self._max_buffer = max_buffer
+        self._max_skipped = max_skipped
+        self._subscribers: dict[AsyncTcpConnection, _Subscriber] = {}
+        self._frame = None
+        self._publishing = None
+        self._sent = 0
+        self._skipped = 0
+        self._dropped = 0
+
+    def __contains__(self, connection: AsyncTcpConnection) -> bool:
+        return connection in self._subscribers
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, connection: AsyncTcpConnection):
+        self._subscribers[connection] = _Subscriber()
+
+    def unsubscribe(self, connection: AsyncTcpConnection):
+        self._subscribers.pop(connection, None)
+
+    def publish(self, frame: bytes):
+        if frame != self._frame:
+            self._frame = frame
+        frame = self._frame
+        for connection, subscriber in list(self._subscribers.items()):
+            if subscriber.frame is not frame:
+                self._offer(connection, subscriber, frame)
+
+    def _offer(
+        self,
+        connection: AsyncTcpConnection,
+        subscriber: _Subscriber,
+        frame: bytes,
+    ):
+        if not connection.is_opened:
+            self.unsubscribe(connection)
+            return
+        if connection.write_buffer_size > self._max_buffer:
+            subscriber.skipped += 1
+            self._skipped += 1
+            if subscriber.skipped > self._max_skipped:
+                logger.debug(f"slow subscriber {connection} dropped")
+                self._dropped += 1
+                self.unsubscribe(connection)
+                connection.abort()
+            return
+        try:
+            connection.write_nowait(frame)
+        except (ConnectionError, RuntimeError):
+            self.unsubscribe(connection)
+            return
+        subscriber.frame = frame
+        subscriber.skipped = 0
+        self._sent += 1
+
+    async def _publishing_loop(self, source: Callable[[], Awaitable[bytes]]):
+        while True:
+            # nobody listens, the mood isn't even computed
+            if self._subscribers:
+                try:
+                    self.publish(await source())
+                except Exception as e:
+                    logger.warning(f"the mood is not published: {e!r}")
+            await asyncio.sleep(self._interval)
+
+    def start(self, source: Callable[[], Awaitable[bytes]]):
+        if self._publishing is None:
+            self._publishing = asyncio.create_task(
+                self._publishing_loop(source)
+            )
+
+    def stop(self):
+        if self._publishing:
+            self._publishing.cancel()
+            self._publishing = None
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "subscribers": len(self._subscribers),
+            "sent": self._sent,
+            "skipped": self._skipped,
+            "dropped": self._dropped,
+        }
@@ -2,7 +2,12 @@ import socket
 import asyncio
 from abc import ABC, abstractmethod
 
-from application.network.common import to_coroutine_function, Reader, Writer
+from application.network.common import (
+    to_coroutine_function,
+    unix_address,
+    Reader,
+    Writer,
+)
 
 
 class AsyncAbstractClient(ABC):
@@ -42,13 +47,17 @@ class AsyncTransportClient(AsyncAbstractClient):
     def __init__(self, host: str, port: int, sock: socket.socket):
         super().__init__(host, port)
         self._sock = sock
-        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self._sock.bind((self._host, self._port))
+        self._sock.setblocking(False)
+        # port 0 leaves the choice of the local port to the kernel, so one
+        # process can keep as many clients as it needs
+        if self._port:
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._sock.bind((self._host, self._port))
 
     async def open(
         self, host: str, port: int, **kwargs
     ) -> "AsyncTransportClient":
-        self._sock.connect((host, port))
+        await asyncio.get_running_loop().sock_connect(self._sock, (host, port))
         self._reader, self._writer = await asyncio.open_connection(
             sock=self._sock
         )
@@ -81,14 +90,14 @@ class AsyncTransportClient(AsyncAbstractClient):
 
 
 class AsyncTcpClient(AsyncTransportClient):
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str = "", port: int = 0):
         super().__init__(
             host, port, socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         )
 
 
 class AsyncUdpClient(AsyncTransportClient):
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str = "", port: int = 0):
         super().__init__(
             host, port, socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         )
@@ -96,12 +105,53 @@ class AsyncUdpClient(AsyncTransportClient):
     async def open(
         self, host: str, port: int, **kwargs
     ) -> "AsyncTransportClient":
+        await asyncio.get_running_loop().sock_connect(self._sock, (host, port))
+        self._reader = Reader(self._sock)
+        self._writer = Writer(self._sock)
+        return self
+
+    async def close(self, force: bool = False):
         await asyncio.sleep(0)
-        self._sock.connect((host, port))
+        self._sock.close()
+
+
+class AsyncUnixClient(AsyncTransportClient):
+    def __init__(self):
+        super().__init__(
+            "", 0, socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        )
+
+    async def open(self, path: str, **kwargs) -> "AsyncTransportClient":
+        await asyncio.get_running_loop().sock_connect(
+            self._sock, unix_address(path)
+        )
+        self._reader, self._writer = await asyncio.open_connection(
+            sock=self._sock
+        )
+        return self
+
+
+class AsyncUnixDatagramClient(AsyncTransportClient):
+    def __init__(self, path: str = ""):
+        super().__init__(
+            path, 0, socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        )
+        # the server answers to the client's name, an empty one autobinds to
+        # a unique abstract address
+        self._sock.bind(unix_address(path))
+
+    async def open(self, path: str, **kwargs) -> "AsyncTransportClient":
+        await asyncio.get_running_loop().sock_connect(
+            self._sock, unix_address(path)
+        )
         self._reader = Reader(self._sock)
         self._writer = Writer(self._sock)
         return self
 
+    async def close(self, force: bool = False):
+        await asyncio.sleep(0)
+        self._sock.close()
+
 
 if __name__ == "__main__":
 
@@ -15,17 +15,24 @@ def to_coroutine_function(func):
     return wrapper
 
 
+def unix_address(path: str) -> str:
+    # "@name" is the usual spelling of a Linux abstract namespace address
+    return "\0" + path[1:] if path.startswith("@") else path
+
+
 class Reader:
     def __init__(self, sock: socket):
         self._sock = sock
 
-    def read(self, n: int, **kwargs) -> bytes:
-        return self._sock.recv(n, **kwargs)
+    async def read(self, n: int) -> bytes:
+        loop = asyncio.get_running_loop()
+        return await loop.sock_recv(self._sock, n)
 
 
 class Writer:
     def __init__(self, sock: socket):
         self._sock = sock
 
-    def write(self, data: bytes, **kwargs):
-        self._sock.send(data, **kwargs)
+    async def write(self, data: bytes):
+        loop = asyncio.get_running_loop()
+        await loop.sock_sendall(self._sock, data)
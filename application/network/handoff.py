@@ -0,0 +1,115 @@
+import asyncio
+import json
+import os
+import socket
+
+from application.network.common import unix_address
+from application.network.server import bind_unix_socket, unlink_unix_socket
+from config.logger import logger
+
+# A restart without closing the listening sockets. The running service
+# listens on CAT_HANDOFF_PATH, a new one started with the same path connects
+# there before binding anything and gets the listening sockets with
+# SCM_RIGHTS. Once the new service serves them the old one stops accepting
+# and reading, answers the requests it has taken in, flushes the writes and
+# exits. Connections queued in the backlog and datagrams not read yet are
+# the new service's.
+CAT_HANDOFF_PATH = os.getenv("CAT_HANDOFF_PATH")
+# Sockets inherited from a supervisor instead, by server name and fd:
+#   CAT_LISTEN_FDS="tcp:127.0.0.1:8000=3,udp:127.0.0.1:8001=4"
+CAT_LISTEN_FDS = os.getenv("CAT_LISTEN_FDS")
+# seconds the old service waits for the new one and for its requests
+CAT_HANDOFF_TIMEOUT = float(os.getenv("CAT_HANDOFF_TIMEOUT", "10"))
+
+MAX_SOCKETS = 64
+_READY = b"ok"
+
+
+def inherited_sockets(spec: str) -> dict[str, socket.socket]:
+    sockets = {}
+    for item in filter(None, spec.split(",")):
+        name, fd = item.rsplit("=", 1)
+        sockets[name] = socket.socket(fileno=int(fd))
+    return sockets
+
+
+class SocketReceiver:
+    # the new service's side, used before its servers are created
+    def __init__(self, path: str, timeout: float = CAT_HANDOFF_TIMEOUT):
+        self._path = path
+        self._timeout = timeout
+        self._peer = None
+
+    def take(self) -> dict[str, socket.socket]:
+        # nothing when no service listens at the path
+        peer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        peer.settimeout(self._timeout)
+        try:
+            peer.connect(unix_address(self._path))
+            message, fds, _, _ = socket.recv_fds(peer, 1 << 16, MAX_SOCKETS)
+        except (FileNotFoundError, ConnectionRefusedError):
+            peer.close()
+            return {}
+        names = json.loads(message)
+        self._peer = peer
+        logger.info(f"took over {', '.join(names)}")
+        return {name: socket.socket(fileno=fd) for name, fd in zip(names, fds)}
+
+    def ready(self):
+        # the old service starts draining
+        if self._peer is None:
+            return
+        try:
+            self._peer.sendall(_READY)
+        except OSError as e:
+            logger.warning(f"the old service is gone: {e!r}")
+        self._peer.close()
+        self._peer = None
+
+
+class SocketSender:
+    # the running service's side
+    def __init__(self, path: str, timeout: float = CAT_HANDOFF_TIMEOUT):
+        self._path = path
+        self._timeout = timeout
+        self._sock = bind_unix_socket(path, socket.SOCK_STREAM)
+        self._sock.listen(1)
+        self._sock.setblocking(False)
+        self.handed_off = False
+
+    async def _send(self, peer, sockets: dict[str, socket.socket]) -> bool:
+        loop = asyncio.get_running_loop()
+        try:
+            socket.send_fds(
+                peer,
+                [json.dumps(list(sockets)).encode()],
+                [sock.fileno() for sock in sockets.values()],
+            )
+            ready = await asyncio.wait_for(
+                loop.sock_recv(peer, len(_READY)), self._timeout
+            )
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.warning(f"socket handoff failed: {e!r}")
+            return False
+        if ready != _READY:
+            logger.warning("the new service quit before serving")
+        return ready == _READY
+
+    async def hand_off(self, sockets, prepare=None):
+        # returns once a new service serves the sockets, sockets() gives
+        # them by server name and prepare() runs before they are sent
+        loop = asyncio.get_running_loop()
+        while True:
+            peer, _ = await loop.sock_accept(self._sock)
+            with peer:
+                if prepare:
+                    await prepare()
+                if await self._send(peer, sockets()):
+                    self.handed_off = True
+                    return
+
+    def close(self):
+        self._sock.close()
+        # the new service listens at the path by now
+        if not self.handed_off:
+            unlink_unix_socket(self._path)
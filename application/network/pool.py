@@ -0,0 +1,432 @@
+import asyncio
+from collections import deque
+
+from application.network.client import (
+    AsyncTransportClient,
+    AsyncTcpClient,
+    AsyncUdpClient,
+    AsyncUnixClient,
+    AsyncUnixDatagramClient,
+)
+from application.network.protocol import (
+    ResponseParser,
+    BinaryResponseParser,
+    encode_text_frame,
+    encode_define,
+    encode_select_cat,
+    encode_pet,
+    encode_feed,
+    encode_batch,
+    encode_batch_entry,
+    MAX_FRAME_SIZE,
+    incorrect_data_message,
+    BUSY,
+    TIMEOUT,
+    MOVED,
+    DEFAULT_CAT,
+    cat_name,
+    tcp_response_messages,
+    udp_response_messages,
+    binary_response_messages,
+    BINARY_MAGIC,
+    OP_DEFINE_USER,
+    OP_DEFINE_FOOD,
+    RESULT_INCORRECT,
+    MAX_INTERNED,
+)
+from application.utils.ring import HashRing, CAT_RING_VNODES
+from config.logger import logger
+
+
+class CatBusyError(Exception):
+    pass
+
+
+class CatTimeoutError(Exception):
+    pass
+
+
+class CatMovedError(Exception):
+    pass
+
+
+POOL_SIZE = 8
+REQUEST_TIMEOUT = 5.0
+READ_SIZE = 4096
+
+
+class PipelinedConnection:
+    def __init__(
+        self,
+        client: AsyncTransportClient,
+        parser: ResponseParser,
+        drop_on_timeout: bool = False,
+    ):
+        self._client = client
+        self._parser = parser
+        self._drop_on_timeout = drop_on_timeout
+        # a pending request is [future, answers it expects, answers so far]
+        self._pending: deque[list] = deque()
+        self._reader_task = None
+        self._is_opened = False
+        # ids of the names defined on this connection in binary mode
+        self.interned: dict[int, dict[str, int]] = {}
+        # the cat selected on this connection in binary mode
+        self.cat_id = DEFAULT_CAT
+
+    async def open(self, *address) -> "PipelinedConnection":
+        await self._client.open(*address)
+        self._is_opened = True
+        self._reader_task = asyncio.create_task(self._read_responses())
+        return self
+
+    async def close(self):
+        if not self._is_opened:
+            return
+        self._fail(ConnectionError("Connection closed"))
+        self._reader_task.cancel()
+        try:
+            await self._client.close(force=True)
+        except OSError:
+            pass
+
+    @property
+    def is_opened(self) -> bool:
+        return self._is_opened
+
+    @property
+    def pending(self) -> int:
+        return len(self._pending)
+
+    def _fail(self, exc: Exception):
+        self._is_opened = False
+        while self._pending:
+            future, _, _ = self._pending.popleft()
+            if not future.done():
+                future.set_exception(exc)
+
+    def _resolve(self, token: bytes):
+        # responses come in the order of requests, so a timed out request
+        # still owns its slot and its answer is dropped
+        future, count, tokens = self._pending[0]
+        tokens.append(token)
+        if len(tokens) < count:
+            return
+        self._pending.popleft()
+        if not future.done():
+            future.set_result(tokens)
+
+    async def _read_responses(self):
+        try:
+            while True:
+                data = await self._client.read(READ_SIZE)
+                if not data:
+                    raise ConnectionError("Connection closed")
+                for token in self._parser.feed(data):
+                    if not self._pending:
+                        logger.warning(f"unexpected response {token}")
+                        continue
+                    self._resolve(token)
+        except asyncio.CancelledError:
+            raise
+        except (OSError, ValueError) as e:
+            self._fail(ConnectionError(str(e)))
+
+    async def send(self, data: bytes):
+        try:
+            await self._client.write(data)
+        except OSError as e:
+            self._fail(ConnectionError(str(e)))
+            raise ConnectionError(str(e)) from e
+
+    async def request(self, frame: bytes, timeout: float) -> bytes:
+        return (await self.request_many(frame, 1, timeout))[0]
+
+    async def request_many(
+        self, frame: bytes, count: int, timeout: float
+    ) -> list[bytes]:
+        if not self._is_opened:
+            raise ConnectionError("Connection closed")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append([future, count, []])
+        await self.send(frame)
+        try:
+            return await asyncio.wait_for(future, timeout=timeout)
+        except asyncio.TimeoutError:
+            # a lost datagram would shift every following answer by one
+            if self._drop_on_timeout:
+                await self.close()
+            raise
+
+
+class AsyncClientPool:
+    client_class: type[AsyncTransportClient] = AsyncTransportClient
+    messages: dict[bool, bytes] = {}
+    drop_on_timeout = False
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        size: int = POOL_SIZE,
+        timeout: float = REQUEST_TIMEOUT,
+    ):
+        self._address = (host, port)
+        self._size = size
+        self._timeout = timeout
+        self._connections: list[PipelinedConnection] = []
+        self._lock = asyncio.Lock()
+        self._results = {
+            message: result for result, message in self.messages.items()
+        }
+
+    def _make_parser(self):
+        return ResponseParser(self.messages.values())
+
+    async def _open_connection(self) -> PipelinedConnection:
+        connection = PipelinedConnection(
+            self.client_class(),
+            self._make_parser(),
+            drop_on_timeout=self.drop_on_timeout,
+        )
+        return await connection.open(*self._address)
+
+    async def _acquire(self) -> PipelinedConnection:
+        async with self._lock:
+            self._connections = [
+                connection
+                for connection in self._connections
+                if connection.is_opened
+            ]
+            if len(self._connections) < self._size and all(
+                connection.pending for connection in self._connections
+            ):
+                self._connections.append(await self._open_connection())
+            return min(self._connections, key=lambda c: c.pending)
+
+    async def request(self, frame: bytes) -> bytes:
+        connection = await self._acquire()
+        return await connection.request(frame, self._timeout)
+
+    def _decode(self, token: bytes) -> bool:
+        if token in (incorrect_data_message, bytes([RESULT_INCORRECT])):
+            raise ValueError("Incorrect data")
+        if (result := self._results[token]) == BUSY:
+            raise CatBusyError("The Cat is busy")
+        if result == TIMEOUT:
+            raise CatTimeoutError("The Cat ran out of time")
+        if result == MOVED:
+            raise CatMovedError("The Cat lives with another worker")
+        return result
+
+    async def close(self):
+        await asyncio.gather(
+            *(connection.close() for connection in self._connections)
+        )
+        self._connections = []
+
+    async def __aenter__(self) -> "AsyncClientPool":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+class AsyncTcpClientPool(AsyncClientPool):
+    client_class = AsyncTcpClient
+    messages = tcp_response_messages
+
+    async def pet(self, name: str, cat_id: int = DEFAULT_CAT) -> bool:
+        return self._decode(
+            await self.request(encode_text_frame(cat_name(cat_id, name)))
+        )
+
+
+class AsyncUdpClientPool(AsyncClientPool):
+    client_class = AsyncUdpClient
+    messages = udp_response_messages
+    drop_on_timeout = True
+
+    async def feed(
+        self, name: str, foodname: str, cat_id: int = DEFAULT_CAT
+    ) -> bool:
+        return self._decode(
+            await self.request(
+                encode_text_frame(cat_name(cat_id, name), foodname)
+            )
+        )
+
+
+class AsyncBinaryClientPool(AsyncClientPool):
+    messages = binary_response_messages
+
+    def _make_parser(self):
+        return BinaryResponseParser()
+
+    async def _open_connection(self) -> PipelinedConnection:
+        connection = await super()._open_connection()
+        await connection.send(bytes([BINARY_MAGIC]))
+        return connection
+
+    def _intern(self, connection, opcode: int, name: str, requests) -> int:
+        names = connection.interned.setdefault(opcode, {})
+        if (id := names.get(name)) is None:
+            # redefined ids reach the server after every frame that used them
+            if len(names) >= MAX_INTERNED:
+                names.clear()
+            id = names[name] = len(names)
+            requests.append(
+                connection.request(
+                    encode_define(opcode, id, name), self._timeout
+                )
+            )
+        return id
+
+    def _select(self, connection, cat_id: int, requests):
+        if connection.cat_id != cat_id:
+            connection.cat_id = cat_id
+            requests.append(
+                connection.request(encode_select_cat(cat_id), self._timeout)
+            )
+
+    async def _call(self, encode, cat_id: int, *fields: str) -> bool:
+        connection = await self._acquire()
+        requests = []
+        self._select(connection, cat_id, requests)
+        ids = [
+            self._intern(connection, opcode, field, requests)
+            for opcode, field in zip((OP_DEFINE_USER, OP_DEFINE_FOOD), fields)
+        ]
+        requests.append(connection.request(encode(*ids), self._timeout))
+        results = await asyncio.gather(*requests)
+        return self._decode(results[-1])
+
+    async def pet(self, name: str, cat_id: int = DEFAULT_CAT) -> bool:
+        return await self._call(encode_pet, cat_id, name)
+
+    async def feed(
+        self, name: str, foodname: str, cat_id: int = DEFAULT_CAT
+    ) -> bool:
+        return await self._call(encode_feed, cat_id, name, foodname)
+
+    async def _batch(self, entries: list[bytes], cat_id: int) -> list[bool]:
+        connection = await self._acquire()
+        requests = []
+        self._select(connection, cat_id, requests)
+        requests.append(
+            connection.request_many(
+                encode_batch(entries), len(entries), self._timeout
+            )
+        )
+        tokens = (await asyncio.gather(*requests))[-1]
+        return [self._decode(token) for token in tokens]
+
+    async def batch(
+        self,
+        actions: list[tuple[str, str | None]],
+        cat_id: int = DEFAULT_CAT,
+    ) -> list[bool]:
+        # (username, foodname) feeds and (username, None) pets, split into
+        # as few frames as fit
+        frames, entries, size = [], [], 0
+        for username, foodname in actions:
+            if not username or foodname == "":
+                raise ValueError("Names can't be empty")
+            entry = encode_batch_entry(username, foodname)
+            if entries and size + len(entry) >= MAX_FRAME_SIZE:
+                frames.append(entries)
+                entries, size = [], 0
+            entries.append(entry)
+            size += len(entry)
+        if entries:
+            frames.append(entries)
+        results = await asyncio.gather(
+            *(self._batch(entries, cat_id) for entries in frames)
+        )
+        return [result for frame in results for result in frame]
+
+
+class AsyncBinaryTcpClientPool(AsyncBinaryClientPool):
+    client_class = AsyncTcpClient
+
+
+class AsyncBinaryUdpClientPool(AsyncBinaryClientPool):
+    client_class = AsyncUdpClient
+    drop_on_timeout = True
+
+
+class AsyncUnixClientPool(AsyncTcpClientPool):
+    client_class = AsyncUnixClient
+
+    def __init__(
+        self,
+        path: str,
+        size: int = POOL_SIZE,
+        timeout: float = REQUEST_TIMEOUT,
+    ):
+        super().__init__(path, 0, size=size, timeout=timeout)
+        self._address = (path,)
+
+
+class AsyncUnixDatagramClientPool(AsyncUdpClientPool):
+    client_class = AsyncUnixDatagramClient
+
+    def __init__(
+        self,
+        path: str,
+        size: int = POOL_SIZE,
+        timeout: float = REQUEST_TIMEOUT,
+    ):
+        super().__init__(path, 0, size=size, timeout=timeout)
+        self._address = (path,)
+
+
+class ShardedClientPool:
+    # One pool per worker of a sharded service, in the order of the workers.
+    # A cat's requests go to the worker the HashRing gives it, the same
+    # ring the workers use.
+    def __init__(
+        self, pools: list[AsyncClientPool], vnodes: int = CAT_RING_VNODES
+    ):
+        self._pools = pools
+        self._ring = HashRing(range(len(pools)), vnodes)
+
+    def pool(self, cat_id: int) -> AsyncClientPool:
+        return self._pools[self._ring.owner(cat_id)]
+
+    async def pet(self, name: str, cat_id: int = DEFAULT_CAT) -> bool:
+        return await self.pool(cat_id).pet(name, cat_id=cat_id)
+
+    async def feed(
+        self, name: str, foodname: str, cat_id: int = DEFAULT_CAT
+    ) -> bool:
+        return await self.pool(cat_id).feed(name, foodname, cat_id=cat_id)
+
+    async def batch(
+        self,
+        actions: list[tuple[str, str | None]],
+        cat_id: int = DEFAULT_CAT,
+    ) -> list[bool]:
+        return await self.pool(cat_id).batch(actions, cat_id=cat_id)
+
+    async def close(self):
+        await asyncio.gather(*(pool.close() for pool in self._pools))
+
+    async def __aenter__(self) -> "ShardedClientPool":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+if __name__ == "__main__":
+
+    async def main():
+        async with AsyncTcpClientPool("127.0.0.1", 8000) as pool:
+            results = await asyncio.gather(
+                *(pool.pet(f"user{i % 10}") for i in range(100)),
+                return_exceptions=True,
+            )
+            logger.info(results)
+
+    asyncio.run(main())
@@ -0,0 +1,364 @@
+import json
+import re
+import struct
+
+
+# answer to requests shed by admission control
+BUSY = "busy"
+# answer to requests that ran out of their time budget
+TIMEOUT = "timeout"
+# answer to requests for a cat hosted by another worker
+MOVED = "moved"
+
+tcp_response_messages = {
+    False: b"Scratched by the Cat",
+    True: b"Tolerated by the Cat",
+    BUSY: b"Hissed at by the busy Cat",
+    TIMEOUT: b"Yawned at by the Cat",
+    MOVED: b"Shooed to another Cat's home",
+}
+
+udp_response_messages = {
+    False: b"Ignored by the Cat",
+    True: b"Eaten by the Cat",
+    BUSY: b"Left for later by the busy Cat",
+    TIMEOUT: b"Sniffed at by the Cat",
+    MOVED: b"Carried to another Cat's home",
+}
+
+incorrect_data_message = b"Incorrect data"
+amused_message = b"The Cat is amused by #"
+
+
+def encode_text_frame(*fields: str) -> bytes:
+    for field in fields:
+        if not field or "@" in field or "~" in field or " - " in field:
+            raise ValueError(f"Field can't be sent: {field!r}")
+    return f"@{' - '.join(fields)}~".encode()
+
+
+TEXT_FRAME = "@([^@~]+)~"
+
+
+def decode_text(
+    buffer: bytes, data: bytes, max_buffer: int, regex: str = TEXT_FRAME
+) -> tuple[list[str], bytes, bool]:
+    # the names of the frames completed by data, the start of a frame split
+    # over reads to keep in the buffer and whether some frame was incorrect
+    incorrect_data = False
+    message = data.decode()
+    corrupted_word = buffer.decode()
+    names = []
+    words = [el for el in re.split(regex, message) if el]
+
+    for word in words:
+        if "@" in word or "~" in word or corrupted_word:
+            corrupted_word += word
+            if "~" not in word:
+                break
+            elif "~" != word[-1]:
+                raise ValueError("Incorrect data")
+            word = re.match(regex, corrupted_word)
+            word = word.group(1) if word else None
+            if not word:
+                incorrect_data = True
+                corrupted_word = ""
+                break
+            corrupted_word = ""
+        names.append(word)
+
+    # a name that never ends must not grow the buffer forever
+    if len(corrupted_word) > max_buffer:
+        corrupted_word = ""
+        incorrect_data = True
+    return names, corrupted_word.encode(), incorrect_data
+
+
+# Text requests go to the default cat, a "<cat id>:" prefix sends them to
+# another one: "@7:alice~", "@7:alice - fish~" and "@7:/top pets 3~" are
+# for the cat 7. The prefix is taken from any name that starts with digits
+# and a colon.
+DEFAULT_CAT = 0
+_cat_prefix = re.compile(r"^(\d+):(.+)$", re.DOTALL)
+
+
+def split_cat(name: str) -> tuple[int, str]:
+    if (match := _cat_prefix.match(name)) is None:
+        return DEFAULT_CAT, name
+    return int(match.group(1)), match.group(2)
+
+
+def cat_name(cat_id: int, name: str) -> str:
+    return name if cat_id == DEFAULT_CAT else f"{cat_id}:{name}"
+
+
+# "@/subscribe~" turns a TCP text connection into a subscription to the cat's
+# mood, it is acknowledged with subscribed_message and then receives a mood
+# frame "@mood - <happiness> - <satiety> - <pet>~" whenever the mood changes
+SUBSCRIBE_COMMAND = "/subscribe"
+subscribed_message = b"Watched by the Cat"
+
+
+def encode_mood(happiness: float, satiety: float, pet: float) -> bytes:
+    return encode_text_frame(
+        "mood", f"{happiness:.3f}", f"{satiety:.3f}", f"{pet:.3f}"
+    )
+
+
+class MoodParser:
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> list[tuple[float, float, float]]:
+        self._buffer += data
+        moods = []
+        while (end := self._buffer.find(b"~")) != -1:
+            frame = self._buffer[:end].decode()
+            del self._buffer[: end + 1]
+            # the acknowledgement and any answers are not mood frames
+            if "@mood - " not in frame:
+                continue
+            fields = frame[frame.index("@mood - ") :].split(" - ")[1:]
+            moods.append(tuple(float(field) for field in fields))
+        return moods
+
+
+# "@/top <metric> <n> [window]~" asks for the n users or foods that lead a
+# metric of the Leaderboard in the last window seconds ("30m" and "1h" work
+# too). The answer is "@top - <metric> - <window> - <entries>~", the entries
+# are a JSON list of [name, count, error] with the true count in
+# [count - error, count], and the window is the one actually covered.
+TOP_COMMAND = "/top"
+
+
+def parse_top(command: str, max_window: float) -> tuple[str, int, float]:
+    _, metric, n, *window = command.split()
+    window = window[0] if window else f"{max_window:g}"
+    scale = {"s": 1, "m": 60, "h": 3600}.get(window[-1])
+    seconds = float(window[:-1]) * scale if scale else float(window)
+    if int(n) <= 0 or not 0 < seconds <= max_window:
+        raise ValueError(f"Incorrect query: {command}")
+    return metric, int(n), seconds
+
+
+def encode_top(metric: str, window: float, entries: list[tuple]) -> bytes:
+    # names can't hold "@" or "~", so the JSON can't either
+    entries = json.dumps([list(entry) for entry in entries])
+    return f"@top - {metric} - {window:g} - {entries}~".encode()
+
+
+def decode_top(frame: bytes) -> tuple[str, float, list[tuple[str, int, int]]]:
+    # the frame ends at the first "~", answers may follow it
+    frame = frame[frame.index(b"@top") + 1 : frame.index(b"~")]
+    _, metric, window, entries = frame.decode().split(" - ", 3)
+    return metric, float(window), [tuple(e) for e in json.loads(entries)]
+
+
+# Text responses have no delimiters, so the stream is split by the known
+# messages. "The Cat is amused" is not an answer to a request and is skipped.
+class ResponseParser:
+    def __init__(self, messages):
+        self._messages = tuple(messages) + (incorrect_data_message,)
+        self._buffer = bytearray()
+
+    def _skip_amused(self) -> bool:
+        if not self._buffer.startswith(amused_message):
+            return False
+        end = len(amused_message)
+        while (
+            end < len(self._buffer) and self._buffer[end : end + 1].isdigit()
+        ):
+            end += 1
+        del self._buffer[:end]
+        return True
+
+    def feed(self, data: bytes) -> list[bytes]:
+        self._buffer += data
+        tokens = []
+        while self._buffer:
+            if self._skip_amused():
+                continue
+            for message in self._messages:
+                if self._buffer.startswith(message):
+                    tokens.append(message)
+                    del self._buffer[: len(message)]
+                    break
+            else:
+                if any(
+                    message.startswith(self._buffer)
+                    for message in self._messages + (amused_message,)
+                ):
+                    break
+                raise ValueError(f"Unexpected response: {bytes(self._buffer)}")
+        return tokens
+
+
+# Binary mode is selected by BINARY_MAGIC as the very first byte a peer
+# sends. Every request is a frame of a big-endian u16 length followed by
+# an opcode byte and its payload, every answer is a single result byte.
+# Users and foods are referred to by ids the client defines per connection,
+# the cat is the one last selected on the connection, the default cat until
+# then.
+BINARY_MAGIC = 0xCA
+
+OP_PET = 0x01
+OP_FEED = 0x02
+# a batch carries many pets and feeds by name, it is answered with one
+# result byte per action
+OP_BATCH = 0x03
+OP_DEFINE_USER = 0x10
+OP_DEFINE_FOOD = 0x11
+OP_SELECT_CAT = 0x12
+# never sent, marks a frame the decoder could not make sense of
+OP_INCORRECT = 0xFF
+
+RESULT_REFUSED = 0x00
+RESULT_ACCEPTED = 0x01
+RESULT_BUSY = 0x02
+RESULT_TIMEOUT = 0x03
+RESULT_MOVED = 0x04
+RESULT_INCORRECT = 0xFF
+
+binary_response_messages = {
+    False: bytes([RESULT_REFUSED]),
+    True: bytes([RESULT_ACCEPTED]),
+    BUSY: bytes([RESULT_BUSY]),
+    TIMEOUT: bytes([RESULT_TIMEOUT]),
+    MOVED: bytes([RESULT_MOVED]),
+}
+
+MAX_INTERNED = 1 << 16
+
+_frame_header = struct.Struct(">H")
+_id = struct.Struct(">I")
+_ids = struct.Struct(">II")
+_batch_entry = struct.Struct(">BH")
+_name_length = struct.Struct(">H")
+MAX_FRAME_SIZE = (1 << 16) - 1
+
+
+def encode_binary_frame(opcode: int, payload: bytes = b"") -> bytes:
+    return _frame_header.pack(len(payload) + 1) + bytes([opcode]) + payload
+
+
+def encode_pet(user_id: int) -> bytes:
+    return encode_binary_frame(OP_PET, _id.pack(user_id))
+
+
+def encode_feed(user_id: int, food_id: int) -> bytes:
+    return encode_binary_frame(OP_FEED, _ids.pack(user_id, food_id))
+
+
+def encode_select_cat(cat_id: int) -> bytes:
+    return encode_binary_frame(OP_SELECT_CAT, _id.pack(cat_id))
+
+
+def encode_define(opcode: int, id: int, name: str) -> bytes:
+    return encode_binary_frame(opcode, _id.pack(id) + name.encode())
+
+
+def encode_batch_entry(username: str, foodname: str | None) -> bytes:
+    username = username.encode()
+    if foodname is None:
+        return _batch_entry.pack(OP_PET, len(username)) + username
+    foodname = foodname.encode()
+    return (
+        _batch_entry.pack(OP_FEED, len(username))
+        + username
+        + _name_length.pack(len(foodname))
+        + foodname
+    )
+
+
+def encode_batch(entries: list[bytes]) -> bytes:
+    payload = b"".join(entries)
+    if len(payload) >= MAX_FRAME_SIZE:
+        raise ValueError("Batch doesn't fit in a frame")
+    return encode_binary_frame(OP_BATCH, payload)
+
+
+def decode_batch(payload: bytes) -> list[tuple[str, str | None]]:
+    actions = []
+    offset = 0
+    while offset < len(payload):
+        kind, length = _batch_entry.unpack_from(payload, offset)
+        offset += _batch_entry.size
+        username = payload[offset : offset + length].decode()
+        offset += length
+        foodname = None
+        if kind == OP_FEED:
+            (length,) = _name_length.unpack_from(payload, offset)
+            offset += _name_length.size
+            foodname = payload[offset : offset + length].decode()
+            offset += length
+        elif kind != OP_PET:
+            raise ValueError("Incorrect data")
+        if not username or foodname == "" or offset > len(payload):
+            raise ValueError("Incorrect data")
+        actions.append((username, foodname))
+    return actions
+
+
+class BinaryDecoder:
+    # pets, feeds and batches are decoded as (cat_id, *args)
+    def __init__(self):
+        self._buffer = bytearray()
+        self._names = {OP_DEFINE_USER: {}, OP_DEFINE_FOOD: {}}
+        self.cat_id = DEFAULT_CAT
+
+    def _define(self, opcode: int, payload: bytes) -> tuple[int, tuple]:
+        names = self._names[opcode]
+        if len(payload) <= _id.size:
+            raise ValueError("Incorrect data")
+        (id,) = _id.unpack_from(payload)
+        if id not in names and len(names) >= MAX_INTERNED:
+            raise ValueError("Too many names")
+        names[id] = payload[_id.size :].decode()
+        return opcode, ()
+
+    def _decode(self, opcode: int, payload: bytes) -> tuple[int, tuple]:
+        if opcode in self._names:
+            return self._define(opcode, payload)
+        if opcode == OP_SELECT_CAT and len(payload) == _id.size:
+            (self.cat_id,) = _id.unpack(payload)
+            return opcode, ()
+        users = self._names[OP_DEFINE_USER]
+        if opcode == OP_PET and len(payload) == _id.size:
+            return opcode, (self.cat_id, users[_id.unpack(payload)[0]])
+        if opcode == OP_FEED and len(payload) == _ids.size:
+            user_id, food_id = _ids.unpack(payload)
+            return opcode, (
+                self.cat_id,
+                users[user_id],
+                self._names[OP_DEFINE_FOOD][food_id],
+            )
+        if opcode == OP_BATCH and payload:
+            return opcode, (self.cat_id, decode_batch(payload))
+        raise ValueError("Incorrect data")
+
+    def feed(self, data: bytes) -> list[tuple[int, tuple]]:
+        self._buffer += data
+        requests = []
+        offset = 0
+        while len(self._buffer) - offset >= _frame_header.size:
+            (length,) = _frame_header.unpack_from(self._buffer, offset)
+            start = offset + _frame_header.size
+            if len(self._buffer) - start < length:
+                break
+            if not length:
+                requests.append((OP_INCORRECT, ()))
+            else:
+                opcode = self._buffer[start]
+                payload = bytes(self._buffer[start + 1 : start + length])
+                try:
+                    requests.append(self._decode(opcode, payload))
+                except (KeyError, ValueError, struct.error):
+                    requests.append((OP_INCORRECT, ()))
+            offset = start + length
+        del self._buffer[:offset]
+        return requests
+
+
+class BinaryResponseParser:
+    def feed(self, data: bytes) -> list[bytes]:
+        return [data[i : i + 1] for i in range(len(data))]
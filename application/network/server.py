@@ -1,18 +1,42 @@
+import os
 import socket
+import struct
 import asyncio
 from abc import ABC, abstractmethod
 
-from application.network.common import to_coroutine_function
+from application.network.common import to_coroutine_function, unix_address
 from config.logger import logger
 
 
 class AsyncAbstractServer(ABC):
+    # names the listening socket when it is handed to another process
+    kind = ""
+
     def __init__(self, host: str, port: int):
         self._host = host
         self._port = port
         self._sock = None
         self._server = None
         self._connections = []
+        # the socket went to another process, whose files are left alone
+        self.handed_off = False
+
+    @classmethod
+    def key(cls, host: str, port: int) -> str:
+        return f"{cls.kind}:{host}:{port}"
+
+    @property
+    def name(self) -> str:
+        return self.key(self._host, self._port)
+
+    @property
+    def socket(self) -> socket.socket:
+        return self._sock
+
+    @abstractmethod
+    def pause(self):
+        # stops taking new work, the socket stays open for another process
+        ...
 
     @abstractmethod
     async def start(self):
@@ -23,21 +47,45 @@ class AsyncAbstractServer(ABC):
         ...
 
 
+# A server may hold a connection object for every peer it has ever heard
+# from, so connections have no __dict__ and allocate buffers only while
+# they hold unprocessed data.
 class AsyncAbstractConnection(ABC):
+    __slots__ = (
+        "_host",
+        "_port",
+        "_reader",
+        "_writer",
+        "_buffer",
+        "protocol",
+        "decoder",
+        "pending",
+    )
+
     def __init__(self, host: str, port: int):
         self._host = host
         self._port = port
         self._reader = None
         self._writer = None
-        self._buffer = b""
+        self._buffer = None
+        # "text" or "binary", decided by the first byte the peer sends
+        self.protocol = None
+        self.decoder = None
+        # work items admitted for this connection and not answered yet
+        self.pending = 0
 
     @property
     def buffer(self) -> bytes:
-        return self._buffer
+        return self._buffer or b""
 
     @buffer.setter
     def buffer(self, value: bytes):
-        self._buffer = value
+        if not value:
+            self._buffer = None
+        elif self._buffer is None:
+            self._buffer = bytearray(value)
+        else:
+            self._buffer[:] = value
 
     @abstractmethod
     async def close(self, *args, **kwargs):
@@ -64,6 +112,8 @@ class AsyncAbstractConnection(ABC):
 
 
 class AsyncTcpConnection(AsyncAbstractConnection):
+    __slots__ = ("_is_opened",)
+
     def __init__(
         self,
         host: str,
@@ -111,16 +161,48 @@ class AsyncTcpConnection(AsyncAbstractConnection):
     def is_opened(self):
         return self._is_opened
 
+    @property
+    def write_buffer_size(self) -> int:
+        return self._writer.transport.get_write_buffer_size()
+
+    def write_nowait(self, data: bytes):
+        # buffered by the transport, the caller checks write_buffer_size
+        if self._writer.transport.is_closing():
+            self._is_opened = False
+            raise ConnectionError("Connection closed")
+        self._writer.write(data)
+
+    def abort(self):
+        self._writer.transport.abort()
+        self._is_opened = False
+
+
+def bind_unix_socket(path: str, type: int) -> socket.socket:
+    address = unix_address(path)
+    if not address.startswith("\0") and os.path.exists(address):
+        os.unlink(address)
+    sock = socket.socket(socket.AF_UNIX, type)
+    sock.bind(address)
+    return sock
+
+
+def unlink_unix_socket(path: str):
+    address = unix_address(path)
+    if not address.startswith("\0") and os.path.exists(address):
+        os.unlink(address)
+
 
 class AsyncTcpServer(AsyncAbstractServer):
-    def __init__(self, host: str, port: int):
+    kind = "tcp"
+
+    def __init__(
+        self, host: str, port: int, sock: socket.socket | None = None
+    ):
         super().__init__(host, port)
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self._sock.bind((self._host, self._port))
+        # a socket taken over from another process is already bound
+        self._sock = sock or self._create_socket()
         self._connections: list[AsyncTcpConnection] = []
-
-        asyncio.create_task(self._monitoring_connections())
+        self._monitoring = None
 
     async def _monitoring_connections(self):
         while True:
@@ -131,21 +213,40 @@ class AsyncTcpServer(AsyncAbstractServer):
                     logger.debug(f"lost connection {connection}")
                     self._connections.remove(connection)
 
-    async def start(self):
-        logger.debug(f"start TCP server {self._host}:{self._port}")
+    def _create_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self._host, self._port))
+        return sock
+
+    def _peer_address(self, writer: asyncio.StreamWriter) -> tuple[str, int]:
+        return writer.get_extra_info("peername")
+
+    async def _serve(self):
+        self._monitoring = asyncio.create_task(self._monitoring_connections())
         self._server = await asyncio.start_server(
             self.handle_message, sock=self._sock, start_serving=True
         )
         return await self._server.start_serving()
 
+    async def start(self):
+        logger.debug(f"start TCP server {self._host}:{self._port}")
+        return await self._serve()
+
+    def pause(self):
+        if self._server:
+            self._server.close()
+
     async def stop(self):
+        if self._monitoring:
+            self._monitoring.cancel()
         self._server.close()
         await self._server.wait_closed()
 
     async def handle_message(
         self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
     ):
-        addr = writer.get_extra_info("peername")
+        addr = self._peer_address(writer)
         new_connection = AsyncTcpConnection(*addr, reader, writer)
         self._connections.append(new_connection)
 
@@ -154,13 +255,83 @@ class AsyncTcpServer(AsyncAbstractServer):
         return self._connections
 
 
+class AsyncUnixServer(AsyncTcpServer):
+    kind = "unix"
+
+    def __init__(self, path: str, sock: socket.socket | None = None):
+        super().__init__(path, 0, sock)
+
+    def _create_socket(self) -> socket.socket:
+        return bind_unix_socket(self._host, socket.SOCK_STREAM)
+
+    def _peer_address(self, writer: asyncio.StreamWriter) -> tuple[str, int]:
+        # unix stream peers are usually unnamed, the peer pid tells them apart
+        sock = writer.get_extra_info("socket")
+        try:
+            creds = sock.getsockopt(
+                socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i")
+            )
+            pid, _, _ = struct.unpack("3i", creds)
+        except (AttributeError, OSError):
+            pid = 0
+        return self._host, pid
+
+    async def start(self):
+        logger.debug(f"start unix stream server {self._host}")
+        return await self._serve()
+
+    async def stop(self):
+        await super().stop()
+        if not self.handed_off:
+            unlink_unix_socket(self._host)
+
+
 class AsyncUdpConnection(AsyncAbstractConnection):
-    def __init__(self, host: str, port: int, transport):
+    __slots__ = (
+        "_transport",
+        "_address",
+        "_is_opened",
+        "_counter",
+        "_message_buffer",
+    )
+
+    def __init__(self, host: str, port: int, transport, address=None):
         super().__init__(host, port)
         self._transport = transport
+        # inet peers are answered at (host, port), the tuple is not kept
+        self._address = address
         self._is_opened = True
-        self.counter = 0
-        self.message_buffer = b""
+        self._message_buffer = None
+
+    @property
+    def counter(self) -> int:
+        # only peers that keep sending partial words have a counter
+        try:
+            return self._counter
+        except AttributeError:
+            return 0
+
+    @counter.setter
+    def counter(self, value: int):
+        if value:
+            self._counter = value
+        elif hasattr(self, "_counter"):
+            del self._counter
+
+    @property
+    def message_buffer(self) -> bytes:
+        return self._message_buffer or b""
+
+    def receive(self, data: bytes):
+        if self._message_buffer is None:
+            self._message_buffer = bytearray(data)
+        else:
+            self._message_buffer += data
+
+    def take_messages(self) -> bytes:
+        data = self.message_buffer
+        self._message_buffer = None
+        return bytes(data)
 
     def close(self):
         self._writer.close()
@@ -168,17 +339,24 @@ class AsyncUdpConnection(AsyncAbstractConnection):
 
     async def write(self, data: bytes):
         await asyncio.sleep(0)
-        self._transport.sendto(data, (self._host, self._port))
+        self._transport.sendto(data, self._address or (self._host, self._port))
 
     async def is_opened(self):
         return self._is_opened
 
 
 class UdpConnectionPool(asyncio.DatagramProtocol):
-    def __init__(self):
+    # datagrams that don't fit in a peer's unprocessed buffer are dropped
+    max_buffer_size = 1 << 16
+
+    def __init__(self, on_datagram=None):
         super().__init__()
         self.transport = None
         self._connections: list[AsyncUdpConnection] = []
+        self._addresses: dict = {}
+        self.dropped = 0
+        # called with the connection and every datagram it receives
+        self._on_datagram = on_datagram
 
     async def _monitoring_connections(self):
         while True:
@@ -192,40 +370,62 @@ class UdpConnectionPool(asyncio.DatagramProtocol):
     def connection_made(self, transport):
         self.transport = transport
 
+    def _new_connection(self, addr) -> AsyncUdpConnection:
+        return AsyncUdpConnection(*addr, self.transport)
+
     def datagram_received(self, data, addr):
-        addresses = [
-            (connection.host, connection.port)
-            for connection in self._connections
-        ]
-        if addr not in addresses:
-            connection = AsyncUdpConnection(*addr, self.transport)
+        if not addr:
+            logger.warning("datagram from an unbound peer can't be answered")
+            return
+        if (connection := self._addresses.get(addr)) is None:
+            connection = self._new_connection(addr)
+            self._addresses[addr] = connection
             self._connections.append(connection)
-        else:
-            connection = self._connections[addresses.index(addr)]
-        logger.debug(f"{connection} -> {data.decode()}")
-        connection.message_buffer += data
+        logger.debug(f"{connection} -> {data.decode(errors='replace')}")
+        if self._on_datagram:
+            self._on_datagram(connection, data)
+        if len(connection.message_buffer) + len(data) > self.max_buffer_size:
+            self.dropped += 1
+            return
+        connection.receive(data)
 
     @property
     def connections(self):
         return self._connections
 
 
+class UnixDatagramConnectionPool(UdpConnectionPool):
+    def _new_connection(self, addr) -> AsyncUdpConnection:
+        return AsyncUdpConnection(addr, 0, self.transport, address=addr)
+
+
 class AsyncUdpServer(AsyncAbstractServer):
-    def __init__(self, host: str, port: int):
+    kind = "udp"
+    protocol_class = UdpConnectionPool
+
+    def __init__(
+        self, host: str, port: int, sock: socket.socket | None = None
+    ):
         super().__init__(host, port)
-        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self._sock.bind((self._host, self._port))
+        self._sock = sock or self._create_socket()
         self._future = None
         self._transport = None
         self._protocol = None
+        self.on_datagram = None
+
+    def _create_socket(self) -> socket.socket:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((self._host, self._port))
+        return sock
 
     async def _start(self):
         (
             self._transport,
             self._protocol,
         ) = await asyncio.get_running_loop().create_datagram_endpoint(
-            UdpConnectionPool, sock=self._sock
+            lambda: self.protocol_class(on_datagram=self.on_datagram),
+            sock=self._sock,
         )
         self._future = asyncio.get_running_loop().create_future()
         await self._future
@@ -234,9 +434,17 @@ class AsyncUdpServer(AsyncAbstractServer):
         logger.debug(f"start UDP server {self._host}:{self._port}")
         await self._start()
 
+    def pause(self):
+        # the datagrams not read yet stay queued for the other process
+        if self._transport:
+            self._transport.pause_reading()
+
     async def _stop(self):
         await asyncio.sleep(0)
-        self._future.done()
+        if self._transport:
+            self._transport.close()
+        if self._future and not self._future.done():
+            self._future.set_result(None)
 
     async def stop(self):
         await self._stop()
@@ -245,6 +453,30 @@ class AsyncUdpServer(AsyncAbstractServer):
     def connections(self):
         return self._protocol.connections
 
+    @property
+    def dropped(self) -> int:
+        return self._protocol.dropped if self._protocol else 0
+
+
+class AsyncUnixDatagramServer(AsyncUdpServer):
+    kind = "unix_dgram"
+    protocol_class = UnixDatagramConnectionPool
+
+    def __init__(self, path: str, sock: socket.socket | None = None):
+        super().__init__(path, 0, sock)
+
+    def _create_socket(self) -> socket.socket:
+        return bind_unix_socket(self._host, socket.SOCK_DGRAM)
+
+    async def start(self):
+        logger.debug(f"start unix datagram server {self._host}")
+        await self._start()
+
+    async def stop(self):
+        await super().stop()
+        if not self.handed_off:
+            unlink_unix_socket(self._host)
+
 
 if __name__ == "__main__":
 
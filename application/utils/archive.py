@@ -0,0 +1,206 @@
+import argparse
+import asyncio
+import datetime
+import os
+from collections import defaultdict
+from pathlib import Path
+
+from application.utils.cruds import StatCRUD
+from application.utils.models import EatStat, PetStat
+from config.db import async_session_injector
+from config.logger import logger
+
+# Stats the cat no longer reads are moved out of the database into Arrow IPC
+# files, one directory per table and day:
+#   <CAT_ARCHIVE_PATH>/eat_stat/day=2026-10-19/<first id>-<last id>.arrow
+# Without compression the reader maps the files and reads them zero-copy.
+CAT_ARCHIVE_PATH = os.getenv("CAT_ARCHIVE_PATH", "archive")
+CAT_ARCHIVE_CHUNK = int(os.getenv("CAT_ARCHIVE_CHUNK", "10000"))
+CAT_ARCHIVE_COMPRESSION = os.getenv("CAT_ARCHIVE_COMPRESSION", "zstd")
+
+TABLES = {
+    "eat_stat": (EatStat, StatCRUD.get_expired_eat_stats),
+    "pet_stat": (PetStat, StatCRUD.get_expired_pet_stats),
+}
+
+
+# pyarrow is optional and slow to import, it is loaded by the first
+# Archiver or ArchiveReader
+pa = pc = None
+
+
+def _require_pyarrow():
+    global pa, pc
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError as e:
+        raise RuntimeError(
+            "The archive needs pyarrow: pip install pyarrow"
+        ) from e
+    pa, pc = pyarrow, pyarrow.compute
+
+
+def _to_arrow(rows: list) -> "pa.Table":
+    columns = {}
+    for name in rows[0]._fields:
+        values = [getattr(row, name) for row in rows]
+        if name in ("user", "food"):
+            # a few names repeat over a whole chunk
+            columns[name] = pa.array(values, pa.string()).dictionary_encode()
+        elif name == "at":
+            columns[name] = pa.array(values, pa.timestamp("us"))
+        else:
+            columns[name] = pa.array(values)
+    return pa.table(columns)
+
+
+class Archiver:
+    def __init__(
+        self,
+        expire_after: float,
+        path: str = CAT_ARCHIVE_PATH,
+        chunk: int = CAT_ARCHIVE_CHUNK,
+        compression: str = CAT_ARCHIVE_COMPRESSION,
+    ):
+        _require_pyarrow()
+        self._expire_after = expire_after
+        self._path = Path(path)
+        self._chunk = chunk
+        self._options = pa.ipc.IpcWriteOptions(compression=compression or None)
+
+    def _write(self, table: str, rows: list) -> list[Path]:
+        days = defaultdict(list)
+        for row in rows:
+            days[row.at.date()].append(row)
+        paths = []
+        for day, day_rows in days.items():
+            directory = self._path / table / f"day={day.isoformat()}"
+            directory.mkdir(parents=True, exist_ok=True)
+            # archiving the same rows again after a crash between the write
+            # and the delete replaces the file
+            path = directory / f"{day_rows[0].id}-{day_rows[-1].id}.arrow"
+            tmp_path = path.with_suffix(".tmp")
+            data = _to_arrow(day_rows)
+            with pa.OSFile(str(tmp_path), "wb") as sink:
+                with pa.ipc.new_file(
+                    sink, data.schema, options=self._options
+                ) as writer:
+                    writer.write_table(data)
+            os.replace(tmp_path, path)
+            paths.append(path)
+        return paths
+
+    async def archive_table(self, table: str) -> int:
+        model, get_expired = TABLES[table]
+        before = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=self._expire_after
+        )
+        archived = 0
+        after_id = 0
+        while rows := await async_session_injector(get_expired)(
+            before, after_id, self._chunk
+        ):
+            # the rows are deleted only once their files are in place
+            await asyncio.to_thread(self._write, table, rows)
+            await async_session_injector(StatCRUD.delete_stats)(
+                model, [row.id for row in rows]
+            )
+            after_id = rows[-1].id
+            archived += len(rows)
+            logger.info(f"archived {archived} {table} rows")
+        return archived
+
+    async def archive(self) -> dict[str, int]:
+        return {table: await self.archive_table(table) for table in TABLES}
+
+
+class ArchiveReader:
+    def __init__(self, path: str = CAT_ARCHIVE_PATH):
+        _require_pyarrow()
+        self._path = Path(path)
+
+    def files(
+        self,
+        table: str,
+        since: datetime.date | None = None,
+        until: datetime.date | None = None,
+    ) -> list[Path]:
+        files = []
+        for directory in sorted((self._path / table).glob("day=*")):
+            day = datetime.date.fromisoformat(directory.name[len("day=") :])
+            if (since and day < since) or (until and day > until):
+                continue
+            files += sorted(directory.glob("*.arrow"))
+        return files
+
+    def read(
+        self,
+        table: str,
+        since: datetime.date | None = None,
+        until: datetime.date | None = None,
+    ) -> "pa.Table":
+        tables = [
+            pa.ipc.open_file(pa.memory_map(str(path))).read_all()
+            for path in self.files(table, since, until)
+        ]
+        if not tables:
+            return pa.table({})
+        return pa.concat_tables(tables).unify_dictionaries()
+
+    def success_rates(
+        self,
+        table: str,
+        by: str,
+        since: datetime.date | None = None,
+        until: datetime.date | None = None,
+    ) -> dict[str, tuple[float, int]]:
+        # name -> (success rate, number of stats), by is "user" or "food"
+        data = self.read(table, since, until)
+        if not data.num_rows:
+            return {}
+        counts = (
+            data.select([by, "is_success"])
+            .set_column(1, "is_success", pc.cast(data["is_success"], "int64"))
+            .group_by(by)
+            .aggregate([("is_success", "mean"), ("is_success", "count")])
+        )
+        return {
+            str(name): (rate, count)
+            for name, rate, count in zip(
+                counts[by].to_pylist(),
+                counts["is_success_mean"].to_pylist(),
+                counts["is_success_count"].to_pylist(),
+            )
+        }
+
+
+if __name__ == "__main__":
+    from application.cat import CAT_TIME_TO_FORGET
+
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    archive = commands.add_parser("archive")
+    archive.add_argument(
+        "--expire-after", type=float, default=CAT_TIME_TO_FORGET
+    )
+    rates = commands.add_parser("rates")
+    rates.add_argument("table", choices=TABLES)
+    rates.add_argument("by", choices=("user", "food"))
+    rates.add_argument("--since", type=datetime.date.fromisoformat)
+    rates.add_argument("--until", type=datetime.date.fromisoformat)
+    args = parser.parse_args()
+
+    if args.command == "archive":
+        print(asyncio.run(Archiver(args.expire_after).archive()))
+    else:
+        reader = ArchiveReader()
+        for name, (rate, count) in sorted(
+            reader.success_rates(
+                args.table, args.by, args.since, args.until
+            ).items()
+        ):
+            print(f"{name}\t{rate:.3f}\t{count}")
@@ -0,0 +1,54 @@
+import base64
+import json
+import os
+import time
+from typing import Iterator
+
+# A capture is JSON lines of the raw inbound payloads:
+#   {"t": monotonic seconds, "proto": "tcp" | "udp", "peer": "host:port",
+#    "data": base64 payload}
+CAPTURE_PATH = os.getenv("CAT_CAPTURE_PATH")
+CAPTURE_FLUSH_INTERVAL = 1.0
+
+
+class TrafficRecorder:
+    def __init__(self, path: str):
+        self._path = path
+        self._file = open(path, "a")
+        self._flushed_at = time.monotonic()
+        self.records = 0
+
+    def record(self, proto: str, peer: str, data: bytes):
+        now = time.monotonic()
+        self._file.write(
+            json.dumps(
+                {
+                    "t": now,
+                    "proto": proto,
+                    "peer": peer,
+                    "data": base64.b64encode(data).decode(),
+                }
+            )
+            + "\n"
+        )
+        self.records += 1
+        if now - self._flushed_at > CAPTURE_FLUSH_INTERVAL:
+            self._file.flush()
+            self._flushed_at = now
+
+    def close(self):
+        self._file.close()
+
+
+def read_capture(path: str) -> Iterator[tuple[float, str, str, bytes]]:
+    with open(path) as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield (
+                record["t"],
+                record["proto"],
+                record["peer"],
+                base64.b64decode(record["data"]),
+            )
@@ -1,11 +1,54 @@
 import datetime
-from typing import List
+from collections import defaultdict
 
-from sqlalchemy import select, and_, desc, update, Select, Update
-from sqlalchemy.dialects.postgresql import insert, Insert
+from sqlalchemy import (
+    select,
+    or_,
+    case,
+    cast,
+    desc,
+    update,
+    delete,
+    func,
+    any_,
+    literal,
+    Select,
+    Update,
+    String,
+    Integer,
+    Boolean,
+    Float,
+    text,
+)
+from sqlalchemy.dialects.postgresql import insert, Insert, ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from application.utils.models import User, Food, EatStat, PetStat
+from application.utils.models import (
+    User,
+    Food,
+    EatStat,
+    PetStat,
+    UserStatSummary,
+    WalCheckpoint,
+)
+from application.utils.summary import fold
+from application.utils.tracing import traced
+
+
+def _array(values: list, type_) -> literal:
+    # one array parameter instead of one parameter per value
+    return literal(values, ARRAY(type_))
+
+
+# per-connection temporary tables the bulk loads are copied into
+_USER_STAGING = "cat_user_staging"
+_FOOD_STAGING = "cat_food_staging"
+
+
+async def _driver_connection(session: AsyncSession):
+    # the asyncpg connection under the session, for COPY
+    connection = await session.connection()
+    return (await connection.get_raw_connection()).driver_connection
 
 
 class CRUD:
@@ -33,6 +76,7 @@ class _UserCRUD(CRUD):
     def __init__(self):
         super().__init__(User)
 
+    @traced()
     async def add_new_user(self, name: str, session: AsyncSession) -> User:
         query = (
             self._insert_model.values({"name": name})
@@ -40,19 +84,74 @@ class _UserCRUD(CRUD):
             .on_conflict_do_nothing()
         )
         res = (await session.execute(query)).scalar()
+        # a concurrent request may have added the same user first
+        if res is None:
+            res = await self.get_user(name, session=session)
         await session.commit()
         return res
 
+    @traced()
     async def get_user(self, name: str, session: AsyncSession) -> User:
         query = self._select_model.where(self._model.name == name)
         res = (await session.execute(query)).scalar()
         return res
 
+    @traced()
+    async def get_or_add_users(
+        self, names: list[str], session: AsyncSession
+    ) -> dict[str, User]:
+        if not names:
+            return {}
+        query = self._insert_model.from_select(
+            ["name"], select(func.unnest(_array(names, String)))
+        ).on_conflict_do_nothing()
+        await session.execute(query)
+        query = self._select_model.where(
+            self._model.name == any_(_array(names, String))
+        )
+        res = (await session.execute(query)).scalars().all()
+        await session.commit()
+        return {user.name: user for user in res}
+
+    @traced()
+    async def get_users(
+        self, names: list[str], session: AsyncSession
+    ) -> dict[str, User]:
+        query = self._select_model.where(
+            self._model.name == any_(_array(names, String))
+        )
+        res = (await session.execute(query)).scalars().all()
+        return {user.name: user for user in res}
+
+    @traced()
+    async def copy_users(self, names: list[str], session: AsyncSession) -> int:
+        # COPY into a staging table is the fastest way in, the merge skips
+        # the users that already exist
+        await session.execute(
+            text(
+                f"CREATE TEMP TABLE IF NOT EXISTS {_USER_STAGING} "
+                "(name text NOT NULL) ON COMMIT DELETE ROWS"
+            )
+        )
+        driver = await _driver_connection(session)
+        await driver.copy_records_to_table(
+            _USER_STAGING, records=[(name,) for name in names]
+        )
+        res = await session.execute(
+            text(
+                f'INSERT INTO "user" (name) SELECT DISTINCT name '
+                f"FROM {_USER_STAGING} ON CONFLICT DO NOTHING"
+            )
+        )
+        await session.commit()
+        return res.rowcount
+
 
 class _FoodCRUD(CRUD):
     def __init__(self):
         super().__init__(Food)
 
+    @traced()
     async def add_new_food(
         self, name: str, prefered_by_the_cat: bool, session: AsyncSession
     ) -> Food:
@@ -64,14 +163,81 @@ class _FoodCRUD(CRUD):
             .on_conflict_do_nothing()
         )
         res = (await session.execute(query)).scalar()
+        if res is None:
+            res = await self.get_food(name, session=session)
         await session.commit()
         return res
 
+    @traced()
     async def get_food(self, name: str, session) -> Food:
         query = self._select_model.where(self._model.name == name)
         res = (await session.execute(query)).scalar()
         return res
 
+    @traced()
+    async def get_or_add_foods(
+        self,
+        names: list[str],
+        prefered_by_the_cat: list[bool],
+        session: AsyncSession,
+    ) -> dict[str, Food]:
+        if not names:
+            return {}
+        query = self._insert_model.from_select(
+            ["name", "preferred_by_the_cat"],
+            select(
+                func.unnest(_array(names, String)),
+                func.unnest(_array(prefered_by_the_cat, Boolean)),
+            ),
+        ).on_conflict_do_nothing()
+        await session.execute(query)
+        query = self._select_model.where(
+            self._model.name == any_(_array(names, String))
+        )
+        res = (await session.execute(query)).scalars().all()
+        await session.commit()
+        return {food.name: food for food in res}
+
+    @traced()
+    async def get_foods(
+        self, names: list[str], session: AsyncSession
+    ) -> dict[str, Food]:
+        query = self._select_model.where(
+            self._model.name == any_(_array(names, String))
+        )
+        res = (await session.execute(query)).scalars().all()
+        return {food.name: food for food in res}
+
+    @traced()
+    async def copy_foods(
+        self,
+        names: list[str],
+        prefered_by_the_cat: list[bool],
+        session: AsyncSession,
+    ) -> int:
+        await session.execute(
+            text(
+                f"CREATE TEMP TABLE IF NOT EXISTS {_FOOD_STAGING} "
+                "(name text NOT NULL, preferred_by_the_cat boolean NOT NULL) "
+                "ON COMMIT DELETE ROWS"
+            )
+        )
+        driver = await _driver_connection(session)
+        await driver.copy_records_to_table(
+            _FOOD_STAGING, records=list(zip(names, prefered_by_the_cat))
+        )
+        # a food listed twice in a chunk keeps one of its flags
+        res = await session.execute(
+            text(
+                "INSERT INTO food (name, preferred_by_the_cat) "
+                "SELECT DISTINCT ON (name) name, preferred_by_the_cat "
+                f"FROM {_FOOD_STAGING} ON CONFLICT DO NOTHING"
+            )
+        )
+        await session.commit()
+        return res.rowcount
+
+    @traced()
     async def is_food_preferred_by_the_cat(
         self, name: str, session: AsyncSession
     ) -> bool:
@@ -86,73 +252,221 @@ class _FoodCRUD(CRUD):
 
 class StatCRUD:
     @staticmethod
-    async def get_eat_stat_by_username_and_period(
-        name: str, period: float, session: AsyncSession
-    ) -> List[EatStat]:
-        query = (
-            select(EatStat)
-            .join(User, and_(User.id == EatStat.user_id, User.name == name))
-            .where(
-                EatStat.eat_at
-                >= datetime.datetime.utcnow()
-                - datetime.timedelta(seconds=period)
-            )
-            .order_by(desc(EatStat.eat_at))
+    @traced()
+    async def get_summaries(
+        cat_id: int, user_ids: list[int], session: AsyncSession
+    ) -> dict[int, UserStatSummary]:
+        query = select(UserStatSummary).where(
+            UserStatSummary.cat_id == cat_id,
+            UserStatSummary.user_id == any_(_array(user_ids, Integer)),
         )
         res = (await session.execute(query)).scalars().all()
-        return res
+        return {summary.user_id: summary for summary in res}
 
     @staticmethod
-    async def get_pet_stat_by_username_and_period(
-        name: str, period: float, session: AsyncSession
-    ) -> List[PetStat]:
-        query = (
-            select(PetStat)
-            .join(User, and_(User.id == PetStat.user_id, User.name == name))
+    @traced()
+    async def _update_summaries(
+        cat_id: int,
+        eat_stats: list[dict],
+        pet_stats: list[dict],
+        forget_after: float,
+        session: AsyncSession,
+    ):
+        # a user's stats are folded first, an upsert can't touch a row twice
+        eaten, petted = defaultdict(list), defaultdict(list)
+        # stats shipped from the write-ahead log carry their own times
+        now = datetime.datetime.utcnow()
+        eat_last_at, pet_last_at = {}, {}
+        for stat in eat_stats:
+            eaten[stat["user_id"]].append(
+                stat["is_success"] or stat["is_cat_was_fed"]
+            )
+            eat_last_at[stat["user_id"]] = stat.get("eat_at", now)
+        for stat in pet_stats:
+            petted[stat["user_id"]].append(stat["is_success"])
+            pet_last_at[stat["user_id"]] = stat.get("pet_at", now)
+        rows = []
+        for user_id in eaten.keys() | petted.keys():
+            eat_acc, eat_norm = fold(eaten.get(user_id, ()))
+            pet_acc, pet_norm = fold(petted.get(user_id, ()))
+            rows.append(
+                {
+                    "cat_id": cat_id,
+                    "user_id": user_id,
+                    "eat_acc": eat_acc,
+                    "eat_norm": eat_norm,
+                    "eat_last_at": eat_last_at.get(user_id),
+                    "pet_acc": pet_acc,
+                    "pet_norm": pet_norm,
+                    "pet_last_at": pet_last_at.get(user_id),
+                }
+            )
+        query = insert(UserStatSummary)
+        stored, new = UserStatSummary.__table__.c, query.excluded
+        forget = datetime.timedelta(seconds=forget_after)
+        set_ = {}
+        for kind in ("eat", "pet"):
+            acc, norm, last_at = (
+                f"{kind}_acc",
+                f"{kind}_norm",
+                f"{kind}_last_at",
+            )
+            last_at_now = func.coalesce(new[last_at], stored[last_at])
+            # the stored history decays by the weight of the new events,
+            # unless it is older than the forget period
+            kept = case(
+                (stored[last_at] >= last_at_now - forget, 1 - new[norm]),
+                else_=0.0,
+            )
+            set_[acc] = new[acc] + kept * stored[acc]
+            set_[norm] = new[norm] + kept * stored[norm]
+            set_[last_at] = last_at_now
+        await session.execute(
+            query.on_conflict_do_update(
+                index_elements=[
+                    UserStatSummary.cat_id,
+                    UserStatSummary.user_id,
+                ],
+                set_=set_,
+            ),
+            rows,
+        )
+
+    @staticmethod
+    @traced()
+    async def get_satiety_scale(
+        cat_id: int,
+        period: float,
+        now: datetime.datetime,
+        session: AsyncSession,
+    ) -> float:
+        # eats weigh less linearly with age, the cat is sated by successful
+        # eats and by the ones it was fed anyway
+        age = func.extract("epoch", literal(now) - EatStat.eat_at)
+        weight = cast((period - age) / period, Float)
+        sated = case(
+            (or_(EatStat.is_success, EatStat.is_cat_was_fed), 1.0), else_=0.0
+        )
+        query = select(
+            func.coalesce(
+                func.sum(weight * sated) / func.nullif(func.sum(weight), 0),
+                0.0,
+            )
+        ).where(
+            EatStat.cat_id == cat_id,
+            EatStat.eat_at >= now - datetime.timedelta(seconds=period),
+        )
+        return float((await session.execute(query)).scalar())
+
+    @staticmethod
+    @traced()
+    async def get_pet_scale(
+        cat_id: int,
+        period: float,
+        size: int,
+        now: datetime.datetime,
+        session: AsyncSession,
+    ) -> float:
+        # the weights halve with every older pet, so only the last size pets
+        # are read
+        recent = (
+            select(
+                PetStat.is_success,
+                func.row_number()
+                .over(order_by=desc(PetStat.pet_at))
+                .label("n"),
+            )
             .where(
-                PetStat.pet_at
-                >= datetime.datetime.utcnow()
-                - datetime.timedelta(seconds=period)
+                PetStat.cat_id == cat_id,
+                PetStat.pet_at >= now - datetime.timedelta(seconds=period),
             )
             .order_by(desc(PetStat.pet_at))
+            .limit(size)
+            .subquery()
         )
-        res = (await session.execute(query)).scalars().all()
-        return res
+        weight = func.power(0.5, recent.c.n)
+        success = case((recent.c.is_success, 1.0), else_=0.0)
+        query = select(
+            func.coalesce(
+                func.sum(weight * success) / func.nullif(func.sum(weight), 0),
+                0.0,
+            )
+        )
+        return float((await session.execute(query)).scalar())
 
     @staticmethod
-    async def get_eat_stat_for_the_last_period(
-        period: float, session: AsyncSession
-    ) -> List[EatStat]:
-        query = select(EatStat).where(
-            EatStat.eat_at
-            >= datetime.datetime.utcnow() - datetime.timedelta(seconds=period)
+    @traced()
+    async def get_expired_eat_stats(
+        before: datetime.datetime,
+        after_id: int,
+        limit: int,
+        session: AsyncSession,
+    ) -> list:
+        query = (
+            select(
+                EatStat.id,
+                EatStat.cat_id,
+                EatStat.eat_at.label("at"),
+                User.name.label("user"),
+                Food.name.label("food"),
+                EatStat.is_success,
+                EatStat.is_cat_was_fed,
+            )
+            .join(User, User.id == EatStat.user_id)
+            .join(Food, Food.id == EatStat.food_id)
+            .where(EatStat.eat_at < before, EatStat.id > after_id)
+            .order_by(EatStat.id)
+            .limit(limit)
         )
-        res = (await session.execute(query)).scalars().all()
-        return res
+        return (await session.execute(query)).all()
 
     @staticmethod
-    async def get_pet_stat_for_the_last_period(
-        period: float, session: AsyncSession
-    ) -> List[PetStat]:
-        query = select(PetStat.is_success).where(
-            PetStat.pet_at
-            >= datetime.datetime.utcnow() - datetime.timedelta(seconds=period)
+    @traced()
+    async def get_expired_pet_stats(
+        before: datetime.datetime,
+        after_id: int,
+        limit: int,
+        session: AsyncSession,
+    ) -> list:
+        query = (
+            select(
+                PetStat.id,
+                PetStat.cat_id,
+                PetStat.pet_at.label("at"),
+                User.name.label("user"),
+                PetStat.is_success,
+            )
+            .join(User, User.id == PetStat.user_id)
+            .where(PetStat.pet_at < before, PetStat.id > after_id)
+            .order_by(PetStat.id)
+            .limit(limit)
         )
-        res = (await session.execute(query)).scalars().all()
-        return res
+        return (await session.execute(query)).all()
 
     @staticmethod
+    @traced()
+    async def delete_stats(model, ids: list[int], session: AsyncSession):
+        await session.execute(
+            delete(model).where(model.id == any_(_array(ids, Integer)))
+        )
+        await session.commit()
+
+    @staticmethod
+    @traced()
     async def add_eat_stat(
+        cat_id: int,
         user_id: int,
         food_id: int,
         is_success: bool,
         is_cat_was_fed: bool,
+        forget_after: float,
         session: AsyncSession,
     ) -> int:
         query = (
             insert(EatStat)
             .values(
                 {
+                    "cat_id": cat_id,
                     "user_id": user_id,
                     "food_id": food_id,
                     "is_success": is_success,
@@ -162,22 +476,149 @@ class StatCRUD:
             .returning(EatStat.id)
         )
         id = (await session.execute(query)).scalar()
+        await StatCRUD._update_summaries(
+            cat_id,
+            [
+                {
+                    "user_id": user_id,
+                    "is_success": is_success,
+                    "is_cat_was_fed": is_cat_was_fed,
+                }
+            ],
+            [],
+            forget_after,
+            session=session,
+        )
         await session.commit()
         return id
 
     @staticmethod
+    @traced()
     async def add_pet_stat(
-        user_id: int, is_success: bool, session: AsyncSession
+        cat_id: int,
+        user_id: int,
+        is_success: bool,
+        forget_after: float,
+        session: AsyncSession,
     ) -> int:
         query = (
             insert(PetStat)
-            .values({"user_id": user_id, "is_success": is_success})
+            .values(
+                {
+                    "cat_id": cat_id,
+                    "user_id": user_id,
+                    "is_success": is_success,
+                }
+            )
             .returning(PetStat.id)
         )
         id = (await session.execute(query)).scalar()
+        await StatCRUD._update_summaries(
+            cat_id,
+            [],
+            [{"user_id": user_id, "is_success": is_success}],
+            forget_after,
+            session=session,
+        )
         await session.commit()
         return id
 
+    @staticmethod
+    async def _insert_stats(
+        cat_id: int,
+        eat_stats: list[dict],
+        pet_stats: list[dict],
+        forget_after: float,
+        session: AsyncSession,
+    ):
+        # executemany inserts are sent as multi-row VALUES batches, the
+        # stats carry their cat_id
+        if eat_stats:
+            await session.execute(insert(EatStat), eat_stats)
+        if pet_stats:
+            await session.execute(insert(PetStat), pet_stats)
+        if eat_stats or pet_stats:
+            await StatCRUD._update_summaries(
+                cat_id, eat_stats, pet_stats, forget_after, session=session
+            )
+
+    @staticmethod
+    @traced()
+    async def add_stats(
+        cat_id: int,
+        eat_stats: list[dict],
+        pet_stats: list[dict],
+        forget_after: float,
+        session: AsyncSession,
+    ):
+        await StatCRUD._insert_stats(
+            cat_id, eat_stats, pet_stats, forget_after, session=session
+        )
+        await session.commit()
+
+    @staticmethod
+    @traced()
+    async def get_wal_checkpoint(
+        name: str, session: AsyncSession
+    ) -> tuple[int, int]:
+        query = select(WalCheckpoint.segment, WalCheckpoint.position).where(
+            WalCheckpoint.name == name
+        )
+        row = (await session.execute(query)).first()
+        return tuple(row) if row else (0, 0)
+
+    @staticmethod
+    @traced()
+    async def lock_wal_checkpoint(
+        name: str, session: AsyncSession
+    ) -> tuple[int, int]:
+        # the position of the log, locked until the session commits
+        await session.execute(
+            insert(WalCheckpoint)
+            .values(name=name, segment=0, position=0)
+            .on_conflict_do_nothing()
+        )
+        query = (
+            select(WalCheckpoint.segment, WalCheckpoint.position)
+            .where(WalCheckpoint.name == name)
+            .with_for_update()
+        )
+        segment, position = (await session.execute(query)).one()
+        return segment, position
+
+    @staticmethod
+    @traced()
+    async def ship_stats(
+        name: str,
+        segment: int,
+        position: int,
+        eat_stats: list[dict],
+        pet_stats: list[dict],
+        forget_after: float,
+        session: AsyncSession,
+    ):
+        # the stats of every cat in the log and the position after them are
+        # committed together
+        eaten, petted = defaultdict(list), defaultdict(list)
+        for stat in eat_stats:
+            eaten[stat["cat_id"]].append(stat)
+        for stat in pet_stats:
+            petted[stat["cat_id"]].append(stat)
+        for cat_id in eaten.keys() | petted.keys():
+            await StatCRUD._insert_stats(
+                cat_id,
+                eaten.get(cat_id, []),
+                petted.get(cat_id, []),
+                forget_after,
+                session=session,
+            )
+        await session.execute(
+            update(WalCheckpoint)
+            .where(WalCheckpoint.name == name)
+            .values(segment=segment, position=position, shipped_at=func.now())
+        )
+        await session.commit()
+
 
 UserCRUD = _UserCRUD()
 FoodCRUD = _FoodCRUD()
@@ -0,0 +1,98 @@
+import os
+import time
+from collections import Counter, OrderedDict
+
+# rates are actions per second, 0 turns a limit off. The pending and queued
+# limits count requests, a batch is one request of many actions.
+PEER_RATE = float(os.getenv("CAT_PEER_RATE", "0"))
+PEER_BURST = float(os.getenv("CAT_PEER_BURST", "100"))
+GLOBAL_RATE = float(os.getenv("CAT_GLOBAL_RATE", "0"))
+GLOBAL_BURST = float(os.getenv("CAT_GLOBAL_BURST", "1000"))
+MAX_PENDING_PER_CONNECTION = int(os.getenv("CAT_MAX_PENDING", "1024"))
+MAX_QUEUED = int(os.getenv("CAT_MAX_QUEUED", "10000"))
+MAX_PEER_BUCKETS = 100_000
+
+
+class TokenBucket:
+    __slots__ = ("_rate", "_burst", "_tokens", "_updated_at")
+
+    def __init__(self, rate: float, burst: float):
+        self._rate = rate
+        self._burst = burst
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+
+    def take(self, n: float = 1) -> bool:
+        now = time.monotonic()
+        self._tokens = min(
+            self._burst, self._tokens + (now - self._updated_at) * self._rate
+        )
+        self._updated_at = now
+        if self._tokens < n:
+            return False
+        self._tokens -= n
+        return True
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        peer_rate: float = PEER_RATE,
+        peer_burst: float = PEER_BURST,
+        global_rate: float = GLOBAL_RATE,
+        global_burst: float = GLOBAL_BURST,
+        max_pending: int = MAX_PENDING_PER_CONNECTION,
+        max_queued: int = MAX_QUEUED,
+    ):
+        self._peer_rate = peer_rate
+        self._peer_burst = peer_burst
+        self._global = (
+            TokenBucket(global_rate, global_burst) if global_rate else None
+        )
+        self._max_pending = max_pending
+        self._max_queued = max_queued
+        self._peers: OrderedDict[str, TokenBucket] = OrderedDict()
+        self._admitted = 0
+        self._shed = Counter()
+
+    def _peer_bucket(self, peer: str) -> TokenBucket:
+        if (bucket := self._peers.get(peer)) is None:
+            bucket = self._peers[peer] = TokenBucket(
+                self._peer_rate, self._peer_burst
+            )
+            # a forgotten peer comes back with a full bucket, which is
+            # what an idle peer would have anyway
+            if len(self._peers) > MAX_PEER_BUCKETS:
+                self._peers.popitem(last=False)
+        else:
+            self._peers.move_to_end(peer)
+        return bucket
+
+    def _reason_to_shed(
+        self, peer: str, pending: int, queued: int, cost: int
+    ) -> str | None:
+        if pending >= self._max_pending:
+            return "connection_pending"
+        if queued >= self._max_queued:
+            return "queue_full"
+        if self._peer_rate and not self._peer_bucket(peer).take(cost):
+            return "peer_rate"
+        if self._global and not self._global.take(cost):
+            return "global_rate"
+        return None
+
+    def admit(
+        self, peer: str, pending: int, queued: int, cost: int = 1
+    ) -> bool:
+        if reason := self._reason_to_shed(peer, pending, queued, cost):
+            self.shed(reason, cost)
+            return False
+        self._admitted += cost
+        return True
+
+    def shed(self, reason: str, n: int = 1):
+        self._shed[reason] += n
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"admitted": self._admitted, **self._shed}
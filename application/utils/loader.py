@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import csv
+import itertools
+import json
+import os
+import time
+from collections import deque
+from typing import Iterator
+
+from application.utils.cruds import UserCRUD, FoodCRUD
+from config.db import async_session_injector
+from config.logger import logger
+
+# A catalog lists users and foods, one record per line:
+#   csv    kind,name,preferred_by_the_cat
+#          user,alice,
+#          food,fish,true
+#   jsonl  {"kind": "user", "name": "alice"}
+#          {"kind": "food", "name": "fish", "preferred_by_the_cat": true}
+# It is read and loaded CAT_LOAD_CHUNK records at a time.
+CAT_LOAD_CHUNK = int(os.getenv("CAT_LOAD_CHUNK", "50000"))
+# a catalog the service loads on start, into the database and the default
+# cat's caches
+CAT_CATALOG_PATH = os.getenv("CAT_CATALOG_PATH")
+
+_true = {"1", "true", "t", "yes", "y"}
+
+
+def _flag(value) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in _true
+    return bool(value)
+
+
+def read_catalog(path: str) -> Iterator[tuple[str, str, bool]]:
+    with open(path, newline="") as file:
+        if path.endswith(".csv"):
+            records = csv.DictReader(file)
+        else:
+            records = (json.loads(line) for line in file if line.strip())
+        for record in records:
+            kind, name = record["kind"], record["name"]
+            if kind not in ("user", "food") or not name:
+                raise ValueError(f"Incorrect catalog record: {record}")
+            yield kind, name, _flag(record.get("preferred_by_the_cat"))
+
+
+class CatalogLoader:
+    def __init__(self, cat=None, chunk: int = CAT_LOAD_CHUNK):
+        # a Cat in the same process gets the last loaded identities cached,
+        # as many as it keeps
+        self._cat = cat
+        self._chunk = chunk
+        cached = cat.cache_size if cat is not None else 0
+        self._last_users = deque(maxlen=cached)
+        self._last_foods = deque(maxlen=cached)
+        self.records = 0
+        self.users = 0
+        self.foods = 0
+
+    async def _load_chunk(self, records: list[tuple[str, str, bool]]):
+        users = [name for kind, name, _ in records if kind == "user"]
+        foods = [name for kind, name, _ in records if kind == "food"]
+        flags = [flag for kind, _, flag in records if kind == "food"]
+        if users:
+            copy_users = async_session_injector(UserCRUD.copy_users)
+            self.users += await copy_users(users)
+        if foods:
+            copy_foods = async_session_injector(FoodCRUD.copy_foods)
+            self.foods += await copy_foods(foods, flags)
+        self._last_users.extend(users)
+        self._last_foods.extend(foods)
+        self.records += len(records)
+
+    async def _warm(self):
+        get_users = async_session_injector(UserCRUD.get_users)
+        get_foods = async_session_injector(FoodCRUD.get_foods)
+        users, foods = list(self._last_users), list(self._last_foods)
+        # the ones listed last end up the most recently used
+        for i in range(0, max(len(users), len(foods)), self._chunk):
+            found_users = await get_users(users[i : i + self._chunk])
+            found_foods = await get_foods(foods[i : i + self._chunk])
+            self._cat.warm(
+                (found_users[name] for name in users[i : i + self._chunk]),
+                (found_foods[name] for name in foods[i : i + self._chunk]),
+            )
+        logger.info(f"{len(users)} users and {len(foods)} foods cached")
+
+    async def load(self, path: str):
+        started = time.perf_counter()
+        records = read_catalog(path)
+        while chunk := list(itertools.islice(records, self._chunk)):
+            await self._load_chunk(chunk)
+            elapsed = time.perf_counter() - started
+            logger.info(
+                f"{self.records} records loaded in {elapsed:.1f} s "
+                f"({self.records / elapsed:.0f}/s), "
+                f"{self.users} new users, {self.foods} new foods"
+            )
+        if self._cat is not None:
+            await self._warm()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("catalog", help="a .csv or .jsonl catalog")
+    parser.add_argument("--chunk", type=int, default=CAT_LOAD_CHUNK)
+    args = parser.parse_args()
+    asyncio.run(CatalogLoader(chunk=args.chunk).load(args.catalog))
@@ -0,0 +1,160 @@
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+from config.logger import logger
+
+# seconds between lag samples and the lag worth remembering
+LOOP_LAG_INTERVAL = float(os.getenv("CAT_LOOP_LAG_INTERVAL", "0.1"))
+LOOP_LAG_THRESHOLD = float(os.getenv("CAT_LOOP_LAG_THRESHOLD", "0.05"))
+# a loop step running longer than this is recorded with its stack, 0 turns
+# the detector off as it wraps every callback the loop runs
+SLOW_CALLBACK_THRESHOLD = float(os.getenv("CAT_SLOW_CALLBACK", "0"))
+LOOP_EVENTS = int(os.getenv("CAT_LOOP_EVENTS", "256"))
+
+
+def _describe(handle: asyncio.Handle) -> str:
+    owner = getattr(handle._callback, "__self__", None)
+    if isinstance(owner, asyncio.Task):
+        coro = owner.get_coro()
+        return getattr(coro, "__qualname__", repr(coro))
+    return getattr(handle._callback, "__qualname__", repr(handle._callback))
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = LOOP_LAG_INTERVAL,
+        lag_threshold: float = LOOP_LAG_THRESHOLD,
+        slow_callback_threshold: float = SLOW_CALLBACK_THRESHOLD,
+        size: int = LOOP_EVENTS,
+    ):
+        self._interval = interval
+        self._lag_threshold = lag_threshold
+        self._slow_threshold = slow_callback_threshold
+        self.events: deque[dict] = deque(maxlen=size)
+        self._sampling = None
+        self._lag = 0.0
+        self._max_lag = 0.0
+        self._slow_callbacks = 0
+        # the step the loop thread is running, read by the watchdog
+        self._step: tuple[int, float] | None = None
+        self._step_stack: tuple[int, list[str]] | None = None
+        self._steps = 0
+        self._loop_thread = None
+        self._watchdog = None
+        self._handle_run = None
+        self._loop = None
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._sampling = asyncio.create_task(self._sample_lag())
+        if self._slow_threshold:
+            self._patch_handles()
+        try:
+            self._loop.add_signal_handler(signal.SIGUSR1, self.dump)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass
+
+    def stop(self):
+        if self._sampling:
+            self._sampling.cancel()
+            self._sampling = None
+        if self._handle_run:
+            asyncio.Handle._run = self._handle_run
+            self._handle_run = None
+        self._watchdog = None
+        if self._loop:
+            try:
+                self._loop.remove_signal_handler(signal.SIGUSR1)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass
+
+    def _record(self, kind: str, duration: float, **details):
+        self.events.append(
+            {"kind": kind, "at": time.time(), "duration": duration, **details}
+        )
+
+    async def _sample_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self._interval)
+            self._lag = max(0.0, loop.time() - started - self._interval)
+            self._max_lag = max(self._max_lag, self._lag)
+            if self._lag > self._lag_threshold:
+                self._record("lag", self._lag)
+
+    def _patch_handles(self):
+        monitor = self
+        handle_run = self._handle_run = asyncio.Handle._run
+
+        def _run(handle):
+            monitor._steps += 1
+            step = monitor._step = (monitor._steps, time.perf_counter())
+            try:
+                return handle_run(handle)
+            finally:
+                monitor._step = None
+                duration = time.perf_counter() - step[1]
+                if duration > monitor._slow_threshold:
+                    monitor._slow_step(handle, step[0], duration)
+
+        asyncio.Handle._run = _run
+        self._loop_thread = threading.get_ident()
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._watchdog.start()
+
+    def _slow_step(self, handle: asyncio.Handle, step: int, duration: float):
+        self._slow_callbacks += 1
+        stack = None
+        if self._step_stack and self._step_stack[0] == step:
+            stack = self._step_stack[1]
+        self._record(
+            "slow_callback", duration, coroutine=_describe(handle), stack=stack
+        )
+
+    def _watch(self):
+        # the stack of a slow step can only be taken while it still runs
+        thread = self._watchdog
+        while self._watchdog is thread:
+            time.sleep(self._slow_threshold / 2)
+            if (step := self._step) is None:
+                continue
+            number, started = step
+            if time.perf_counter() - started < self._slow_threshold:
+                continue
+            if self._step_stack and self._step_stack[0] == number:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._step_stack = (number, traceback.format_stack(frame))
+
+    def dump(self):
+        logger.warning(
+            f"loop lag {self._lag * 1000:.1f} ms, "
+            f"max {self._max_lag * 1000:.1f} ms, "
+            f"{self._slow_callbacks} slow callbacks, "
+            f"{len(self.events)} events:"
+        )
+        for event in self.events:
+            stack = "".join(event.get("stack") or ())
+            details = {
+                key: value for key, value in event.items() if key != "stack"
+            }
+            logger.warning(f"{details}\n{stack}".rstrip())
+
+    @property
+    def stats(self) -> dict[str, float]:
+        return {
+            "lag": self._lag,
+            "max_lag": self._max_lag,
+            "slow_callbacks": self._slow_callbacks,
+        }
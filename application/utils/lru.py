@@ -0,0 +1,36 @@
+from collections import OrderedDict
+from typing import Any, Hashable, Iterator
+
+
+class LRUCache:
+    def __init__(self, maxsize: int):
+        self._maxsize = maxsize
+        self._items: OrderedDict[Hashable, Any] = OrderedDict()
+
+    @property
+    def maxsize(self) -> int:
+        return self._maxsize
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if (value := self._items.get(key, default)) is not default:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self._maxsize:
+            self._items.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        return self._items.pop(key, default)
+
+    def items(self) -> Iterator[tuple[Hashable, Any]]:
+        # the most recently used first
+        return reversed(self._items.items())
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
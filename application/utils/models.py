@@ -4,9 +4,12 @@ from sqlalchemy import (
     Column,
     String,
     Integer,
+    BigInteger,
     Boolean,
+    Float,
     ForeignKey,
     DateTime,
+    Index,
     func,
 )
 
@@ -27,9 +30,18 @@ class Food(Base):
     preferred_by_the_cat = Column(Boolean, nullable=False)
 
 
+# the cat a stat or a summary belongs to, the users and the foods are shared
+# by all the cats
+_cat_id = lambda **kwargs: Column(
+    Integer, nullable=False, server_default="0", **kwargs
+)
+
+
 class EatStat(Base):
     __tablename__ = "eat_stat"
+    __table_args__ = (Index("ix_eat_stat_cat_id_eat_at", "cat_id", "eat_at"),)
     id = _id()
+    cat_id = _cat_id()
     user_id = Column(
         Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
     )
@@ -43,9 +55,38 @@ class EatStat(Base):
 
 class PetStat(Base):
     __tablename__ = "pet_stat"
+    __table_args__ = (Index("ix_pet_stat_cat_id_pet_at", "cat_id", "pet_at"),)
     id = _id()
+    cat_id = _cat_id()
     user_id = Column(
         Integer, ForeignKey("user.id", ondelete="CASCADE"), nullable=False
     )
     is_success = Column(Boolean, nullable=False)
     pet_at = Column(DateTime, default=func.now())
+
+
+class UserStatSummary(Base):
+    # a user's eat and pet histories folded into halving weights, kept up to
+    # date with every stat written, see application.utils.summary
+    __tablename__ = "user_stat_summary"
+    cat_id = _cat_id(primary_key=True)
+    user_id = Column(
+        Integer,
+        ForeignKey("user.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    eat_acc = Column(Float, nullable=False, server_default="0")
+    eat_norm = Column(Float, nullable=False, server_default="0")
+    eat_last_at = Column(DateTime, nullable=True)
+    pet_acc = Column(Float, nullable=False, server_default="0")
+    pet_norm = Column(Float, nullable=False, server_default="0")
+    pet_last_at = Column(DateTime, nullable=True)
+
+
+class WalCheckpoint(Base):
+    # how far a write-ahead log has been shipped, see application.utils.wal
+    __tablename__ = "wal_checkpoint"
+    name = Column(String, primary_key=True)
+    segment = Column(BigInteger, nullable=False)
+    position = Column(BigInteger, nullable=False)
+    shipped_at = Column(DateTime, default=func.now(), onupdate=func.now())
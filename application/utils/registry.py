@@ -0,0 +1,85 @@
+import asyncio
+import os
+from typing import Any, Callable, Hashable, Iterator
+
+# seconds a cat may go without requests before its state is dropped, it is
+# read back from the DB on the next request, 0 keeps every cat
+CAT_IDLE_EVICT = float(os.getenv("CAT_IDLE_EVICT", "600"))
+
+
+class Registry:
+    # Values are created by the factory on first use and closed once they
+    # have not been used for idle_after seconds. Pinned keys stay.
+    def __init__(
+        self,
+        factory: Callable[[Hashable], Any],
+        close: Callable[[Any], None],
+        idle_after: float = CAT_IDLE_EVICT,
+        pinned: tuple = (),
+    ):
+        self._factory = factory
+        self._close = close
+        self._idle_after = idle_after
+        self._pinned = set(pinned)
+        self._items: dict[Hashable, Any] = {}
+        self._used_at: dict[Hashable, float] = {}
+        self._sweeping = None
+        self._created = 0
+        self._evicted = 0
+
+    def get(self, key: Hashable) -> Any:
+        if (value := self._items.get(key)) is None:
+            value = self._items[key] = self._factory(key)
+            self._created += 1
+        self._used_at[key] = asyncio.get_running_loop().time()
+        return value
+
+    def peek(self, key: Hashable) -> Any:
+        # without creating or touching the value
+        return self._items.get(key)
+
+    def values(self) -> Iterator[Any]:
+        return iter(list(self._items.values()))
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def evict_idle(self) -> list[Hashable]:
+        deadline = asyncio.get_running_loop().time() - self._idle_after
+        idle = [
+            key
+            for key, used_at in self._used_at.items()
+            if used_at < deadline and key not in self._pinned
+        ]
+        for key in idle:
+            del self._used_at[key]
+            self._close(self._items.pop(key))
+        self._evicted += len(idle)
+        return idle
+
+    async def _sweeping_loop(self):
+        while True:
+            await asyncio.sleep(max(1.0, self._idle_after / 2))
+            self.evict_idle()
+
+    def start(self):
+        if self._idle_after and self._sweeping is None:
+            self._sweeping = asyncio.create_task(self._sweeping_loop())
+
+    def stop(self):
+        if self._sweeping:
+            self._sweeping.cancel()
+            self._sweeping = None
+        for value in self._items.values():
+            self._close(value)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "live": len(self._items),
+            "created": self._created,
+            "evicted": self._evicted,
+        }
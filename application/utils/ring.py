@@ -0,0 +1,41 @@
+import bisect
+import hashlib
+import os
+from typing import Hashable, Sequence
+
+# Cats are spread over the workers by a consistent hash ring, so adding a
+# worker moves only about 1/n of the cats. Every node is placed on the ring
+# CAT_RING_VNODES times to even out the shares. The servers and the clients
+# must agree on the nodes and on the vnodes.
+CAT_RING_VNODES = int(os.getenv("CAT_RING_VNODES", "64"))
+
+
+def _hash(key: str) -> int:
+    # stable across processes, unlike hash()
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class HashRing:
+    def __init__(
+        self, nodes: Sequence[Hashable], vnodes: int = CAT_RING_VNODES
+    ):
+        if not nodes:
+            raise ValueError("A ring needs at least one node")
+        self._nodes = list(nodes)
+        points = sorted(
+            (_hash(f"{node}#{i}"), node)
+            for node in self._nodes
+            for i in range(vnodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._owners = [node for _, node in points]
+
+    @property
+    def nodes(self) -> list[Hashable]:
+        return self._nodes
+
+    def owner(self, key: Hashable) -> Hashable:
+        # the first point clockwise from the key's hash
+        i = bisect.bisect(self._hashes, _hash(str(key)))
+        return self._owners[i % len(self._owners)]
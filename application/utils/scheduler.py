@@ -0,0 +1,125 @@
+import asyncio
+import os
+from collections import defaultdict, deque
+
+
+def parse_weights(spec: str) -> dict[str, float]:
+    # "10.0.0.5=4,10.0.0.6=2"
+    weights = {}
+    for item in filter(None, (el.strip() for el in spec.split(","))):
+        address, _, weight = item.rpartition("=")
+        weights[address] = float(weight)
+        if weights[address] <= 0:
+            raise ValueError(f"Weight of {address} must be positive")
+    return weights
+
+
+SCHEDULER_CONCURRENCY = int(os.getenv("CAT_SCHEDULER_CONCURRENCY", "10"))
+SCHEDULER_IN_FLIGHT_LIMIT = int(os.getenv("CAT_SCHEDULER_IN_FLIGHT", "4"))
+SCHEDULER_PEER_WEIGHTS = parse_weights(os.getenv("CAT_PEER_WEIGHTS", ""))
+
+
+# Deficit round robin over per-client queues of waiting work items. A work
+# item holds one of `concurrency` slots while it runs and costs its number
+# of actions from the client's deficit, so a client with big batches only
+# gets its weighted share of the actions.
+class FairScheduler:
+    def __init__(
+        self,
+        concurrency: int = SCHEDULER_CONCURRENCY,
+        in_flight_limit: int = SCHEDULER_IN_FLIGHT_LIMIT,
+        weights: dict[str, float] | None = None,
+        default_weight: float = 1.0,
+    ):
+        self._concurrency = concurrency
+        self._in_flight_limit = in_flight_limit
+        self._weights = SCHEDULER_PEER_WEIGHTS if weights is None else weights
+        self._default_weight = default_weight
+        # a waiting work item is (future, cost)
+        self._queues: dict[str, deque[tuple[asyncio.Future, int]]] = {}
+        self._deficits: dict[str, float] = {}
+        self._round: deque[str] = deque()
+        self._in_flight: dict[str, int] = defaultdict(int)
+        self._running = 0
+        self._waiting = 0
+
+    def weight(self, client: str) -> float:
+        return self._weights.get(client, self._default_weight)
+
+    def _leave_round(self, client: str):
+        self._round.popleft()
+        del self._queues[client]
+        del self._deficits[client]
+
+    def _dispatch(self):
+        blocked = 0
+        while (
+            self._running < self._concurrency
+            and self._round
+            and blocked < len(self._round)
+        ):
+            client = self._round[0]
+            queue = self._queues[client]
+            while queue and queue[0][0].done():
+                queue.popleft()
+            if not queue:
+                self._leave_round(client)
+                continue
+            if self._in_flight[client] >= self._in_flight_limit:
+                self._round.rotate(-1)
+                blocked += 1
+                continue
+            future, cost = queue[0]
+            if self._deficits[client] < cost:
+                self._deficits[client] += self.weight(client)
+                if self._deficits[client] < cost:
+                    self._round.rotate(-1)
+                    continue
+            blocked = 0
+            queue.popleft()
+            future.set_result(None)
+            self._waiting -= 1
+            self._deficits[client] -= cost
+            self._in_flight[client] += 1
+            self._running += 1
+            if not queue:
+                self._leave_round(client)
+            elif self._deficits[client] < queue[0][1]:
+                self._round.rotate(-1)
+
+    async def acquire(self, client: str, cost: int = 1):
+        future = asyncio.get_running_loop().create_future()
+        if client not in self._queues:
+            self._queues[client] = deque()
+            self._deficits[client] = 0.0
+            self._round.append(client)
+        self._queues[client].append((future, cost))
+        self._waiting += 1
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                self._waiting -= 1
+            else:
+                self.release(client)
+            raise
+
+    def release(self, client: str):
+        self._running -= 1
+        self._in_flight[client] -= 1
+        if not self._in_flight[client]:
+            del self._in_flight[client]
+        self._dispatch()
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "running": self._running,
+            "waiting": self._waiting,
+            "clients": len(self._queues),
+        }
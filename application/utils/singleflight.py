@@ -0,0 +1,58 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class _Flight:
+    __slots__ = ("future", "waiters")
+
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+        self.waiters = 0
+
+
+# Identical concurrent calls share the first caller's awaitable, so a burst
+# of requests for one key costs a single query. A flight is cancelled when
+# every caller waiting for it has been cancelled.
+class SingleFlight:
+    def __init__(self):
+        self._flights: dict[Hashable, _Flight] = {}
+        self._calls = 0
+        self._coalesced = 0
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if (flight := self._flights.get(key)) and flight.future is future:
+            del self._flights[key]
+
+    async def do(
+        self,
+        key: Hashable,
+        func: Callable[..., Awaitable[Any]],
+        *args,
+        **kwargs,
+    ) -> Any:
+        self._calls += 1
+        if (flight := self._flights.get(key)) is None:
+            future = asyncio.ensure_future(func(*args, **kwargs))
+            flight = self._flights[key] = _Flight(future)
+            future.add_done_callback(lambda f: self._forget(key, f))
+        else:
+            self._coalesced += 1
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.future)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.future.done():
+                # later callers must not join a flight that is going away
+                self._forget(key, flight.future)
+                flight.future.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "calls": self._calls,
+            "coalesced": self._coalesced,
+            "in_flight": len(self._flights),
+        }
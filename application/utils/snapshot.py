@@ -0,0 +1,159 @@
+import mmap
+import os
+import struct
+from dataclasses import dataclass, field
+
+# A snapshot of what the Cat knows, written on stop and read on start:
+#   header    magic, version, created_at, satiety and pet scales, counts
+#   users     id, name
+#   foods     id, preferred_by_the_cat, name
+#   histories user id, eat and pet summaries as (acc, norm, age in ms), the
+#             age of a summary without events is MAX_AGE
+# Names are prefixed by their u16 length, all numbers are big-endian.
+MAGIC = b"CATS"
+VERSION = 2
+
+_header = struct.Struct(">4sHdddIII")
+_user = struct.Struct(">IH")
+_food = struct.Struct(">I?H")
+_history = struct.Struct(">I")
+_summary = struct.Struct(">ddI")
+MAX_AGE = (1 << 32) - 1
+MAX_NAME_LENGTH = (1 << 16) - 1
+
+
+@dataclass
+class Snapshot:
+    created_at: float
+    satiety_scale: float
+    pet_scale: float
+    # (id, name)
+    users: list[tuple[int, str]] = field(default_factory=list)
+    # (id, name, preferred_by_the_cat)
+    foods: list[tuple[int, str, bool]] = field(default_factory=list)
+    # user id -> (eat summary, pet summary), a summary is
+    # (acc, norm, last_at or None), see application.utils.summary
+    histories: dict[int, tuple[tuple, tuple]] = field(default_factory=dict)
+
+
+def _pack_summary(summary: tuple, created_at: float) -> bytes:
+    acc, norm, last_at = summary
+    if last_at is None:
+        return _summary.pack(acc, norm, MAX_AGE)
+    age = min(MAX_AGE - 1, max(0, int((created_at - last_at) * 1000)))
+    return _summary.pack(acc, norm, age)
+
+
+def _encoded(items: list[tuple]) -> list[tuple]:
+    # names too long for the format are left out
+    return [
+        (id, name.encode(), *rest)
+        for id, name, *rest in items
+        if len(name.encode()) <= MAX_NAME_LENGTH
+    ]
+
+
+def dump_snapshot(snapshot: Snapshot) -> bytes:
+    users = _encoded(snapshot.users)
+    foods = _encoded(snapshot.foods)
+    parts = [
+        _header.pack(
+            MAGIC,
+            VERSION,
+            snapshot.created_at,
+            snapshot.satiety_scale,
+            snapshot.pet_scale,
+            len(users),
+            len(foods),
+            len(snapshot.histories),
+        )
+    ]
+    for id, name in users:
+        parts += [_user.pack(id, len(name)), name]
+    for id, name, preferred in foods:
+        parts += [_food.pack(id, preferred, len(name)), name]
+    for user_id, (eat, pet) in snapshot.histories.items():
+        parts.append(_history.pack(user_id))
+        parts.append(_pack_summary(eat, snapshot.created_at))
+        parts.append(_pack_summary(pet, snapshot.created_at))
+    return b"".join(parts)
+
+
+def write_snapshot(path: str, snapshot: Snapshot):
+    # a crash while writing leaves the previous snapshot in place
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(dump_snapshot(snapshot))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+class _Cursor:
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._offset = 0
+
+    def unpack(self, struct_: struct.Struct) -> tuple:
+        values = struct_.unpack_from(self._buffer, self._offset)
+        self._offset += struct_.size
+        return values
+
+    def name(self, length: int) -> str:
+        end = self._offset + length
+        if end > len(self._buffer):
+            raise ValueError("Truncated snapshot")
+        name = bytes(self._buffer[self._offset : end]).decode()
+        self._offset = end
+        return name
+
+    def summary(self, created_at: float) -> tuple:
+        acc, norm, age = self.unpack(_summary)
+        if age == MAX_AGE:
+            return acc, norm, None
+        return acc, norm, created_at - age / 1000
+
+
+def parse_snapshot(buffer) -> Snapshot:
+    cursor = _Cursor(buffer)
+    try:
+        (
+            magic,
+            version,
+            created_at,
+            satiety_scale,
+            pet_scale,
+            n_users,
+            n_foods,
+            n_histories,
+        ) = cursor.unpack(_header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unknown snapshot format")
+        snapshot = Snapshot(created_at, satiety_scale, pet_scale)
+        for _ in range(n_users):
+            id, length = cursor.unpack(_user)
+            snapshot.users.append((id, cursor.name(length)))
+        for _ in range(n_foods):
+            id, preferred, length = cursor.unpack(_food)
+            snapshot.foods.append((id, cursor.name(length), preferred))
+        for _ in range(n_histories):
+            (user_id,) = cursor.unpack(_history)
+            snapshot.histories[user_id] = (
+                cursor.summary(created_at),
+                cursor.summary(created_at),
+            )
+    except struct.error as e:
+        raise ValueError("Truncated snapshot") from e
+    return snapshot
+
+
+def read_snapshot(path: str) -> Snapshot | None:
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return None
+    with file:
+        if not os.fstat(file.fileno()).st_size:
+            return None
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return parse_snapshot(buffer)
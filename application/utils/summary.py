@@ -0,0 +1,50 @@
+from typing import Iterable
+
+
+class Summary:
+    # A user's eats or pets folded into halving weights: the newest event
+    # weighs 1/2, the one before 1/4 and so on. acc / norm is the weighted
+    # success rate of the whole history without keeping the events, and a
+    # history left alone longer than the forget period starts over.
+    # Unlike the old window of the last forget period, events older than it
+    # still count while the user keeps coming back, with the weight of their
+    # place in the history: the one 8 events back weighs 1/256.
+    __slots__ = ("acc", "norm", "last_at")
+
+    def __init__(
+        self, acc: float = 0.0, norm: float = 0.0, last_at: float | None = None
+    ):
+        self.acc = acc
+        self.norm = norm
+        self.last_at = last_at
+
+    def add(self, value: bool, at: float, forget_after: float):
+        if self.last_at is None or at - self.last_at > forget_after:
+            self.acc = self.norm = 0.0
+        self.acc = 0.5 * (self.acc + value)
+        self.norm = 0.5 * (self.norm + 1)
+        self.last_at = at
+
+    def scale(self, now: float, forget_after: float) -> float:
+        if not self.norm or now - self.last_at > forget_after:
+            return 1.0
+        return self.acc / self.norm
+
+    def is_fresh(self, now: float, forget_after: float) -> bool:
+        return self.last_at is not None and now - self.last_at <= forget_after
+
+    def copy(self) -> "Summary":
+        return Summary(self.acc, self.norm, self.last_at)
+
+    def astuple(self) -> tuple[float, float, float | None]:
+        return self.acc, self.norm, self.last_at
+
+
+def fold(values: Iterable[bool]) -> tuple[float, float]:
+    # the (acc, norm) of a history made of values alone, oldest first; it is
+    # merged into an earlier one as acc + (1 - norm) * earlier acc
+    summary = Summary()
+    for value in values:
+        summary.acc = 0.5 * (summary.acc + value)
+        summary.norm = 0.5 * (summary.norm + 1)
+    return summary.acc, summary.norm
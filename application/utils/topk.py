@@ -0,0 +1,133 @@
+import heapq
+import os
+import time
+from collections import deque
+from typing import Hashable
+
+# entries kept per sketch, the count of an entry is overestimated by at most
+# the number of events in its bucket divided by the capacity
+CAT_TOP_CAPACITY = int(os.getenv("CAT_TOP_CAPACITY", "1000"))
+# the window of a query is made of whole buckets
+CAT_TOP_BUCKET = float(os.getenv("CAT_TOP_BUCKET", "60"))
+CAT_TOP_BUCKETS = int(os.getenv("CAT_TOP_BUCKETS", "60"))
+
+
+class SpaceSaving:
+    # Space-Saving heavy hitters: a new key replaces the key with the
+    # smallest count and takes over its count as its error, so a stored
+    # count c means the true count is in [c - error, c], and a key that is
+    # not stored occurred at most min_count times.
+    def __init__(self, capacity: int):
+        self._capacity = capacity
+        self._counts: dict[Hashable, list[int]] = {}
+        # (count, key) with stale entries, fixed up lazily
+        self._heap: list[tuple[int, Hashable]] = []
+
+    def _smallest(self) -> Hashable:
+        while True:
+            count, key = self._heap[0]
+            if key in self._counts and self._counts[key][0] == count:
+                return key
+            heapq.heappop(self._heap)
+
+    def _compact(self):
+        self._heap = [(count, key) for key, (count, _) in self._counts.items()]
+        heapq.heapify(self._heap)
+
+    def add(self, key: Hashable, count: int = 1):
+        if (entry := self._counts.get(key)) is not None:
+            entry[0] += count
+        elif len(self._counts) < self._capacity:
+            entry = self._counts[key] = [count, 0]
+        else:
+            evicted = self._smallest()
+            floor, _ = self._counts.pop(evicted)
+            entry = self._counts[key] = [floor + count, floor]
+        heapq.heappush(self._heap, (entry[0], key))
+        if len(self._heap) > 4 * self._capacity:
+            self._compact()
+
+    @property
+    def min_count(self) -> int:
+        if len(self._counts) < self._capacity:
+            return 0
+        return self._counts[self._smallest()][0]
+
+    def items(self):
+        # (key, count, error)
+        return (
+            (key, count, error) for key, (count, error) in self._counts.items()
+        )
+
+
+class WindowedTopK:
+    def __init__(
+        self,
+        capacity: int = CAT_TOP_CAPACITY,
+        bucket: float = CAT_TOP_BUCKET,
+        buckets: int = CAT_TOP_BUCKETS,
+    ):
+        self._capacity = capacity
+        self._bucket = bucket
+        # (bucket number, sketch), the newest last
+        self._buckets: deque[tuple[int, SpaceSaving]] = deque()
+        self._max_buckets = buckets
+
+    @property
+    def max_window(self) -> float:
+        return self._bucket * self._max_buckets
+
+    def add(self, key: Hashable, now: float | None = None):
+        number = int((time.time() if now is None else now) // self._bucket)
+        if not self._buckets or self._buckets[-1][0] != number:
+            self._buckets.append((number, SpaceSaving(self._capacity)))
+            oldest = number - self._max_buckets
+            while self._buckets[0][0] <= oldest:
+                self._buckets.popleft()
+        self._buckets[-1][1].add(key)
+
+    def top(
+        self, n: int, window: float, now: float | None = None
+    ) -> tuple[float, list[tuple[Hashable, int, int]]]:
+        # the n keys with the highest upper bounds as (key, count, error):
+        # the true count is in [count - error, count]; the window covered is
+        # returned too as it is rounded up to whole buckets
+        number = int((time.time() if now is None else now) // self._bucket)
+        n_buckets = min(self._max_buckets, max(1, -(-window // self._bucket)))
+        first = number - int(n_buckets) + 1
+        sketches = [sketch for b, sketch in self._buckets if b >= first]
+        # a key missing from a full sketch may still have occurred there as
+        # often as the smallest count of that sketch
+        floors = [sketch.min_count for sketch in sketches]
+        upper: dict[Hashable, int] = {}
+        lower: dict[Hashable, int] = {}
+        for sketch, floor in zip(sketches, floors):
+            for key, count, error in sketch.items():
+                upper[key] = upper.get(key, 0) + count - floor
+                lower[key] = lower.get(key, 0) + count - error
+        missing = sum(floors)
+        upper = {key: count + missing for key, count in upper.items()}
+        best = heapq.nlargest(n, upper.items(), key=lambda item: item[1])
+        return n_buckets * self._bucket, [
+            (key, count, count - lower[key]) for key, count in best
+        ]
+
+
+class Leaderboard:
+    # successful pets and feeds by user and eaten foods by name
+    METRICS = ("pets", "feeds", "foods")
+
+    def __init__(self, **kwargs):
+        self._metrics = {
+            metric: WindowedTopK(**kwargs) for metric in self.METRICS
+        }
+
+    def record(self, metric: str, key: Hashable):
+        self._metrics[metric].add(key)
+
+    def top(self, metric: str, n: int, window: float):
+        return self._metrics[metric].top(n, window)
+
+    @property
+    def max_window(self) -> float:
+        return self._metrics[self.METRICS[0]].max_window
@@ -0,0 +1,149 @@
+import asyncio
+import functools
+import inspect
+import itertools
+import json
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# fraction of requests traced, the spans are appended to CAT_TRACE_PATH in
+# the Chrome trace-event format (chrome://tracing, ui.perfetto.dev)
+TRACE_SAMPLE_RATE = float(os.getenv("CAT_TRACE_SAMPLE", "0"))
+TRACE_PATH = os.getenv("CAT_TRACE_PATH", "cat_trace.json")
+TRACE_FLUSH_EVENTS = 1000
+TRACE_FLUSH_INTERVAL = 1.0
+
+
+def _now() -> int:
+    return time.perf_counter_ns() // 1000
+
+
+class Trace:
+    __slots__ = ("id", "tracer", "lanes")
+
+    def __init__(self, id: int, tracer: "Tracer"):
+        self.id = id
+        self.tracer = tracer
+        # every task of a request gets its own row, so concurrent spans of
+        # one request don't overlap
+        self.lanes: dict[asyncio.Task | None, int] = {}
+
+    def lane(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if (lane := self.lanes.get(task)) is None:
+            lane = self.lanes[task] = len(self.lanes)
+        return self.id * 1000 + lane
+
+
+_current_trace: ContextVar[Trace | None] = ContextVar(
+    "current_trace", default=None
+)
+
+
+class Tracer:
+    def __init__(
+        self, sample_rate: float = TRACE_SAMPLE_RATE, path: str = TRACE_PATH
+    ):
+        self.sample_rate = sample_rate
+        self._path = path
+        self._ids = itertools.count(1)
+        self._events: list[str] = []
+        self._file = None
+        self._flushed_at = time.monotonic()
+        self._pid = os.getpid()
+
+    @contextmanager
+    def request(self, name: str, **args):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            yield None
+            return
+        trace = Trace(next(self._ids), self)
+        token = _current_trace.set(trace)
+        try:
+            with span(name, **args):
+                yield trace
+        finally:
+            _current_trace.reset(token)
+            if time.monotonic() - self._flushed_at > TRACE_FLUSH_INTERVAL:
+                self.flush()
+
+    def add(self, name: str, trace: Trace, started: int, args: dict):
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": started,
+            "dur": _now() - started,
+            "pid": self._pid,
+            "tid": trace.lane(),
+            "args": {"trace": trace.id, **args},
+        }
+        self._events.append(json.dumps(event, default=str))
+        if len(self._events) >= TRACE_FLUSH_EVENTS:
+            self.flush()
+
+    def flush(self):
+        self._flushed_at = time.monotonic()
+        if not self._events:
+            return
+        if self._file is None:
+            # the JSON array format allows an unterminated array, so events
+            # are appended as they come
+            self._file = open(self._path, "w")
+            self._file.write("[\n")
+        self._file.write(",\n".join(self._events) + ",\n")
+        self._file.flush()
+        self._events = []
+
+    def close(self):
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+tracer = Tracer()
+
+
+@contextmanager
+def span(name: str, **args):
+    if (trace := _current_trace.get()) is None:
+        yield
+        return
+    started = _now()
+    try:
+        yield
+    finally:
+        trace.tracer.add(name, trace, started, args)
+
+
+def traced(name: str | None = None):
+    # untraced calls only pay for a context variable lookup
+    def decorator(func):
+        span_name = name or func.__qualname__
+        if inspect.iscoroutinefunction(func):
+
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                if _current_trace.get() is None:
+                    return await func(*args, **kwargs)
+                with span(span_name):
+                    return await func(*args, **kwargs)
+
+        else:
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if _current_trace.get() is None:
+                    return func(*args, **kwargs)
+                with span(span_name):
+                    return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,387 @@
+import asyncio
+import datetime
+import fcntl
+import os
+import struct
+import time
+import zlib
+from pathlib import Path
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from application.utils.cruds import StatCRUD
+from config.db import async_session_injector
+from config.logger import logger
+
+# Stats are appended to a local log before they reach the database, so a
+# request waits for a disk write instead of a commit and the cat keeps
+# deciding while the database is slow or restarting. The log is a directory
+# of segments
+#   <CAT_WAL_PATH>/<segment number, 16 digits>.wal
+# of fixed size records, a crc32 of the rest and
+#   kind, cat id, user id, food id, at, is_success, is_cat_was_fed
+# The last number given to a segment is kept in <CAT_WAL_PATH>/last, so the
+# numbers keep growing after the shipped segments are deleted.
+# Appends are written and fsynced in groups by one task, off the loop. The
+# writer holds a lock on its segment, a segment nobody holds is sealed. The
+# WalShipper inserts the records in large batches in one transaction with
+# the position shipped so far and deletes the segments behind it, so a
+# record reaches the database once even when two services share the log
+# during a socket handoff. Histories the cat reads from user_stat_summary
+# get the records the shipper hasn't inserted yet folded in, see
+# Cat._load_histories. "" turns the log off.
+CAT_WAL_PATH = os.getenv("CAT_WAL_PATH", "")
+CAT_WAL_SEGMENT_SIZE = int(os.getenv("CAT_WAL_SEGMENT_SIZE", str(16 << 20)))
+CAT_WAL_SHIP_INTERVAL = float(os.getenv("CAT_WAL_SHIP_INTERVAL", "0.5"))
+CAT_WAL_SHIP_BATCH = int(os.getenv("CAT_WAL_SHIP_BATCH", "5000"))
+# the last shipping on stop gives up after this many seconds, what is left
+# is shipped by the next start
+CAT_WAL_SHIP_TIMEOUT = float(os.getenv("CAT_WAL_SHIP_TIMEOUT", "5"))
+
+EAT = 1
+PET = 2
+
+_crc = struct.Struct(">I")
+_body = struct.Struct(">BIIId??")
+RECORD_SIZE = _crc.size + _body.size
+SUFFIX = ".wal"
+MARKER = "last"
+
+
+def eat_record(
+    cat_id: int,
+    user_id: int,
+    food_id: int,
+    is_success: bool,
+    is_cat_was_fed: bool,
+) -> tuple:
+    return (
+        EAT,
+        cat_id,
+        user_id,
+        food_id,
+        time.time(),
+        is_success,
+        is_cat_was_fed,
+    )
+
+
+def pet_record(cat_id: int, user_id: int, is_success: bool) -> tuple:
+    return (PET, cat_id, user_id, 0, time.time(), is_success, False)
+
+
+def _encode(record: tuple) -> bytes:
+    body = _body.pack(*record)
+    return _crc.pack(zlib.crc32(body)) + body
+
+
+def _segment_path(path: Path, number: int) -> Path:
+    return path / f"{number:016d}{SUFFIX}"
+
+
+def segments(path: Path) -> list[int]:
+    return sorted(
+        int(entry.stem)
+        for entry in path.glob(f"*{SUFFIX}")
+        if entry.stem.isdigit()
+    )
+
+
+def _is_sealed(file) -> bool:
+    try:
+        fcntl.flock(file, fcntl.LOCK_SH | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+def read_records(
+    path: Path, segment: int, offset: int, limit: int | None = None
+) -> tuple[list[tuple], tuple[int, int]]:
+    # up to limit records from the position, all of them without a limit,
+    # and the position after them
+    records = []
+    for number in segments(path):
+        if number < segment:
+            continue
+        if number > segment:
+            segment, offset = number, 0
+        size = None if limit is None else (limit - len(records)) * RECORD_SIZE
+        try:
+            with open(_segment_path(path, number), "rb") as file:
+                # the lock is taken before the read, a sealed segment
+                # doesn't grow after it
+                sealed = _is_sealed(file)
+                file.seek(offset)
+                data = file.read(size)
+        except FileNotFoundError:
+            # shipped and deleted by another service
+            continue
+        end = len(data) - len(data) % RECORD_SIZE
+        for start in range(0, end, RECORD_SIZE):
+            (crc,) = _crc.unpack_from(data, start)
+            body = data[start + _crc.size : start + RECORD_SIZE]
+            if zlib.crc32(body) == crc:
+                records.append(_body.unpack(body))
+            elif not sealed:
+                # being written right now
+                end = start
+                break
+            else:
+                logger.warning(
+                    f"corrupted record at {number}:{offset + start}"
+                )
+        offset += end
+        if len(data) == size or not sealed:
+            break
+        # the whole sealed segment is read, torn tail records are dropped
+        segment, offset = number + 1, 0
+    return records, (segment, offset)
+
+
+def truncate(path: Path, segment: int):
+    # the segments before the shipped position
+    for number in segments(path):
+        if number >= segment:
+            break
+        _segment_path(path, number).unlink(missing_ok=True)
+
+
+def _name(path: Path) -> str:
+    return str(path.resolve())
+
+
+def _stats(records: list[tuple]) -> tuple[list[dict], list[dict]]:
+    eat_stats, pet_stats = [], []
+    for kind, cat_id, user_id, food_id, at, is_success, fed in records:
+        at = datetime.datetime.utcfromtimestamp(at)
+        if kind == EAT:
+            eat_stats.append(
+                {
+                    "cat_id": cat_id,
+                    "user_id": user_id,
+                    "food_id": food_id,
+                    "is_success": is_success,
+                    "is_cat_was_fed": fed,
+                    "eat_at": at,
+                }
+            )
+        else:
+            pet_stats.append(
+                {
+                    "cat_id": cat_id,
+                    "user_id": user_id,
+                    "is_success": is_success,
+                    "pet_at": at,
+                }
+            )
+    return eat_stats, pet_stats
+
+
+class WriteAheadLog:
+    def __init__(
+        self,
+        path: str = CAT_WAL_PATH,
+        segment_size: int = CAT_WAL_SEGMENT_SIZE,
+    ):
+        self._path = Path(path)
+        self._path.mkdir(parents=True, exist_ok=True)
+        self._segment_size = segment_size
+        self._fd = None
+        self._segment = None
+        self._size = 0
+        self._buffer = bytearray()
+        self._waiters: list[asyncio.Future] = []
+        self._flushing = None
+        self._appended = 0
+        self._writes = 0
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def name(self) -> str:
+        # the checkpoint of the log, the same for every service using it
+        return _name(self._path)
+
+    async def shipped(self, session: AsyncSession) -> tuple[int, int]:
+        return await StatCRUD.get_wal_checkpoint(self.name, session=session)
+
+    async def unshipped(
+        self, position: tuple[int, int], cat_id: int, user_ids: list[int]
+    ) -> list[tuple]:
+        # the users' records after the shipped position, in order
+        records, _ = await asyncio.to_thread(
+            read_records, self._path, *position
+        )
+        user_ids = set(user_ids)
+        return [
+            record
+            for record in records
+            if record[1] == cat_id and record[2] in user_ids
+        ]
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "appended": self._appended,
+            "writes": self._writes,
+            "segment": self._segment or 0,
+        }
+
+    def _open_segment(self):
+        # a new segment is locked before it is linked in, so a shipper never
+        # takes it for a sealed one
+        temporary = self._path / f".{os.getpid()}.{id(self)}.tmp"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        marker = os.open(self._path / MARKER, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # the services sharing the log number their segments in turn, the
+            # number is saved before it is used
+            fcntl.flock(marker, fcntl.LOCK_EX)
+            last = int(os.pread(marker, 16, 0) or b"0")
+            number = max(last, max(segments(self._path), default=0)) + 1
+            os.pwrite(marker, b"%016d" % number, 0)
+            os.fsync(marker)
+            os.link(temporary, _segment_path(self._path, number))
+        finally:
+            os.close(marker)
+        os.unlink(temporary)
+        self._fd, self._segment, self._size = fd, number, 0
+
+    def _close_segment(self):
+        # the lock goes with the descriptor, the segment is sealed
+        os.close(self._fd)
+        self._fd = None
+
+    def _write(self, data: bytes):
+        # runs in a thread, one write at a time
+        if self._fd is None:
+            self._open_segment()
+        try:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(self._fd, view) :]
+            os.fsync(self._fd)
+        except OSError:
+            # the records after a torn one go to a new segment
+            self._close_segment()
+            raise
+        self._size += len(data)
+        if self._size >= self._segment_size:
+            self._close_segment()
+
+    async def _flush(self):
+        # the appends that come during a write go together into the next one
+        try:
+            while self._waiters:
+                data, waiters = bytes(self._buffer), self._waiters
+                self._buffer, self._waiters = bytearray(), []
+                try:
+                    await asyncio.to_thread(self._write, data)
+                except OSError as e:
+                    logger.warning(f"write-ahead log write failed: {e!r}")
+                    for waiter in waiters:
+                        if not waiter.done():
+                            waiter.set_exception(e)
+                    continue
+                self._writes += 1
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_result(None)
+        finally:
+            self._flushing = None
+
+    async def append(self, records: list[tuple]):
+        # returns once the records are on disk
+        self._buffer += b"".join(map(_encode, records))
+        self._appended += len(records)
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if self._flushing is None:
+            self._flushing = asyncio.create_task(self._flush())
+        await waiter
+
+    async def close(self):
+        if self._flushing:
+            await asyncio.shield(self._flushing)
+        if self._fd is not None:
+            self._close_segment()
+
+
+class WalShipper:
+    def __init__(
+        self,
+        path: str | Path,
+        forget_after: float,
+        interval: float = CAT_WAL_SHIP_INTERVAL,
+        batch: int = CAT_WAL_SHIP_BATCH,
+    ):
+        self._path = Path(path)
+        self._name = _name(self._path)
+        self._forget_after = forget_after
+        self._interval = interval
+        self._batch = batch
+        self._shipping = None
+        self._shipped = 0
+        self._failures = 0
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {"shipped": self._shipped, "failures": self._failures}
+
+    @async_session_injector
+    async def _ship_batch(self, session: AsyncSession) -> int:
+        # the checkpoint row stays locked until the commit, so services
+        # sharing the log ship one after another
+        segment, offset = await StatCRUD.lock_wal_checkpoint(
+            self._name, session=session
+        )
+        records, position = await asyncio.to_thread(
+            read_records, self._path, segment, offset, self._batch
+        )
+        if position == (segment, offset):
+            return 0
+        eat_stats, pet_stats = _stats(records)
+        await StatCRUD.ship_stats(
+            self._name,
+            *position,
+            eat_stats,
+            pet_stats,
+            self._forget_after,
+            session=session,
+        )
+        self._shipped += len(records)
+        await asyncio.to_thread(truncate, self._path, position[0])
+        return len(records)
+
+    async def ship(self) -> int:
+        shipped = 0
+        while (count := await self._ship_batch()) == self._batch:
+            shipped += count
+        return shipped + count
+
+    async def _shipping_loop(self):
+        while True:
+            try:
+                await self.ship()
+            except Exception as e:
+                self._failures += 1
+                logger.warning(f"shipping the write-ahead log failed: {e!r}")
+            await asyncio.sleep(self._interval)
+
+    def start(self):
+        if self._shipping is None:
+            self._shipping = asyncio.create_task(self._shipping_loop())
+
+    async def stop(self, timeout: float = CAT_WAL_SHIP_TIMEOUT):
+        if self._shipping:
+            self._shipping.cancel()
+            self._shipping = None
+        try:
+            async with asyncio.timeout(timeout):
+                await self.ship()
+        except Exception as e:
+            logger.warning(f"the write-ahead log is left to ship: {e!r}")
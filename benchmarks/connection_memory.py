@@ -0,0 +1,54 @@
+import argparse
+import gc
+import tracemalloc
+
+from application.network.server import AsyncTcpConnection, AsyncUdpConnection
+
+# Bytes a server holds per idle peer: the connection object and the
+# registry entries pointing at it. Peer addresses are created before the
+# measurement starts, a real server gets them from the socket layer.
+PEERS = (10_000, 100_000, 1_000_000)
+
+
+def _addresses(n: int) -> list[tuple[str, int]]:
+    return [
+        (f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", i) for i in range(n)
+    ]
+
+
+def _tcp_peers(addresses):
+    return [
+        AsyncTcpConnection(host, port, None, None) for host, port in addresses
+    ]
+
+
+def _udp_peers(addresses):
+    # what UdpConnectionPool keeps for every peer it has heard from
+    connections = {}
+    for address in addresses:
+        connections[address] = AsyncUdpConnection(*address, None)
+    return connections, list(connections.values())
+
+
+def measure(make, n: int) -> float:
+    addresses = _addresses(n)
+    gc.collect()
+    tracemalloc.start()
+    peers = make(addresses)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del peers
+    return size / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--peers", type=int, nargs="*", default=PEERS)
+    args = parser.parse_args()
+    for name, make in (("tcp", _tcp_peers), ("udp", _udp_peers)):
+        for n in args.peers:
+            print(f"{name:>4} {n:>9} peers: {measure(make, n):7.1f} B/peer")
+
+
+if __name__ == "__main__":
+    main()
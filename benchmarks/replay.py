@@ -0,0 +1,114 @@
+import argparse
+import asyncio
+import time
+
+from application.network.client import AsyncTcpClient, AsyncUdpClient
+from application.utils.capture import read_capture
+
+# Resends a capture recorded with CAT_CAPTURE_PATH against a running
+# service. Every captured peer gets its own client, so connection-level
+# state such as the binary mode negotiation is replayed too. Run the service
+# with CAT_RANDOM_SEED on the same database state for repeatable decisions.
+READ_SIZE = 1 << 16
+
+
+class Peer:
+    def __init__(self, proto: str, host: str, port: int):
+        self._proto = proto
+        self._address = (host, port)
+        self._client = None
+        self._draining = None
+        self.received = 0
+
+    async def _drain(self, client):
+        try:
+            while data := await client.read(READ_SIZE):
+                self.received += len(data)
+        except (OSError, ConnectionError):
+            pass
+
+    async def send(self, data: bytes):
+        if self._client is None:
+            if self._proto == "tcp":
+                self._client = AsyncTcpClient()
+            else:
+                self._client = AsyncUdpClient()
+            await self._client.open(*self._address)
+            self._draining = asyncio.create_task(self._drain(self._client))
+        try:
+            await self._client.write(data)
+        except (OSError, ConnectionError):
+            # the service hung up, the next payload opens a new connection
+            await self.close()
+
+    async def close(self):
+        if self._client is None:
+            return
+        self._draining.cancel()
+        try:
+            await self._client.close(force=True)
+        except OSError:
+            pass
+        self._client = None
+
+
+async def replay(
+    path: str, host: str, ports: dict, speed: float, drain: float
+):
+    records = list(read_capture(path))
+    if not records:
+        print("empty capture")
+        return
+    loop = asyncio.get_running_loop()
+    peers: dict[tuple[str, str], Peer] = {}
+    first_at = records[0][0]
+    started = loop.time()
+    sent = 0
+    for t, proto, peer, data in records:
+        if speed:
+            # keeps the captured gaps, divided by the speed
+            delay = started + (t - first_at) / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if (key := (proto, peer)) not in peers:
+            peers[key] = Peer(proto, host, ports[proto])
+        await peers[key].send(data)
+        sent += len(data)
+    elapsed = loop.time() - started
+    await asyncio.sleep(drain)
+    received = sum(peer.received for peer in peers.values())
+    await asyncio.gather(*(peer.close() for peer in peers.values()))
+    print(
+        f"{len(records)} payloads from {len(peers)} peers, {sent} bytes "
+        f"sent in {elapsed:.3f} s ({len(records) / max(elapsed, 1e-9):.0f} "
+        f"payloads/s), {received} bytes received"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("capture")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--tcp-port", type=int, default=8000)
+    parser.add_argument("--udp-port", type=int, default=8001)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1.0,
+        help="1 replays in real time, N is N times faster, 0 is max speed",
+    )
+    parser.add_argument(
+        "--drain",
+        type=float,
+        default=2.0,
+        help="seconds to wait for answers after the last payload",
+    )
+    args = parser.parse_args()
+    ports = {"tcp": args.tcp_port, "udp": args.udp_port}
+    started = time.perf_counter()
+    asyncio.run(replay(args.capture, args.host, ports, args.speed, args.drain))
+    print(f"total {time.perf_counter() - started:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+# Cold start of a replica: the import time of application.cat and the time
+# from spawning the service process until its first TCP request is served.
+# The service uses the database configured by the DB_* variables.
+IMPORT = (
+    "import time; started = time.perf_counter(); import application.cat; "
+    "print(time.perf_counter() - started)"
+)
+REQUEST = b"@startup~"
+
+
+def import_time() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+async def _serve(port: int):
+    from application.cat import CatService
+
+    service = await CatService.create(tcp_port=port, udp_port=port + 1)
+    await service.start()
+
+
+def _request(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=5) as sock:
+            sock.sendall(REQUEST)
+            # an unhappy Cat hangs up instead of answering, the request was
+            # served either way
+            sock.recv(64)
+            return True
+    except OSError:
+        return False
+
+
+def first_response_time(port: int, timeout: float) -> float:
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.startup", "--serve", str(port)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if _request(port):
+                return time.perf_counter() - started
+            time.sleep(0.005)
+        raise TimeoutError("The service didn't answer")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        asyncio.run(_serve(args.serve))
+        return
+    imports = [import_time() for _ in range(args.runs)]
+    print(f"import application.cat: {statistics.median(imports) * 1e3:.1f} ms")
+    starts = [
+        first_response_time(args.port, args.timeout) for _ in range(args.runs)
+    ]
+    print(f"spawn to first response: {statistics.median(starts) * 1e3:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
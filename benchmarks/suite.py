@@ -0,0 +1,496 @@
+import argparse
+import asyncio
+import datetime
+import json
+import platform
+import sys
+import time
+from typing import Callable
+
+from sqlalchemy.dialects.postgresql.asyncpg import dialect as asyncpg_dialect
+
+from application.cat import Cat, CatService, History
+from application.network.server import AsyncTcpConnection
+from application.utils.cruds import UserCRUD, FoodCRUD, StatCRUD
+from application.utils.models import User, Food, EatStat, UserStatSummary
+from application.utils.summary import Summary, fold
+from config.logger import logger
+
+# Microbenchmarks of the hot paths: the text frame parser, the scoring and
+# every CRUD method. The CRUDs run against FakeSession, which compiles each
+# statement for PostgreSQL the way the engine does, cache included, and
+# answers with canned rows, so a CRUD benchmark is the Python side of a
+# query without the round trip. SQLite can't stand in for the database,
+# the CRUDs use PostgreSQL upserts, arrays and COPY.
+#
+#   python -m benchmarks.suite run --save baseline.json
+#   python -m benchmarks.suite compare baseline.json --threshold 10
+#
+# compare runs the suite again, or reads a second results file, and exits
+# with 1 when a benchmark got slower than the baseline by more than the
+# threshold percent, or when a benchmark of the baseline didn't run.
+MIN_TIME = 0.1
+REPEAT = 5
+THRESHOLD = 10.0
+
+NOW = datetime.datetime(2026, 10, 19)
+
+BENCHMARKS: dict[str, Callable[[], Callable]] = {}
+
+
+def benchmark(name: str):
+    # registers a setup, it returns the sync or async callable to time
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+class FakeResult:
+    def __init__(self, rows: list):
+        self._rows = rows
+        self.rowcount = len(rows)
+
+    def scalar(self):
+        return self._rows[0] if self._rows else None
+
+    def scalars(self) -> "FakeResult":
+        return self
+
+    def all(self) -> list:
+        return self._rows
+
+    def one(self):
+        return self._rows[0]
+
+
+class FakeDriverConnection:
+    async def copy_records_to_table(self, table: str, records):
+        for _ in records:
+            pass
+
+
+class FakeConnection:
+    async def get_raw_connection(self):
+        return self
+
+    @property
+    def driver_connection(self) -> FakeDriverConnection:
+        return FakeDriverConnection()
+
+
+class FakeSession:
+    def __init__(self, rows: list = ()):
+        self._rows = list(rows)
+        self._dialect = asyncpg_dialect()
+        self._compiled = {}
+
+    async def execute(self, statement, params=None) -> FakeResult:
+        # what Connection.execute does before the driver is called
+        if isinstance(params, list):
+            params = params[0]
+        compiled, extracted, _, _ = statement._compile_w_cache(
+            dialect=self._dialect,
+            compiled_cache=self._compiled,
+            column_keys=sorted(params or ()),
+            for_executemany=False,
+            schema_translate_map=None,
+        )
+        compiled.construct_params(params, extracted_parameters=extracted)
+        return FakeResult(self._rows)
+
+    async def connection(self) -> FakeConnection:
+        return FakeConnection()
+
+    async def commit(self):
+        pass
+
+
+def _names(prefix: str, n: int) -> list[str]:
+    return [f"{prefix}{i}" for i in range(n)]
+
+
+def _users(n: int) -> list[User]:
+    return [User(id=i, name=name) for i, name in enumerate(_names("u", n))]
+
+
+def _foods(n: int) -> list[Food]:
+    return [
+        Food(id=i, name=name, preferred_by_the_cat=i % 2 == 0)
+        for i, name in enumerate(_names("f", n))
+    ]
+
+
+def _parse(data: list[bytes]):
+    # the service's own parsing, on a service that doesn't listen anywhere
+    service = CatService.__new__(CatService)
+    connection = AsyncTcpConnection("127.0.0.1", 0, None, None)
+
+    def parse():
+        for chunk in data:
+            service._data_preprocessing(connection, chunk)
+
+    return parse
+
+
+@benchmark("parse.one_frame")
+def _parse_one_frame():
+    return _parse([b"@alice~"])
+
+
+@benchmark("parse.100_frames")
+def _parse_many_frames():
+    return _parse([b"".join(b"@%s~" % n.encode() for n in _names("u", 100))])
+
+
+@benchmark("parse.split_frame")
+def _parse_split_frame():
+    return _parse([b"@alice", b"bob", b"~@carol~"])
+
+
+@benchmark("parse.100_feeds")
+def _parse_feeds():
+    return _parse([b"@alice - fish~" * 100])
+
+
+@benchmark("parse.100_cat_frames")
+def _parse_cat_frames():
+    return _parse([b"".join(b"@7:%s~" % n.encode() for n in _names("u", 100))])
+
+
+@benchmark("score.summary_add")
+def _summary_add():
+    summary = Summary()
+    return lambda: summary.add(True, 1.0, 300)
+
+
+@benchmark("score.summary_scale")
+def _summary_scale():
+    summary = Summary(0.7, 0.9, 1.0)
+    return lambda: summary.scale(2.0, 300)
+
+
+@benchmark("score.fold_64")
+def _fold():
+    values = [i % 3 != 0 for i in range(64)]
+    return lambda: fold(values)
+
+
+@benchmark("score.happiness_scale")
+def _happiness_scale():
+    cat = Cat(seed=1)
+    return lambda: cat.happiness_scale
+
+
+@benchmark("score.history_scale")
+def _history_scale():
+    cat, summary = Cat(seed=1), Summary(0.7, 0.9, time.time())
+    return lambda: cat._history_scale(summary)
+
+
+@benchmark("score.satiety_scale")
+def _satiety_scale():
+    cat, session = Cat(seed=1), FakeSession([0.4])
+    return lambda: cat._get_satiety_scale(session=session)
+
+
+@benchmark("score.pet_scale")
+def _pet_scale():
+    cat, session = Cat(seed=1), FakeSession([0.6])
+    return lambda: cat._get_pet_scale(session=session)
+
+
+@benchmark("score.predisposition_by_eat_scale")
+def _predisposition_by_eat_scale():
+    # a known user with a cached history, no query
+    cat = Cat(seed=1, snapshot_path="")
+    cat._users.put("u0", _users(1)[0])
+    history = History()
+    for i in range(64):
+        history.eat.add(i % 3 != 0, time.time(), 300)
+    cat._histories.put(0, history)
+    return lambda: cat._predisposition_by_eat_scale("u0")
+
+
+@benchmark("score.predisposition_to_eat")
+def _predisposition_to_eat():
+    cat = Cat(seed=1)
+    return lambda: cat._predisposition_to_eat(0.6, 0.8)
+
+
+@benchmark("score.predisposition_to_pet")
+def _predisposition_to_pet():
+    cat = Cat(seed=1)
+    return lambda: cat._predisposition_to_pet(0.6, 0.8)
+
+
+def _crud(rows: list, method, *args):
+    session = FakeSession(rows)
+    return lambda: method(*args, session=session)
+
+
+@benchmark("crud.user.add_new_user")
+def _add_new_user():
+    return _crud(_users(1), UserCRUD.add_new_user, "u0")
+
+
+@benchmark("crud.user.get_user")
+def _get_user():
+    return _crud(_users(1), UserCRUD.get_user, "u0")
+
+
+@benchmark("crud.user.get_or_add_users_100")
+def _get_or_add_users():
+    return _crud(_users(100), UserCRUD.get_or_add_users, _names("u", 100))
+
+
+@benchmark("crud.user.get_users_100")
+def _get_users():
+    return _crud(_users(100), UserCRUD.get_users, _names("u", 100))
+
+
+@benchmark("crud.user.copy_users_1000")
+def _copy_users():
+    return _crud([], UserCRUD.copy_users, _names("u", 1000))
+
+
+@benchmark("crud.food.add_new_food")
+def _add_new_food():
+    return _crud(_foods(1), FoodCRUD.add_new_food, "f0", True)
+
+
+@benchmark("crud.food.get_food")
+def _get_food():
+    return _crud(_foods(1), FoodCRUD.get_food, "f0")
+
+
+@benchmark("crud.food.get_or_add_foods_100")
+def _get_or_add_foods():
+    return _crud(
+        _foods(100),
+        FoodCRUD.get_or_add_foods,
+        _names("f", 100),
+        [True] * 100,
+    )
+
+
+@benchmark("crud.food.get_foods_100")
+def _get_foods():
+    return _crud(_foods(100), FoodCRUD.get_foods, _names("f", 100))
+
+
+@benchmark("crud.food.copy_foods_1000")
+def _copy_foods():
+    return _crud([], FoodCRUD.copy_foods, _names("f", 1000), [True] * 1000)
+
+
+@benchmark("crud.food.is_food_preferred_by_the_cat")
+def _is_food_preferred():
+    return _crud([True], FoodCRUD.is_food_preferred_by_the_cat, "f0")
+
+
+@benchmark("crud.stat.get_summaries_100")
+def _get_summaries():
+    summaries = [UserStatSummary(cat_id=0, user_id=i) for i in range(100)]
+    return _crud(summaries, StatCRUD.get_summaries, 0, list(range(100)))
+
+
+@benchmark("crud.stat.get_satiety_scale")
+def _get_satiety_scale():
+    return _crud([0.5], StatCRUD.get_satiety_scale, 0, 60, NOW)
+
+
+@benchmark("crud.stat.get_pet_scale")
+def _get_pet_scale():
+    return _crud([0.5], StatCRUD.get_pet_scale, 0, 300, 64, NOW)
+
+
+@benchmark("crud.stat.get_expired_eat_stats")
+def _get_expired_eat_stats():
+    return _crud([], StatCRUD.get_expired_eat_stats, NOW, 0, 10000)
+
+
+@benchmark("crud.stat.get_expired_pet_stats")
+def _get_expired_pet_stats():
+    return _crud([], StatCRUD.get_expired_pet_stats, NOW, 0, 10000)
+
+
+@benchmark("crud.stat.delete_stats_1000")
+def _delete_stats():
+    return _crud([], StatCRUD.delete_stats, EatStat, list(range(1000)))
+
+
+@benchmark("crud.stat.add_eat_stat")
+def _add_eat_stat():
+    return _crud([1], StatCRUD.add_eat_stat, 0, 1, 1, True, False, 300)
+
+
+@benchmark("crud.stat.add_pet_stat")
+def _add_pet_stat():
+    return _crud([1], StatCRUD.add_pet_stat, 0, 1, True, 300)
+
+
+@benchmark("crud.stat.add_stats_200")
+def _add_stats():
+    eat_stats = [
+        {
+            "cat_id": 0,
+            "user_id": i,
+            "food_id": i % 10,
+            "is_success": i % 2 == 0,
+            "is_cat_was_fed": False,
+        }
+        for i in range(100)
+    ]
+    pet_stats = [
+        {"cat_id": 0, "user_id": i, "is_success": i % 3 == 0}
+        for i in range(100)
+    ]
+    return _crud([], StatCRUD.add_stats, 0, eat_stats, pet_stats, 300)
+
+
+@benchmark("crud.stat.lock_wal_checkpoint")
+def _lock_wal_checkpoint():
+    return _crud([(1, 0)], StatCRUD.lock_wal_checkpoint, "wal")
+
+
+@benchmark("crud.stat.ship_stats_200")
+def _ship_stats():
+    eat_stats = [
+        {
+            "cat_id": i % 4,
+            "user_id": i,
+            "food_id": i % 10,
+            "is_success": i % 2 == 0,
+            "is_cat_was_fed": False,
+            "eat_at": NOW,
+        }
+        for i in range(100)
+    ]
+    pet_stats = [
+        {
+            "cat_id": i % 4,
+            "user_id": i,
+            "is_success": i % 3 == 0,
+            "pet_at": NOW,
+        }
+        for i in range(100)
+    ]
+    return _crud(
+        [], StatCRUD.ship_stats, "wal", 1, 0, eat_stats, pet_stats, 300
+    )
+
+
+async def _round(func: Callable, number: int, is_async: bool) -> float:
+    started = time.perf_counter()
+    if is_async:
+        for _ in range(number):
+            await func()
+    else:
+        for _ in range(number):
+            func()
+    return time.perf_counter() - started
+
+
+async def measure(func: Callable, min_time: float, repeat: int) -> float:
+    # seconds per call, the best of repeat rounds that each last at least
+    # min_time; the warm-up call tells a coroutine from a plain result
+    if is_async := asyncio.iscoroutine(result := func()):
+        await result
+    number = 1
+    while (elapsed := await _round(func, number, is_async)) < min_time:
+        number *= 2 if elapsed * 10 > min_time else 10
+    best = elapsed
+    for _ in range(repeat - 1):
+        best = min(best, await _round(func, number, is_async))
+    return best / number
+
+
+async def run(names: list[str], min_time: float, repeat: int) -> dict:
+    results = {}
+    for name in names:
+        func = BENCHMARKS[name]()
+        results[name] = await measure(func, min_time, repeat)
+        print(f"{name:<52} {results[name] * 1e6:10.2f} us")
+    return {
+        "python": platform.python_version(),
+        "created_at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    # the names of the benchmarks slower than the baseline by more than
+    # threshold percent, or gone from the current results
+    regressed = []
+    for name in baseline["results"].keys() - current["results"].keys():
+        regressed.append(name)
+        print(f"{name:<52} {'MISSING':>10}")
+    for name, seconds in current["results"].items():
+        if (base := baseline["results"].get(name)) is None:
+            print(f"{name:<52} {'new':>10}")
+            continue
+        change = (seconds / base - 1) * 100
+        mark = ""
+        if change > threshold:
+            regressed.append(name)
+            mark = "  REGRESSED"
+        print(
+            f"{name:<52} {base * 1e6:10.2f} us {seconds * 1e6:10.2f} us "
+            f"{change:+7.1f}%{mark}"
+        )
+    return regressed
+
+
+def _load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+    for command in ("run", "compare"):
+        sub = commands.add_parser(command)
+        sub.add_argument("--filter", default="", help="a name prefix")
+        sub.add_argument("--min-time", type=float, default=MIN_TIME)
+        sub.add_argument("--repeat", type=int, default=REPEAT)
+        sub.add_argument("--save", help="write the results as JSON")
+    compare_parser = commands.choices["compare"]
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument(
+        "current", nargs="?", help="results to compare instead of a new run"
+    )
+    compare_parser.add_argument("--threshold", type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    # the log sinks would measure the terminal
+    logger.remove()
+    if args.command == "compare" and args.current:
+        current = _load(args.current)
+    else:
+        names = [name for name in BENCHMARKS if name.startswith(args.filter)]
+        current = asyncio.run(run(names, args.min_time, args.repeat))
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(current, file, indent=2)
+    if args.command == "compare":
+        print()
+        baseline = _load(args.baseline)
+        # the benchmarks left out by the filter aren't missing
+        baseline["results"] = {
+            name: seconds
+            for name, seconds in baseline["results"].items()
+            if name.startswith(args.filter)
+        }
+        if regressed := compare(baseline, current, args.threshold):
+            print(
+                f"{len(regressed)} benchmarks missing or regressed over "
+                f"{args.threshold}%"
+            )
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+from application.network.client import AsyncTcpClient, AsyncUnixClient
+from application.network.server import AsyncTcpServer, AsyncUnixServer
+
+# Round trips through the service listeners with an echo handler instead of
+# the Cat, so only the transport is measured and no database is needed.
+REQUEST = b"@alice~"
+
+
+async def _echo(connection):
+    try:
+        while True:
+            await connection.write(await connection.read(4096))
+    except ConnectionError:
+        pass
+
+
+async def _serve(server):
+    served = set()
+    while True:
+        for connection in server.connections:
+            if connection not in served:
+                served.add(connection)
+                asyncio.create_task(_echo(connection))
+        await asyncio.sleep(0.001)
+
+
+async def _round_trip(client) -> float:
+    started = time.perf_counter()
+    await client.write(REQUEST)
+    received = 0
+    while received < len(REQUEST):
+        received += len(await client.read(4096))
+    return time.perf_counter() - started
+
+
+async def _latency(make_client, address, requests: int) -> list[float]:
+    client = await make_client().open(*address)
+    latencies = [await _round_trip(client) for _ in range(requests)]
+    await client.close()
+    return latencies
+
+
+async def _throughput(make_client, address, clients: int, duration: float):
+    done = 0
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal done
+        client = await make_client().open(*address)
+        while time.perf_counter() < deadline:
+            await _round_trip(client)
+            done += 1
+        await client.close()
+
+    await asyncio.gather(*(worker() for _ in range(clients)))
+    return done / duration
+
+
+def _report(name: str, latencies: list[float], rps: float):
+    latencies = sorted(latencies)
+    p50 = latencies[len(latencies) // 2] * 1e6
+    p99 = latencies[int(len(latencies) * 0.99)] * 1e6
+    mean = statistics.fmean(latencies) * 1e6
+    print(
+        f"{name:<6} mean {mean:8.1f} us  p50 {p50:8.1f} us  "
+        f"p99 {p99:8.1f} us  {rps:10.0f} req/s"
+    )
+
+
+async def main(args):
+    path = os.path.join(tempfile.mkdtemp(), "cat.sock")
+    tcp_server = AsyncTcpServer("127.0.0.1", args.port)
+    unix_server = AsyncUnixServer(path)
+    for server in (tcp_server, unix_server):
+        await server.start()
+        asyncio.create_task(_serve(server))
+
+    cases = [
+        ("tcp", AsyncTcpClient, ("127.0.0.1", args.port)),
+        ("unix", AsyncUnixClient, (path,)),
+    ]
+    for name, make_client, address in cases:
+        latencies = await _latency(make_client, address, args.requests)
+        rps = await _throughput(
+            make_client, address, args.clients, args.duration
+        )
+        _report(name, latencies, rps)
+
+    await asyncio.gather(tcp_server.stop(), unix_server.stop())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Loopback TCP vs unix socket listener benchmark"
+    )
+    parser.add_argument("--port", type=int, default=18000)
+    parser.add_argument("--requests", type=int, default=10000)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=3.0)
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,7 @@
 import os
 from functools import wraps
 
+from sqlalchemy import text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.ext.asyncio import (
     create_async_engine,
@@ -19,10 +20,32 @@ DB_URL = (
 )
 
 Base = declarative_base()
-engine = create_async_engine(DB_URL, echo=False)
-async_session = async_sessionmaker(
-    engine, class_=AsyncSession, expire_on_commit=False
-)
+# the engine and the session maker are created by the first session, so
+# importing the models doesn't load the driver
+_engine = None
+_session_maker = None
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(DB_URL, echo=False)
+    return _engine
+
+
+def async_session() -> AsyncSession:
+    global _session_maker
+    if _session_maker is None:
+        _session_maker = async_sessionmaker(
+            get_engine(), class_=AsyncSession, expire_on_commit=False
+        )
+    return _session_maker()
+
+
+async def warm_up():
+    # opens the first pooled connection ahead of the first request
+    async with get_engine().connect() as connection:
+        await connection.execute(text("SELECT 1"))
 
 
 def async_session_injector(func):
@@ -21,4 +21,12 @@ fmt = (
 
 logger.remove()
 logger.add(sys.stdout, format=fmt)
-logger.add(**logger_parameters, format=fmt)
+_file_sink = None
+
+
+def add_file_sink():
+    # called by the service entry point, the sink writes from a background
+    # thread so a slow disk doesn't stall the event loop
+    global _file_sink
+    if _file_sink is None:
+        _file_sink = logger.add(**logger_parameters, format=fmt, enqueue=True)
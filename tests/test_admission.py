@@ -0,0 +1,47 @@
+import asyncio
+
+from application.cat import CatService
+from application.network.protocol import BUSY
+from application.network.server import AsyncTcpConnection
+from application.utils.limits import AdmissionController
+
+
+def test_big_batch_is_one_pending_request():
+    admission = AdmissionController(max_pending=1024, max_queued=10000)
+    assert admission.admit("h", 0, 0, 2000)
+    assert not admission.admit("h", 1024, 0, 1)
+    assert not admission.admit("h", 0, 10000, 1)
+
+
+def test_rates_are_charged_per_action():
+    admission = AdmissionController(peer_rate=1, peer_burst=100)
+    assert not admission.admit("h", 0, 0, 2000)
+    assert admission.stats["peer_rate"] == 2000
+
+
+def test_big_batch_on_an_idle_service():
+    async def main():
+        service = CatService(
+            tcp_port=0,
+            udp_port=0,
+            unix_stream_path=None,
+            unix_dgram_path=None,
+        )
+        connection = AsyncTcpConnection("127.0.0.1", 1, None, None)
+        actions = [(f"u{i}", None) for i in range(2000)]
+
+        async def batch(actions, deadline=None):
+            return [True] * len(actions)
+
+        try:
+            result = await service._scheduled(
+                connection, batch, actions, cost=len(actions)
+            )
+        finally:
+            for server in service._servers:
+                server._sock.close()
+        assert result != BUSY
+        assert len(result) == 2000
+        assert connection.pending == 0
+
+    asyncio.run(main())
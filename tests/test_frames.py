@@ -0,0 +1,31 @@
+import asyncio
+
+from application.cat import _in_order
+
+
+def test_one_users_requests_keep_the_frame_order():
+    async def main():
+        running, log = set(), []
+
+        async def run(request):
+            user, n = request
+            assert user not in running
+            running.add(user)
+            # the later requests are faster, concurrency would reorder them
+            await asyncio.sleep(0.01 / (n + 1))
+            running.discard(user)
+            log.append(request)
+            return n
+
+        requests = [("a", 0), ("b", 0), ("a", 1), ("b", 1), ("a", 2)]
+        results = await _in_order(requests, lambda request: request[0], run)
+        assert results == [0, 0, 1, 1, 2]
+        assert [r for r in log if r[0] == "a"] == [
+            ("a", 0),
+            ("a", 1),
+            ("a", 2),
+        ]
+        # the users still run side by side
+        assert log.index(("b", 0)) < log.index(("a", 1))
+
+    asyncio.run(main())
@@ -0,0 +1,37 @@
+import asyncio
+
+from application.cat import Cat, History
+from application.utils.cruds import StatCRUD
+
+
+def test_stale_history_is_read_again():
+    cat = Cat(snapshot_path="")
+    cat._histories.put(1, History())
+    assert cat._cached_history(1) is not None
+    cat._histories.get(1).loaded_at -= cat._history_ttl + 1
+    assert cat._cached_history(1) is None
+
+
+def test_history_written_during_a_read_is_not_cached(monkeypatch):
+    async def main():
+        cat = Cat(snapshot_path="")
+        reading = asyncio.Event()
+        written = asyncio.Event()
+
+        async def read(*args, session):
+            reading.set()
+            await written.wait()
+            return {}
+
+        monkeypatch.setattr(StatCRUD, "get_summaries", read)
+        load = asyncio.create_task(cat._load_histories([1, 2], session=None))
+        await reading.wait()
+        with cat._adding_stats([1]):
+            cat._remember_pet(1, True)
+        written.set()
+        await load
+        assert 1 not in cat._histories
+        assert 2 in cat._histories
+        assert not cat._reading and not cat._writing and not cat._written
+
+    asyncio.run(main())